@@ -0,0 +1,108 @@
+"""
+Microbenchmark of ObjectId conversion on deeply nested cart documents.
+
+Compares the former post-processing path (full decode followed by a recursive
+Python walk) with decode-time conversion through the library codec options,
+and with lazy RawBSONDocument decoding where only a few fields are read.
+
+Usage:
+    python lab1/benchmarks/bench_objectid_decoding.py --documents 5000 --depth 4
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+import bson
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'library'))
+
+from bson_codecs import RAW_STRING_ID_CODEC_OPTIONS, STRING_ID_CODEC_OPTIONS, is_object_id_hex  # noqa: E402
+
+
+def convert_objectid_to_string(document):
+    """Recursive walk formerly applied to every retrieved document."""
+    for key, value in document.items():
+        if isinstance(value, ObjectId):
+            document[key] = str(value)
+        elif isinstance(value, dict):
+            convert_objectid_to_string(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    convert_objectid_to_string(item)
+
+
+def make_cart(depth, products_per_cart):
+    """Builds a cart whose product lines nest `depth` levels of references."""
+    def nested(level):
+        node = {'refId': ObjectId(), 'tags': [ObjectId(), ObjectId()], 'level': level}
+        if level < depth:
+            node['child'] = nested(level + 1)
+        return node
+
+    return {
+        '_id': ObjectId(),
+        'userId': ObjectId(),
+        'date': datetime(2024, 1, 15, 10, 0),
+        'products': [
+            {'productId': ObjectId(), 'quantity': i + 1, 'details': nested(1)}
+            for i in range(products_per_cart)
+        ],
+        'relatedCarts': [ObjectId() for _ in range(3)]
+    }
+
+
+def legacy_path(data):
+    documents = bson.decode_all(data)
+    for doc in documents:
+        convert_objectid_to_string(doc)
+    return documents
+
+
+def codec_path(data):
+    return bson.decode_all(data, STRING_ID_CODEC_OPTIONS)
+
+
+def lazy_path(data):
+    documents = bson.decode_all(data, RAW_STRING_ID_CODEC_OPTIONS)
+    return [(doc['_id'], doc['userId']) for doc in documents]
+
+
+def legacy_hex_check(value):
+    return len(value) == 24 and all(c in '0123456789abcdef' for c in value.lower())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=5000, help='Number of cart documents')
+    parser.add_argument('--depth', type=int, default=4, help='Nesting depth of each product line')
+    parser.add_argument('--products', type=int, default=5, help='Product lines per cart')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions (best is kept)')
+    args = parser.parse_args()
+
+    carts = [make_cart(args.depth, args.products) for _ in range(args.documents)]
+    data = b''.join(bson.encode(cart) for cart in carts)
+    print(f"{args.documents} carts, depth {args.depth}, {len(data) / 1024 / 1024:.1f} MiB of BSON")
+
+    baseline = min(timeit.repeat(lambda: legacy_path(data), number=1, repeat=args.repeat))
+    results = [
+        ('decode + recursive walk', baseline),
+        ('decode-time codec', min(timeit.repeat(lambda: codec_path(data), number=1, repeat=args.repeat))),
+        ('lazy RawBSONDocument (2 fields)', min(timeit.repeat(lambda: lazy_path(data), number=1, repeat=args.repeat))),
+    ]
+    for name, seconds in results:
+        print(f"  {name:<34} {seconds * 1000:9.1f} ms   x{baseline / seconds:5.2f}")
+
+    ids = [str(ObjectId()) for _ in range(100000)] + ['CART_1705312800'] * 10000
+    legacy = min(timeit.repeat(lambda: [legacy_hex_check(v) for v in ids], number=1, repeat=args.repeat))
+    regex = min(timeit.repeat(lambda: [is_object_id_hex(v) for v in ids], number=1, repeat=args.repeat))
+    print(f"ObjectId hex check on {len(ids)} ids")
+    print(f"  {'per-character all()':<34} {legacy * 1000:9.1f} ms   x{1:5.2f}")
+    print(f"  {'compiled regex':<34} {regex * 1000:9.1f} ms   x{legacy / regex:5.2f}")
+
+
+if __name__ == '__main__':
+    main()
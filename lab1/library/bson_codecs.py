@@ -0,0 +1,54 @@
+import json
+import re
+from collections.abc import Mapping
+from typing import Any
+
+from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from bson.raw_bson import RawBSONDocument
+
+
+# 24 hexadecimal characters, the string form of an ObjectId
+_OBJECT_ID_HEX = re.compile(r'[0-9a-fA-F]{24}')
+
+
+class ObjectIdToStringDecoder(TypeDecoder):
+    """Decodes every ObjectId, at any depth and inside lists, to its hex string."""
+
+    bson_type = ObjectId
+
+    def transform_bson(self, value: ObjectId) -> str:
+        return str(value)
+
+
+STRING_ID_TYPE_REGISTRY = TypeRegistry([ObjectIdToStringDecoder()])
+
+# Fully decoded documents with ObjectIds converted to strings while decoding
+STRING_ID_CODEC_OPTIONS = CodecOptions(type_registry=STRING_ID_TYPE_REGISTRY)
+
+# Lazily decoded documents: fields are only materialised when they are accessed
+RAW_STRING_ID_CODEC_OPTIONS = CodecOptions(
+    document_class=RawBSONDocument,
+    type_registry=STRING_ID_TYPE_REGISTRY
+)
+
+
+def get_codec_options(lazy: bool = False) -> CodecOptions:
+    """Returns the codec options used to read documents through the library."""
+    return RAW_STRING_ID_CODEC_OPTIONS if lazy else STRING_ID_CODEC_OPTIONS
+
+
+def is_object_id_hex(value: Any) -> bool:
+    """Checks whether a value is a 24-character hexadecimal ObjectId string."""
+    return isinstance(value, str) and _OBJECT_ID_HEX.fullmatch(value) is not None
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return dict(value)
+    return str(value)
+
+
+def documents_to_json(documents: Any) -> str:
+    """Serialises decoded or lazily decoded documents to a JSON string."""
+    return json.dumps(documents, default=_json_default)
@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+from robot.api import logger
+
+from memory_backend import MemoryClient, is_memory_uri
+
+
+class _PooledClient:
+    """A MongoClient shared by every alias connected with the same URI and options."""
+
+    def __init__(self, client: MongoClient, uri: str):
+        self.client = client
+        self.uri = uri
+        self.aliases = set()
+        self.last_used = time.monotonic()
+
+
+class MongoConnectionRegistry:
+    """
+    Registry of named MongoDB connections backed by shared, pooled clients.
+
+    Connecting twice with the same URI and pool options reuses the already-warm
+    client instead of paying TLS and SRV resolution again. Releasing an alias keeps
+    the client pooled until it has been unused for `idle_timeout` seconds.
+    Every client is created with the given pymongo `event_listeners`. URIs starting
+    with `memory://` get an in-process `MemoryClient` instead of a MongoClient.
+    """
+
+    def __init__(self, idle_timeout: float = 300, event_listeners: Optional[List] = None):
+        self.idle_timeout = float(idle_timeout)
+        self.event_listeners = list(event_listeners or [])
+        self._clients: Dict[Tuple, _PooledClient] = {}
+        self._aliases: Dict[str, Tuple] = {}
+        self._lock = threading.RLock()
+
+    def connect(self, alias: str, uri: str, **options) -> Tuple[MongoClient, bool]:
+        """
+        Binds an alias to a pooled client for the URI, creating it if needed.
+
+        Returns:
+            The client and whether an existing client was reused
+        """
+        key = (uri, tuple(sorted(options.items())))
+        with self._lock:
+            self.evict_idle()
+            if self._aliases.get(alias) not in (None, key):
+                self.release(alias)
+
+            pooled = self._clients.get(key)
+            reused = pooled is not None
+            if not reused:
+                if is_memory_uri(uri):
+                    client = MemoryClient(uri, **options)
+                else:
+                    client = MongoClient(uri, event_listeners=self.event_listeners, **options)
+                try:
+                    client.admin.command('ping')
+                except Exception:
+                    client.close()
+                    raise
+                pooled = _PooledClient(client, uri)
+                self._clients[key] = pooled
+
+            pooled.aliases.add(alias)
+            pooled.last_used = time.monotonic()
+            self._aliases[alias] = key
+            return pooled.client, reused
+
+    def get(self, alias: str) -> MongoClient:
+        """Returns the client bound to an alias."""
+        with self._lock:
+            key = self._aliases.get(alias)
+            if key is None:
+                raise ConnectionFailure(
+                    f"No MongoDB connection with alias '{alias}'. Use 'Connect To MongoDB' first."
+                )
+            pooled = self._clients[key]
+            pooled.last_used = time.monotonic()
+            return pooled.client
+
+    def has_alias(self, alias: str) -> bool:
+        """Checks whether an alias is bound to a client."""
+        return alias in self._aliases
+
+    def aliases(self) -> List[str]:
+        """Returns the aliases currently bound to a client."""
+        return list(self._aliases)
+
+    def release(self, alias: str, close: bool = False) -> bool:
+        """
+        Unbinds an alias. The client stays pooled for reuse unless `close` is True.
+
+        Returns:
+            True if the alias was bound, False otherwise
+        """
+        with self._lock:
+            key = self._aliases.pop(alias, None)
+            if key is None:
+                return False
+            pooled = self._clients[key]
+            pooled.aliases.discard(alias)
+            pooled.last_used = time.monotonic()
+            if close:
+                for other in list(pooled.aliases):
+                    self._aliases.pop(other, None)
+                self._close(key)
+            return True
+
+    def evict_idle(self) -> int:
+        """
+        Closes clients that no alias uses and that have been idle for too long.
+
+        Returns:
+            Number of clients closed
+        """
+        with self._lock:
+            now = time.monotonic()
+            expired = [
+                key for key, pooled in self._clients.items()
+                if not pooled.aliases and now - pooled.last_used >= self.idle_timeout
+            ]
+            for key in expired:
+                self._close(key)
+            return len(expired)
+
+    def close_all(self) -> None:
+        """Closes every pooled client and forgets all aliases."""
+        with self._lock:
+            for key in list(self._clients):
+                self._close(key)
+            self._aliases.clear()
+
+    def _close(self, key: Tuple) -> None:
+        pooled = self._clients.pop(key)
+        pooled.client.close()
+        logger.info(f"Closed pooled MongoDB client for {pooled.uri}")
@@ -0,0 +1,262 @@
+"""
+High-volume synthetic data generator for the fakeStoreDB collections.
+
+Produces schema-faithful products, users, carts and categories in batches with a
+seeded random generator, and streams each batch either into a MongoDB collection
+(unordered bulk inserts) or into JSONL / BSON files.
+
+Document ids are derived from the collection and the document index, so carts can
+reference any generated user or product without keeping ids in memory.
+
+Usage:
+    python lab1/library/fakestore_generator.py --uri mongodb://localhost:27017 \\
+        --database fakeStoreDB --products 1000000 --users 100000 --carts 2000000
+    python lab1/library/fakestore_generator.py --output-dir data --format bson --products 1000000
+"""
+import argparse
+import os
+import random
+import struct
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+import bson
+from bson import ObjectId
+from bson import json_util
+from pymongo import MongoClient
+
+
+COLLECTIONS = ('categories', 'products', 'users', 'carts')
+
+# One byte per collection inside generated ObjectIds
+_ID_TAGS = {'categories': 1, 'products': 2, 'users': 3, 'carts': 4}
+
+BASE_CATEGORIES = ["electronics", "jewelery", "men's clothing", "women's clothing"]
+_ADJECTIVES = ['Slim', 'Classic', 'Premium', 'Casual', 'Rugged', 'Compact', 'Wireless', 'Solid', 'Vintage', 'Ultra']
+_NOUNS = ['Backpack', 'Jacket', 'T-Shirt', 'Ring', 'Bracelet', 'Hard Drive', 'Monitor', 'Raincoat', 'Sweater', 'Bag']
+_FIRST_NAMES = ['john', 'david', 'kevin', 'don', 'derek', 'david', 'miriam', 'william', 'kate', 'jimmie']
+_LAST_NAMES = ['doe', 'morrison', 'ryan', 'romer', 'powell', 'russell', 'snyder', 'hopkins', 'hale', 'klein']
+_CITIES = ['kilcoole', 'cullman', 'san Antonio', 'el paso', 'fresno', 'mesa', 'miami beach', 'fort wayne']
+_STREETS = ['new road', 'Lovers Ln', 'Frances Ct', 'Hunters Creek Dr', 'adams St', 'prospect st', 'vally view ln']
+_DESCRIPTION_WORDS = ('your perfect pack for everyday use and walks in the forest stash your laptop up to '
+                      '15 inches in the padded sleeve slim fit lightweight long sleeve').split()
+
+_BASE_DATE = datetime(2020, 1, 1)
+
+
+def generated_id(collection: str, index: int, seed: int = 42) -> ObjectId:
+    """Returns the deterministic ObjectId of the index-th generated document of a collection."""
+    return ObjectId(struct.pack('>IBxxxI', seed & 0xFFFFFFFF, _ID_TAGS[collection], index))
+
+
+class FakeStoreGenerator:
+    """Generates batches of fakeStoreDB documents with a seeded random generator."""
+
+    def __init__(self, seed: int = 42, products: int = 0, users: int = 0, categories: int = 0):
+        self.seed = int(seed)
+        self.counts = {'products': int(products), 'users': int(users), 'categories': int(categories)}
+
+    def batch(self, collection: str, start: int, count: int) -> List[Dict]:
+        """Generates documents start..start+count-1 of a collection."""
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Unknown collection '{collection}'. Expected one of: {', '.join(COLLECTIONS)}")
+        # Seeding per batch keeps every batch reproducible on its own
+        rng = random.Random(f"{self.seed}:{collection}:{start}")
+        return getattr(self, f"_{collection}")(rng, start, count)
+
+    def iter_batches(self, collection: str, total: int, batch_size: int) -> Iterator[List[Dict]]:
+        """Yields the documents of a collection in batches of batch_size."""
+        for start in range(0, int(total), int(batch_size)):
+            yield self.batch(collection, start, min(int(batch_size), int(total) - start))
+
+    def _ids(self, collection: str, start: int, count: int) -> List[ObjectId]:
+        return [generated_id(collection, index, self.seed) for index in range(start, start + count)]
+
+    def _category_names(self) -> List[str]:
+        extra = max(self.counts['categories'] - len(BASE_CATEGORIES), 0)
+        return BASE_CATEGORIES + [f"category {index}" for index in range(extra)]
+
+    def _categories(self, rng: random.Random, start: int, count: int) -> List[Dict]:
+        names = self._category_names()
+        return [
+            {
+                '_id': _id,
+                'name': names[index % len(names)],
+                'description': f"All products in {names[index % len(names)]}",
+                'image': f"https://fakestoreapi.com/img/category/{index}.jpg"
+            }
+            for index, _id in zip(range(start, start + count), self._ids('categories', start, count))
+        ]
+
+    def _products(self, rng: random.Random, start: int, count: int) -> List[Dict]:
+        names = self._category_names()
+        adjectives = rng.choices(_ADJECTIVES, k=count)
+        nouns = rng.choices(_NOUNS, k=count)
+        categories = rng.choices(names, k=count)
+        prices = [round(rng.uniform(1, 1000), 2) for _ in range(count)]
+        rates = [round(rng.uniform(1, 5), 1) for _ in range(count)]
+        rating_counts = [rng.randint(0, 700) for _ in range(count)]
+        return [
+            {
+                '_id': _id,
+                'title': f"{adjectives[i]} {nouns[i]} {start + i}",
+                'price': prices[i],
+                'description': ' '.join(rng.choices(_DESCRIPTION_WORDS, k=12)),
+                'category': categories[i],
+                'image': f"https://fakestoreapi.com/img/{start + i}.jpg",
+                'rating': {'rate': rates[i], 'count': rating_counts[i]}
+            }
+            for i, _id in enumerate(self._ids('products', start, count))
+        ]
+
+    def _users(self, rng: random.Random, start: int, count: int) -> List[Dict]:
+        firstnames = rng.choices(_FIRST_NAMES, k=count)
+        lastnames = rng.choices(_LAST_NAMES, k=count)
+        cities = rng.choices(_CITIES, k=count)
+        streets = rng.choices(_STREETS, k=count)
+        return [
+            {
+                '_id': _id,
+                'email': f"{firstnames[i]}.{lastnames[i]}{start + i}@gmail.com",
+                'username': f"{firstnames[i][0]}{lastnames[i]}{start + i}",
+                'password': f"pw{rng.getrandbits(32):08x}",
+                'name': {'firstname': firstnames[i], 'lastname': lastnames[i]},
+                'address': {
+                    'city': cities[i],
+                    'street': streets[i],
+                    'number': rng.randint(1, 9999),
+                    'zipcode': f"{rng.randint(10000, 99999)}-{rng.randint(1000, 9999)}",
+                    'geolocation': {
+                        'lat': f"{rng.uniform(-90, 90):.4f}",
+                        'long': f"{rng.uniform(-180, 180):.4f}"
+                    }
+                },
+                'phone': f"1-{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+            }
+            for i, _id in enumerate(self._ids('users', start, count))
+        ]
+
+    def _carts(self, rng: random.Random, start: int, count: int) -> List[Dict]:
+        users, products = self.counts['users'], self.counts['products']
+        if not users or not products:
+            raise ValueError("Carts reference users and products: generate both with a non-zero count")
+        days = [rng.randrange(0, 1500) for _ in range(count)]
+        return [
+            {
+                '_id': _id,
+                'userId': generated_id('users', rng.randrange(users), self.seed),
+                'date': (_BASE_DATE + timedelta(days=days[i])).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'products': [
+                    {'productId': generated_id('products', rng.randrange(products), self.seed),
+                     'quantity': rng.randint(1, 10)}
+                    for _ in range(rng.randint(1, 5))
+                ]
+            }
+            for i, _id in enumerate(self._ids('carts', start, count))
+        ]
+
+
+def mongo_sink(collection) -> Callable[[List[Dict]], None]:
+    """Returns a sink inserting each batch with one unordered bulk insert."""
+    def write(batch: List[Dict]) -> None:
+        collection.insert_many(batch, ordered=False)
+    return write
+
+
+class FileSink:
+    """Appends each batch to a JSONL (MongoDB extended JSON) or BSON file."""
+
+    def __init__(self, path: str, file_format: str = 'jsonl'):
+        if file_format not in ('jsonl', 'bson'):
+            raise ValueError(f"Unsupported file format '{file_format}'. Expected jsonl or bson")
+        self.path = path
+        self.file_format = file_format
+        self._handle = open(path, 'wb')
+
+    def __call__(self, batch: List[Dict]) -> None:
+        if self.file_format == 'bson':
+            self._handle.write(b''.join(bson.encode(document) for document in batch))
+        else:
+            self._handle.write(''.join(json_util.dumps(document) + '\n' for document in batch).encode('utf-8'))
+
+    def close(self) -> None:
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def generate_collection(generator: FakeStoreGenerator, collection: str, total: int,
+                        sink: Callable[[List[Dict]], None], batch_size: int = 10000,
+                        progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Streams the generated documents of one collection into a sink.
+
+    Returns:
+        Number of documents, elapsed seconds and documents per second
+    """
+    started = time.perf_counter()
+    written = 0
+    for batch in generator.iter_batches(collection, total, batch_size):
+        sink(batch)
+        written += len(batch)
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(f"{collection}: {written}/{total} documents ({written / elapsed:,.0f} docs/s)")
+    seconds = time.perf_counter() - started
+    return {
+        'collection': collection,
+        'documents': written,
+        'seconds': round(seconds, 3),
+        'documents_per_second': round(written / seconds, 1) if seconds else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', help='MongoDB URI to insert into')
+    parser.add_argument('--database', default='fakeStoreDB', help='Database name')
+    parser.add_argument('--output-dir', help='Write <collection>.<format> files here instead of MongoDB')
+    parser.add_argument('--format', default='jsonl', choices=('jsonl', 'bson'), help='Output file format')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Documents per batch')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    for collection in COLLECTIONS:
+        parser.add_argument(f'--{collection}', type=int, default=0, help=f'Number of {collection}')
+    args = parser.parse_args()
+
+    if not args.uri and not args.output_dir:
+        parser.error('either --uri or --output-dir is required')
+
+    generator = FakeStoreGenerator(args.seed, args.products, args.users, args.categories)
+    client = None
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    else:
+        client = MongoClient(args.uri)
+
+    try:
+        for collection in COLLECTIONS:
+            total = getattr(args, collection)
+            if not total:
+                continue
+            if client is not None:
+                stats = generate_collection(generator, collection, total,
+                                            mongo_sink(client[args.database][collection]),
+                                            args.batch_size, print)
+            else:
+                path = os.path.join(args.output_dir, f"{collection}.{args.format}")
+                with FileSink(path, args.format) as sink:
+                    stats = generate_collection(generator, collection, total, sink, args.batch_size, print)
+            print(f"{collection}: {stats['documents']} documents in {stats['seconds']}s "
+                  f"({stats['documents_per_second']:,.0f} docs/s)")
+    finally:
+        if client is not None:
+            client.close()
+
+
+if __name__ == '__main__':
+    main()
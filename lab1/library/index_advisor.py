@@ -0,0 +1,205 @@
+import json
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Operators matched by an index equality bound; every other field operator is a range
+EQUALITY_OPERATORS = {'$eq', '$in', '$elemMatch', '$all'}
+
+# Plan nodes nest their children under these keys (classic and slot-based engines)
+_CHILD_STAGE_KEYS = ('inputStage', 'queryPlan', 'thenStage', 'elseStage', 'outerStage', 'innerStage')
+
+
+class QueryShapeAdvisor:
+    """
+    Records the distinct filter/sort shapes run by the library, explains each shape
+    once and suggests compound indexes for collection scans and poorly selective plans.
+
+    A shape is the filter with every value replaced by 1, so `{"price": {"$gt": 10}}`
+    and `{"price": {"$gt": 99}}` share one explain.
+    """
+
+    def __init__(self, ratio_threshold: float = 10.0):
+        self.ratio_threshold = float(ratio_threshold)
+        self._shapes: Dict[Tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shape(value: Any) -> Any:
+        """Returns a filter or sort with its values replaced by 1."""
+        if isinstance(value, dict):
+            return {key: QueryShapeAdvisor.shape(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            shapes = [QueryShapeAdvisor.shape(item) for item in value]
+            # $in/$nin lists of any length share a shape; $and/$or branches do not
+            if all(shape == 1 for shape in shapes):
+                return [1] if shapes else []
+            return shapes
+        return 1
+
+    def record(self, connection: Optional[str], database_name: str, collection_name: str,
+               operation: str, filter_query: Dict, sort: Optional[List[Tuple[str, int]]],
+               explainer: Callable[[], Dict]) -> None:
+        """
+        Counts one execution of a query and explains its shape the first time it is seen.
+
+        Args:
+            connection: Connection alias the query ran on
+            database_name: Name of the database
+            collection_name: Name of the collection
+            operation: Keyword operation (find, update, delete, count)
+            filter_query: Filter of the query
+            sort: Sort of the query as (field, direction) pairs, if any
+            explainer: Returns the executionStats explain of the query
+        """
+        sort = [tuple(item) for item in sort or []]
+        key = (connection, database_name, collection_name,
+               json.dumps(self.shape(filter_query), sort_keys=True),
+               json.dumps([field for field, _ in sort]))
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is not None:
+                entry['executions'] += 1
+                entry['operations'][operation] = entry['operations'].get(operation, 0) + 1
+                return
+            entry = {
+                'connection': connection,
+                'database': database_name,
+                'collection': collection_name,
+                'shape': self.shape(filter_query),
+                'sort': [list(item) for item in sort],
+                'executions': 1,
+                'operations': {operation: 1},
+            }
+            self._shapes[key] = entry
+
+        # Explained outside the lock: other threads only wait for new shapes of their own
+        try:
+            entry.update(self.analyse(explainer()))
+        except Exception as e:
+            entry['error'] = str(e)
+        entry['suggested_index'] = self.suggest_index(filter_query, sort) if entry.get('flagged') else None
+
+    def analyse(self, explain: Dict) -> Dict[str, Any]:
+        """Extracts the plan stages and examined/returned counters of an explain document."""
+        stats = explain.get('executionStats', {})
+        stages = self._plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        n_returned = int(stats.get('nReturned', 0))
+        docs_examined = int(stats.get('totalDocsExamined', 0))
+        ratio = docs_examined / max(n_returned, 1)
+
+        reasons = []
+        if 'COLLSCAN' in stages:
+            reasons.append('COLLSCAN')
+        if docs_examined and ratio > self.ratio_threshold:
+            reasons.append(f"docsExamined/nReturned ratio {ratio:.1f} above {self.ratio_threshold:g}")
+        return {
+            'stages': stages,
+            'n_returned': n_returned,
+            'docs_examined': docs_examined,
+            'keys_examined': int(stats.get('totalKeysExamined', 0)),
+            'execution_time_ms': int(stats.get('executionTimeMillis', 0)),
+            'ratio': round(ratio, 2),
+            'flagged': bool(reasons),
+            'reasons': reasons,
+        }
+
+    @staticmethod
+    def suggest_index(filter_query: Dict, sort: Optional[List[Tuple[str, int]]] = None) -> Optional[List[List]]:
+        """
+        Suggests a compound index following the equality, sort, range rule.
+
+        Returns:
+            Index keys as [field, direction] pairs, or None when no index would help
+        """
+        equality: List[str] = []
+        ranges: List[str] = []
+
+        def visit(query: Dict) -> None:
+            for field, condition in query.items():
+                if field == '$and':
+                    for branch in condition:
+                        visit(branch)
+                elif field.startswith('$'):
+                    # $or, $expr, $text... have no single compound index shape
+                    continue
+                elif (isinstance(condition, dict) and condition
+                      and all(operator.startswith('$') for operator in condition)):
+                    (equality if set(condition) <= EQUALITY_OPERATORS else ranges).append(field)
+                else:
+                    equality.append(field)
+
+        visit(filter_query or {})
+        keys: List[List] = []
+        for field, direction in ([(field, 1) for field in equality] + list(sort or [])
+                                 + [(field, 1) for field in ranges]):
+            if field not in (key[0] for key in keys):
+                keys.append([field, int(direction)])
+
+        if not keys or keys == [['_id', 1]]:
+            return None
+        return keys
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Builds the report of every recorded shape and the deduplicated index suggestions.
+
+        A suggestion whose keys prefix another suggestion on the same collection is
+        dropped, since the longer index serves both queries.
+        """
+        with self._lock:
+            shapes = [dict(entry) for entry in self._shapes.values()]
+
+        candidates: Dict[Tuple, Dict[str, Any]] = {}
+        for entry in shapes:
+            keys = entry.get('suggested_index')
+            if not keys:
+                continue
+            key = (entry['connection'], entry['database'], entry['collection'], json.dumps(keys))
+            suggestion = candidates.setdefault(key, {
+                'connection': entry['connection'],
+                'database': entry['database'],
+                'collection': entry['collection'],
+                'keys': keys,
+                'shapes': 0,
+                'executions': 0,
+            })
+            suggestion['shapes'] += 1
+            suggestion['executions'] += entry['executions']
+
+        suggestions = [
+            suggestion for suggestion in candidates.values()
+            if not any(
+                other is not suggestion
+                and other['collection'] == suggestion['collection']
+                and other['database'] == suggestion['database']
+                and other['connection'] == suggestion['connection']
+                and len(other['keys']) > len(suggestion['keys'])
+                and other['keys'][:len(suggestion['keys'])] == suggestion['keys']
+                for other in candidates.values()
+            )
+        ]
+        shapes.sort(key=lambda entry: (not entry.get('flagged'), -entry.get('docs_examined', 0)))
+        suggestions.sort(key=lambda suggestion: -suggestion['executions'])
+        return {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'ratio_threshold': self.ratio_threshold,
+            'shapes': shapes,
+            'flagged': sum(1 for entry in shapes if entry.get('flagged')),
+            'suggested_indexes': suggestions,
+        }
+
+    def _plan_stages(self, plan: Dict) -> List[str]:
+        """Returns the stage names of a winning plan, root first."""
+        stages = []
+        pending = [plan]
+        while pending:
+            node = pending.pop(0)
+            if not isinstance(node, dict):
+                continue
+            if 'stage' in node:
+                stages.append(node['stage'])
+            pending.extend(node[key] for key in _CHILD_STAGE_KEYS if key in node)
+            pending.extend(node.get('inputStages', []))
+        return stages
@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+
+# Sub-bucket bits of the histogram: every value is kept within 1/128 (< 0.8%) of its magnitude
+_PRECISION_BITS = 7
+_SUB_BUCKET_MASK = (1 << _PRECISION_BITS) - 1
+
+# Commands that are not part of a keyword's work
+_IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue'}
+
+
+class LatencyHistogram:
+    """
+    Streaming log-linear histogram of microsecond latencies, in the spirit of HdrHistogram.
+
+    Values below 128 microseconds are counted exactly; larger values share a bucket
+    with values of the same power of two that agree on their 7 leading bits, so memory
+    grows with the latency range, not with the number of samples.
+    """
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, micros: int) -> None:
+        micros = max(int(micros), 0)
+        shift = max(micros.bit_length() - _PRECISION_BITS, 0)
+        index = (shift << _PRECISION_BITS) + (micros >> shift)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.min = micros if not self.count else min(self.min, micros)
+        self.max = max(self.max, micros)
+        self.count += 1
+        self.total += micros
+
+    def percentile(self, percent: float) -> int:
+        """Returns the value below which `percent` % of the samples fall, in microseconds."""
+        if not self.count:
+            return 0
+        rank = max(int(self.count * float(percent) / 100 + 0.5), 1)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                shift = index >> _PRECISION_BITS
+                lower = (index & _SUB_BUCKET_MASK) << shift
+                return min(lower + ((1 << shift) - 1) // 2, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """Returns count, min, mean, percentiles and max, in milliseconds."""
+        return {
+            'count': self.count,
+            'min_ms': self.min / 1000,
+            'mean_ms': round(self.total / self.count / 1000, 3) if self.count else 0.0,
+            'p50_ms': self.percentile(50) / 1000,
+            'p90_ms': self.percentile(90) / 1000,
+            'p99_ms': self.percentile(99) / 1000,
+            'p999_ms': self.percentile(99.9) / 1000,
+            'max_ms': self.max / 1000,
+        }
+
+
+class LatencyRecorder(monitoring.CommandListener):
+    """
+    Times keywords end to end and, through pymongo command monitoring, the server
+    round trips they made.
+
+    Histograms are kept per (keyword, collection). The collection is taken from the
+    first command the keyword sent. Keywords slower than `slow_threshold_ms` are
+    kept in a slow-operation log, and appended to `slow_log_path` as JSON lines
+    when one is given.
+    """
+
+    def __init__(self, slow_threshold_ms: float = 100, slow_log_path: Optional[str] = None,
+                 slow_log_size: int = 1000):
+        self.enabled = False
+        self.slow_threshold_ms = float(slow_threshold_ms)
+        self.slow_log_path = slow_log_path
+        self.slow_operations: deque = deque(maxlen=int(slow_log_size))
+        self._histograms: Dict[Tuple[str, str], Dict[str, LatencyHistogram]] = {}
+        self._active: Optional[Dict[str, Any]] = None
+        self._pending: Dict[Tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, slow_threshold_ms: float = 100, slow_log_path: Optional[str] = None) -> None:
+        self.slow_threshold_ms = float(slow_threshold_ms)
+        self.slow_log_path = slow_log_path
+        self.enabled = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self.slow_operations.clear()
+
+    # Keyword timing
+
+    def start(self, keyword_name: str) -> None:
+        if not self.enabled:
+            return
+        self._active = {'keyword': keyword_name, 'collection': None, 'server_micros': 0,
+                        'commands': 0, 'started': time.perf_counter()}
+
+    def end(self, failed: bool = False) -> None:
+        active, self._active = self._active, None
+        if active is None:
+            return
+        total_micros = int((time.perf_counter() - active['started']) * 1_000_000)
+        key = (active['keyword'], active['collection'] or '-')
+        with self._lock:
+            histograms = self._histograms.setdefault(key, {
+                'total': LatencyHistogram(), 'server': LatencyHistogram(), 'failures': 0
+            })
+            histograms['total'].record(total_micros)
+            if active['commands']:
+                histograms['server'].record(active['server_micros'])
+            if failed:
+                histograms['failures'] += 1
+
+        if total_micros / 1000 >= self.slow_threshold_ms:
+            self._log_slow_operation(active, total_micros, failed)
+
+    # pymongo command monitoring
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        active = self._active
+        if active is None or event.command_name in _IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event)
+
+    def _finished(self, event) -> None:
+        active = self._active
+        if active is None or event.command_name in _IGNORED_COMMANDS:
+            return
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), None)
+            # Commands of parallel workers add up to the keyword that spawned them
+            active['server_micros'] += event.duration_micros
+            active['commands'] += 1
+            if active['collection'] is None and collection:
+                active['collection'] = collection
+
+    # Reporting
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns the latency summary of every (keyword, collection) pair.
+
+        `total` covers the whole keyword (argument parsing, server round trips and
+        result conversion); `server` only the time spent waiting for command replies.
+        """
+        with self._lock:
+            keywords = {
+                f"{keyword_name} | {collection}": {
+                    'keyword': keyword_name,
+                    'collection': collection,
+                    'failures': histograms['failures'],
+                    'total': histograms['total'].summary(),
+                    'server': histograms['server'].summary(),
+                }
+                for (keyword_name, collection), histograms in sorted(self._histograms.items())
+            }
+            return {
+                'generated_at': datetime.now().isoformat(timespec='seconds'),
+                'slow_threshold_ms': self.slow_threshold_ms,
+                'keywords': keywords,
+                'slow_operations': list(self.slow_operations),
+            }
+
+    def export(self, path: str) -> Dict[str, Any]:
+        """Writes the summary to a JSON file and returns it."""
+        summary = self.summary()
+        with open(path, 'w', encoding='utf-8') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+        return summary
+
+    def _log_slow_operation(self, active: Dict[str, Any], total_micros: int, failed: bool) -> None:
+        entry = {
+            'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+            'keyword': active['keyword'],
+            'collection': active['collection'],
+            'total_ms': total_micros / 1000,
+            'server_ms': active['server_micros'] / 1000,
+            'commands': active['commands'],
+            'failed': failed,
+        }
+        with self._lock:
+            self.slow_operations.append(entry)
+            if self.slow_log_path:
+                with open(self.slow_log_path, 'a', encoding='utf-8') as slow_log:
+                    slow_log.write(json.dumps(entry) + '\n')
@@ -0,0 +1,1784 @@
+"""
+In-process MongoDB engine used by CustomMongoDBLibrary for `memory://` URIs.
+
+It implements the part of the pymongo client, database, collection and cursor API
+used by the library: filters with the common query operators, projections, sort,
+skip and limit, update operators, upserts, bulk writes, unique and compound
+secondary indexes, `explain` and the basic aggregation stages. Documents go
+through a BSON round trip on the way in and out, so stored documents never share
+state with the caller and the database codec options (ObjectId to string, raw
+BSON) apply exactly as with a real server.
+
+Secondary indexes are real: an equality or `$in` lookup on an index prefix, or a
+range on its first unbounded field, only visits the matching index entries.
+
+Every client connected to the same `memory://<name>` URI shares the same data for
+the lifetime of the process.
+"""
+import copy
+import itertools
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from urllib.parse import urlsplit
+
+import bson
+from bson import ObjectId
+from bson.binary import Binary
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+MEMORY_SCHEME = 'memory://'
+
+_STORES: Dict[str, '_Store'] = {}
+_STORES_LOCK = threading.Lock()
+
+# Marks a path that does not exist, as opposed to one holding null
+_MISSING = object()
+
+_RANGE_OPERATORS = {'$gt', '$gte', '$lt', '$lte'}
+
+_REGEX_FLAGS = {'i': re.IGNORECASE, 'm': re.MULTILINE, 's': re.DOTALL, 'x': re.VERBOSE}
+
+_TYPE_ALIASES = {
+    'double': float, 'string': str, 'object': Mapping, 'array': list, 'binData': (bytes, Binary),
+    'objectId': ObjectId, 'bool': bool, 'date': datetime, 'null': type(None), 'regex': (Regex, re.Pattern),
+    'int': int, 'long': int, 'decimal': Decimal128, 'timestamp': Timestamp,
+}
+
+
+def is_memory_uri(uri: str) -> bool:
+    """Checks whether a connection URI selects the in-process engine."""
+    return uri.startswith(MEMORY_SCHEME)
+
+
+# Value ordering and matching
+
+def _sort_key(value: Any) -> Tuple:
+    """Returns a key ordering values like MongoDB's BSON comparison order."""
+    if value is None:
+        return (1,)
+    if isinstance(value, bool):
+        return (8, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, Decimal128):
+        return (2, value.to_decimal())
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, Mapping):
+        return (4, tuple((key, _sort_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (5, tuple(_sort_key(item) for item in value))
+    if isinstance(value, (bytes, Binary)):
+        return (6, bytes(value))
+    if isinstance(value, ObjectId):
+        return (7, value.binary)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return (9, value)
+    if isinstance(value, Timestamp):
+        return (10, (value.time, value.inc))
+    if isinstance(value, (Regex, re.Pattern)):
+        return (11, (value.pattern, int(value.flags)))
+    if isinstance(value, MinKey):
+        return (0,)
+    if isinstance(value, MaxKey):
+        return (12,)
+    return (13, str(value))
+
+
+def _equal(left: Any, right: Any) -> bool:
+    return _sort_key(left) == _sort_key(right)
+
+
+def _resolve(value: Any, parts: Sequence[str]) -> List[Any]:
+    """Returns every value reached by a dotted path, descending into arrays of documents."""
+    if not parts:
+        return [value]
+    if isinstance(value, Mapping):
+        if parts[0] in value:
+            return _resolve(value[parts[0]], parts[1:])
+        return []
+    if isinstance(value, list):
+        found = []
+        if parts[0].isdigit() and int(parts[0]) < len(value):
+            found.extend(_resolve(value[int(parts[0])], parts[1:]))
+        for item in value:
+            if isinstance(item, Mapping):
+                found.extend(_resolve(item, parts))
+        return found
+    return []
+
+
+def _candidates(document: Mapping, path: str) -> Tuple[List[Any], List[Any]]:
+    """Returns the values of a path, and the same values with arrays also expanded."""
+    values = _resolve(document, path.split('.'))
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return values, expanded
+
+
+def _compile_regex(pattern: Any, options: str = '') -> re.Pattern:
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    flags = 0
+    for option in options or '':
+        flags |= _REGEX_FLAGS.get(option, 0)
+    try:
+        return re.compile(pattern, flags)
+    except re.error as e:
+        raise OperationFailure(f"Regular expression is invalid: {e}", code=51091)
+
+
+def _regex_match(values: List[Any], regex: re.Pattern) -> bool:
+    return any(isinstance(value, str) and regex.search(value) for value in values)
+
+
+def _value_matches(expanded: List[Any], target: Any) -> bool:
+    """Equality as used by queries: a regex target matches strings, null matches a missing field."""
+    if isinstance(target, (re.Pattern, Regex)):
+        return _regex_match(expanded, _compile_regex(target))
+    if target is None and not expanded:
+        return True
+    return any(_equal(value, target) for value in expanded)
+
+
+def matches(document: Mapping, query: Optional[Mapping]) -> bool:
+    """Checks whether a document matches a query filter."""
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(document, branch) for branch in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, branch) for branch in condition):
+                return False
+        elif key == '$expr':
+            if not _truthy(evaluate(condition, document)):
+                return False
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        elif not _match_field(document, key, condition):
+            return False
+    return True
+
+
+def _is_operator_document(condition: Any) -> bool:
+    return isinstance(condition, Mapping) and bool(condition) and all(
+        str(key).startswith('$') for key in condition
+    )
+
+
+def _match_field(document: Mapping, path: str, condition: Any) -> bool:
+    values, expanded = _candidates(document, path)
+    if not _is_operator_document(condition):
+        return _value_matches(expanded, condition)
+    return all(
+        _match_operator(document, path, values, expanded, operator, argument, condition)
+        for operator, argument in condition.items()
+    )
+
+
+def _match_operator(document: Mapping, path: str, values: List[Any], expanded: List[Any],
+                    operator: str, argument: Any, condition: Mapping) -> bool:
+    if operator == '$eq':
+        return _value_matches(expanded, argument)
+    if operator == '$ne':
+        return not _value_matches(expanded, argument)
+    if operator in _RANGE_OPERATORS:
+        bound = _sort_key(argument)
+        for value in expanded:
+            key = _sort_key(value)
+            if key[0] != bound[0]:
+                continue
+            if ((operator == '$gt' and key > bound) or (operator == '$gte' and key >= bound)
+                    or (operator == '$lt' and key < bound) or (operator == '$lte' and key <= bound)):
+                return True
+        return False
+    if operator == '$in':
+        return any(_value_matches(expanded, item) for item in argument)
+    if operator == '$nin':
+        return not any(_value_matches(expanded, item) for item in argument)
+    if operator == '$exists':
+        return bool(values) == bool(argument)
+    if operator == '$regex':
+        return _regex_match(expanded, _compile_regex(argument, condition.get('$options', '')))
+    if operator == '$options':
+        return True
+    if operator == '$not':
+        if isinstance(argument, (re.Pattern, Regex)):
+            return not _regex_match(expanded, _compile_regex(argument))
+        return not _match_field(document, path, argument)
+    if operator == '$size':
+        return any(isinstance(value, list) and len(value) == int(argument) for value in values)
+    if operator == '$all':
+        return bool(argument) and all(_value_matches(expanded, item) for item in argument)
+    if operator == '$elemMatch':
+        for value in values:
+            if not isinstance(value, list):
+                continue
+            for item in value:
+                if _is_operator_document(argument):
+                    if _match_field({'item': item}, 'item', argument):
+                        return True
+                elif isinstance(item, Mapping) and matches(item, argument):
+                    return True
+        return False
+    if operator == '$type':
+        aliases = argument if isinstance(argument, list) else [argument]
+        for alias in aliases:
+            if alias == 'number':
+                if any(isinstance(v, (int, float, Decimal128)) and not isinstance(v, bool) for v in expanded):
+                    return True
+                continue
+            expected = _TYPE_ALIASES.get(alias)
+            if expected is None:
+                raise OperationFailure(f"Unknown type name alias: {alias}", code=2)
+            for value in (expanded if alias != 'array' else values):
+                if alias in ('int', 'long', 'double') and isinstance(value, bool):
+                    continue
+                if isinstance(value, expected):
+                    return True
+        return False
+    if operator == '$mod':
+        divisor, remainder = argument
+        return any(isinstance(v, (int, float)) and not isinstance(v, bool) and v % divisor == remainder
+                   for v in expanded)
+    raise OperationFailure(f"unknown operator: {operator}", code=2)
+
+
+# Projection, sort and paths
+
+def _get_path(document: Mapping, path: str, default: Any = None) -> Any:
+    value: Any = document
+    for part in path.split('.'):
+        if isinstance(value, Mapping) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, list):
+            value = [item[part] for item in value if isinstance(item, Mapping) and part in item]
+        else:
+            return default
+    return value
+
+
+def _set_path(document: Dict, path: str, value: Any) -> None:
+    parts = path.split('.')
+    target: Any = document
+    for index, part in enumerate(parts):
+        last = index == len(parts) - 1
+        if part == '$' or part.startswith('$['):
+            raise OperationFailure(
+                f"The positional operator in '{path}' is not supported by the memory:// backend", code=2
+            )
+        if isinstance(target, list):
+            if not part.isdigit():
+                raise OperationFailure(f"Cannot create field '{part}' in element {{{parts[index - 1]}: [...]}}",
+                                       code=28)
+            position = int(part)
+            while len(target) <= position:
+                target.append(None)
+            if last:
+                target[position] = value
+            else:
+                if not isinstance(target[position], (Mapping, list)):
+                    target[position] = {}
+                target = target[position]
+        elif isinstance(target, Mapping):
+            if last:
+                target[part] = value
+            else:
+                if part not in target or target[part] is None:
+                    target[part] = {}
+                elif not isinstance(target[part], (Mapping, list)):
+                    raise OperationFailure(
+                        f"Cannot create field '{parts[index + 1]}' in element {{{part}: {target[part]!r}}}",
+                        code=28
+                    )
+                target = target[part]
+        else:
+            raise OperationFailure(f"Cannot create field '{part}' in element {target!r}", code=28)
+
+
+def _unset_path(document: Dict, path: str) -> bool:
+    parts = path.split('.')
+    target: Any = document
+    for part in parts[:-1]:
+        if isinstance(target, Mapping) and part in target:
+            target = target[part]
+        elif isinstance(target, list) and part.isdigit() and int(part) < len(target):
+            target = target[int(part)]
+        else:
+            return False
+    if isinstance(target, Mapping) and parts[-1] in target:
+        del target[parts[-1]]
+        return True
+    if isinstance(target, list) and parts[-1].isdigit() and int(parts[-1]) < len(target):
+        target[int(parts[-1])] = None
+        return True
+    return False
+
+
+def _has_path(document: Mapping, path: str) -> bool:
+    return bool(_resolve(document, path.split('.')))
+
+
+def project(document: Mapping, projection: Any) -> Dict:
+    """Applies an inclusion or exclusion projection to a document."""
+    if not projection:
+        return dict(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = bool(projection.get('_id', True))
+    fields = {key: value for key, value in projection.items() if key != '_id'}
+    computed = {key: value for key, value in fields.items()
+                if not isinstance(value, (bool, int, float))}
+    inclusions = [key for key, value in fields.items() if key not in computed and value]
+    exclusions = [key for key, value in fields.items() if key not in computed and not value]
+    if (inclusions or computed) and exclusions:
+        raise OperationFailure(
+            f"Cannot do exclusion on field {exclusions[0]} in inclusion projection", code=31254
+        )
+
+    if inclusions or computed:
+        projected: Dict = {}
+        if include_id and '_id' in document:
+            projected['_id'] = document['_id']
+        for path in inclusions:
+            _copy_path(document, projected, path.split('.'))
+        for path, expression in computed.items():
+            _set_path(projected, path, evaluate(expression, document))
+        return projected
+
+    projected = copy.deepcopy(dict(document))
+    for path in exclusions:
+        _remove_everywhere(projected, path.split('.'))
+    if not include_id:
+        projected.pop('_id', None)
+    return projected
+
+
+def _copy_path(source: Any, target: Dict, parts: List[str]) -> None:
+    key = parts[0]
+    if not isinstance(source, Mapping) or key not in source:
+        return
+    value = source[key]
+    if len(parts) == 1:
+        target[key] = copy.deepcopy(value)
+    elif isinstance(value, Mapping):
+        _copy_path(value, target.setdefault(key, {}), parts[1:])
+    elif isinstance(value, list):
+        items = target.setdefault(key, [{} for _ in value] if not isinstance(target.get(key), list) else None)
+        for item, projected in zip(value, items):
+            if isinstance(item, Mapping):
+                _copy_path(item, projected, parts[1:])
+        target[key] = [item for item, original in zip(items, value) if isinstance(original, Mapping)]
+
+
+def _remove_everywhere(value: Any, parts: List[str]) -> None:
+    if isinstance(value, list):
+        for item in value:
+            _remove_everywhere(item, parts)
+    elif isinstance(value, Mapping):
+        if len(parts) == 1:
+            value.pop(parts[0], None)
+        elif parts[0] in value:
+            _remove_everywhere(value[parts[0]], parts[1:])
+
+
+def _normalise_sort(sort: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if sort is None:
+        return []
+    if isinstance(sort, str):
+        return [(sort, int(direction or 1))]
+    if isinstance(sort, Mapping):
+        return [(field, int(order)) for field, order in sort.items()]
+    return [(field, int(order)) for field, order in sort]
+
+
+def _sort_documents(documents: List[Mapping], sort: List[Tuple[str, int]]) -> List[Mapping]:
+    # Stable sorts from the least significant key reproduce a compound sort
+    for field, direction in reversed(sort):
+        def key(document, field=field, direction=direction):
+            values = _resolve(document, field.split('.'))
+            expanded = [item for value in values for item in (value if isinstance(value, list) else [value])]
+            if not expanded:
+                return (1,)
+            keys = [_sort_key(value) for value in expanded]
+            return min(keys) if direction > 0 else max(keys)
+        documents = sorted(documents, key=key, reverse=direction < 0)
+    return documents
+
+
+# Updates
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def apply_update(document: Dict, update: Mapping, inserting: bool = False) -> None:
+    """Applies update operators to a document in place."""
+    for operator, fields in update.items():
+        if not isinstance(fields, Mapping):
+            raise OperationFailure(f"Modifiers operate on fields but we found type "
+                                   f"{type(fields).__name__} instead", code=9)
+        for path, argument in fields.items():
+            if path == '_id' or path.startswith('_id.'):
+                if operator in ('$set', '$setOnInsert') and _equal(_get_path(document, path), argument):
+                    continue
+                if not inserting or operator not in ('$set', '$setOnInsert'):
+                    raise OperationFailure(
+                        "Performing an update on the path '_id' would modify the immutable field '_id'",
+                        code=66
+                    )
+            _apply_operator(document, operator, path, argument, inserting)
+
+
+def _apply_operator(document: Dict, operator: str, path: str, argument: Any, inserting: bool) -> None:
+    current = _get_path(document, path, _MISSING)
+    if operator == '$set':
+        _set_path(document, path, copy.deepcopy(argument))
+    elif operator == '$setOnInsert':
+        if inserting:
+            _set_path(document, path, copy.deepcopy(argument))
+    elif operator == '$unset':
+        _unset_path(document, path)
+    elif operator in ('$inc', '$mul'):
+        if not _is_number(argument):
+            raise OperationFailure(f"Cannot {operator[1:]} with non-numeric argument: {{{path}: {argument!r}}}",
+                                   code=14)
+        if current is _MISSING:
+            _set_path(document, path, argument if operator == '$inc' else argument * 0)
+        elif not _is_number(current):
+            raise OperationFailure(f"Cannot apply {operator} to a value of non-numeric type. "
+                                   f"{{{path}: {current!r}}} has the field of non-numeric type", code=14)
+        else:
+            _set_path(document, path, current + argument if operator == '$inc' else current * argument)
+    elif operator in ('$min', '$max'):
+        if current is _MISSING or (
+            (_sort_key(argument) < _sort_key(current)) == (operator == '$min')
+            and not _equal(argument, current)
+        ):
+            _set_path(document, path, copy.deepcopy(argument))
+    elif operator in ('$push', '$addToSet'):
+        values = list(argument['$each']) if _is_operator_document(argument) and '$each' in argument else [argument]
+        if current is _MISSING:
+            current = []
+            _set_path(document, path, current)
+        elif not isinstance(current, list):
+            raise OperationFailure(f"The field '{path}' must be an array but is of type "
+                                   f"{type(current).__name__}", code=2)
+        if operator == '$push':
+            position = len(current)
+            if _is_operator_document(argument) and '$position' in argument:
+                # A negative position counts from the end of the array
+                position = int(argument['$position'])
+                position = min(position, len(current)) if position >= 0 else max(len(current) + position, 0)
+            current[position:position] = copy.deepcopy(values)
+        else:
+            for value in copy.deepcopy(values):
+                if not any(_equal(value, item) for item in current):
+                    current.append(value)
+        if operator == '$push' and _is_operator_document(argument):
+            if '$sort' in argument:
+                order = argument['$sort']
+                if isinstance(order, Mapping):
+                    current[:] = _sort_documents(current, _normalise_sort(order))
+                else:
+                    current.sort(key=_sort_key, reverse=int(order) < 0)
+            if '$slice' in argument:
+                limit = int(argument['$slice'])
+                current[:] = current[:limit] if limit >= 0 else current[limit:]
+    elif operator in ('$pull', '$pullAll'):
+        if isinstance(current, list):
+            if operator == '$pullAll':
+                current[:] = [item for item in current if not any(_equal(item, value) for value in argument)]
+            elif _is_operator_document(argument):
+                current[:] = [item for item in current if not _match_field({'item': item}, 'item', argument)]
+            elif isinstance(argument, Mapping):
+                current[:] = [item for item in current
+                              if not (isinstance(item, Mapping) and matches(item, argument))]
+            else:
+                current[:] = [item for item in current if not _equal(item, argument)]
+    elif operator == '$pop':
+        if isinstance(current, list) and current:
+            current.pop(0 if int(argument) < 0 else -1)
+    elif operator == '$rename':
+        if current is not _MISSING:
+            _unset_path(document, path)
+            _set_path(document, argument, current)
+    elif operator == '$currentDate':
+        _set_path(document, path, datetime.now(timezone.utc).replace(tzinfo=None))
+    else:
+        raise OperationFailure(f"Unknown modifier: {operator}", code=9)
+
+
+def _upsert_seed(query: Mapping) -> Dict:
+    """Returns the document an upsert starts from: the equality fields of the filter."""
+    seed: Dict = {}
+    for key, condition in query.items():
+        if key == '$and':
+            for branch in condition:
+                for path, value in _upsert_seed(branch).items():
+                    _set_path(seed, path, value)
+        elif key.startswith('$'):
+            continue
+        elif _is_operator_document(condition):
+            if '$eq' in condition:
+                _set_path(seed, key, copy.deepcopy(condition['$eq']))
+        elif not isinstance(condition, (re.Pattern, Regex)):
+            _set_path(seed, key, copy.deepcopy(condition))
+    return seed
+
+
+# Aggregation expressions
+
+def _truthy(value: Any) -> bool:
+    return value not in (None, False, 0) and value is not _MISSING
+
+
+def evaluate(expression: Any, document: Mapping) -> Any:
+    """Evaluates an aggregation expression against a document."""
+    if isinstance(expression, str):
+        if expression.startswith('$$'):
+            name, _, rest = expression[2:].partition('.')
+            if name in ('ROOT', 'CURRENT'):
+                return _get_path(document, rest) if rest else document
+            raise OperationFailure(f"Use of undefined variable: {name}", code=17276)
+        if expression.startswith('$'):
+            return _get_path(document, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [evaluate(item, document) for item in expression]
+    if isinstance(expression, Mapping):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+            if operator.startswith('$'):
+                return _evaluate_operator(operator, argument, document)
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    return expression
+
+
+def _arguments(argument: Any, document: Mapping) -> List[Any]:
+    if isinstance(argument, list):
+        return [evaluate(item, document) for item in argument]
+    return [evaluate(argument, document)]
+
+
+def _evaluate_operator(operator: str, argument: Any, document: Mapping) -> Any:
+    if operator == '$literal':
+        return argument
+    if operator == '$cond':
+        if isinstance(argument, Mapping):
+            condition, then, otherwise = argument['if'], argument['then'], argument['else']
+        else:
+            condition, then, otherwise = argument
+        return evaluate(then if _truthy(evaluate(condition, document)) else otherwise, document)
+    if operator == '$ifNull':
+        values = _arguments(argument, document)
+        return next((value for value in values[:-1] if value is not None), values[-1])
+
+    values = _arguments(argument, document)
+    if operator in ('$sum', '$avg', '$min', '$max') and len(values) == 1 and isinstance(values[0], list):
+        values = values[0]
+    numbers = [value for value in values if _is_number(value)]
+    if operator == '$sum':
+        return sum(numbers)
+    if operator == '$avg':
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator in ('$min', '$max'):
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        return (min if operator == '$min' else max)(present, key=_sort_key)
+    if operator in ('$add', '$multiply'):
+        if any(value is None for value in values):
+            return None
+        result = values[0]
+        for value in values[1:]:
+            result = result + value if operator == '$add' else result * value
+        return result
+    if operator in ('$subtract', '$divide', '$mod'):
+        left, right = values
+        if left is None or right is None:
+            return None
+        if operator == '$subtract':
+            return left - right
+        if operator == '$divide':
+            return left / right
+        return left % right
+    if operator == '$abs':
+        return None if values[0] is None else abs(values[0])
+    if operator == '$round':
+        return None if values[0] is None else round(values[0], int(values[1]) if len(values) > 1 else 0)
+    if operator == '$concat':
+        return None if any(value is None for value in values) else ''.join(values)
+    if operator == '$toUpper':
+        return str(values[0] or '').upper()
+    if operator == '$toLower':
+        return str(values[0] or '').lower()
+    if operator == '$toString':
+        return None if values[0] is None else str(values[0])
+    if operator == '$size':
+        if not isinstance(values[0], list):
+            raise OperationFailure("The argument to $size must be an array", code=17124)
+        return len(values[0])
+    if operator == '$arrayElemAt':
+        array, index = values
+        return array[index] if isinstance(array, list) and -len(array) <= index < len(array) else None
+    if operator in ('$first', '$last'):
+        array = values[0]
+        return (array[0] if operator == '$first' else array[-1]) if isinstance(array, list) and array else None
+    if operator == '$in':
+        return any(_equal(values[0], item) for item in values[1])
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$cmp'):
+        left, right = _sort_key(values[0]), _sort_key(values[1])
+        return {
+            '$eq': left == right, '$ne': left != right, '$gt': left > right, '$gte': left >= right,
+            '$lt': left < right, '$lte': left <= right, '$cmp': (left > right) - (left < right),
+        }[operator]
+    if operator == '$and':
+        return all(_truthy(value) for value in values)
+    if operator == '$or':
+        return any(_truthy(value) for value in values)
+    if operator == '$not':
+        return not _truthy(values[0])
+    raise OperationFailure(f"Unrecognized expression '{operator}'", code=168)
+
+
+# Indexes
+
+def _index_name(keys: List[Tuple[str, Any]]) -> str:
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _normalise_index_keys(keys: Any, direction: Any = 1) -> List[Tuple[str, Any]]:
+    if isinstance(keys, str):
+        return [(keys, direction)]
+    if isinstance(keys, Mapping):
+        return [(field, order) for field, order in keys.items()]
+    return [tuple(key) if not isinstance(key, str) else (key, 1) for key in keys]
+
+
+class _Index:
+    """
+    A secondary index: one hash map per key prefix, and the distinct keys of each
+    prefix sorted on demand for range scans.
+    """
+
+    def __init__(self, name: str, keys: List[Tuple[str, Any]], unique: bool = False):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self._levels: List[Dict[Tuple, Set[Tuple]]] = [{} for _ in keys]
+        self._sorted: List[Optional[List[Tuple]]] = [None for _ in keys]
+
+    def entry_keys(self, document: Mapping) -> Set[Tuple]:
+        """Returns the index keys of a document; arrays produce one key per element."""
+        per_field = []
+        for field in self.fields:
+            values = []
+            for value in _resolve(document, field.split('.')):
+                if isinstance(value, list):
+                    values.extend(value or [None])
+                else:
+                    values.append(value)
+            per_field.append({_sort_key(value) for value in values} or {_sort_key(None)})
+        return set(itertools.product(*per_field))
+
+    def conflicts(self, document: Mapping, document_key: Tuple) -> Optional[Tuple]:
+        """Returns the first key of a unique index already used by another document."""
+        if not self.unique:
+            return None
+        for key in self.entry_keys(document):
+            if self._levels[-1].get(key, set()) - {document_key}:
+                return key
+        return None
+
+    def add(self, document: Mapping, document_key: Tuple) -> None:
+        for key in self.entry_keys(document):
+            for depth, level in enumerate(self._levels):
+                prefix = key[:depth + 1]
+                if prefix not in level:
+                    self._sorted[depth] = None
+                level.setdefault(prefix, set()).add(document_key)
+
+    def remove(self, document: Mapping, document_key: Tuple) -> None:
+        for key in self.entry_keys(document):
+            for depth, level in enumerate(self._levels):
+                prefix = key[:depth + 1]
+                entries = level.get(prefix)
+                if entries is not None:
+                    entries.discard(document_key)
+                    if not entries:
+                        del level[prefix]
+                        self._sorted[depth] = None
+
+    def lookup(self, prefixes: List[Tuple], bounds: Optional[Tuple] = None) -> Tuple[Set[Tuple], int]:
+        """
+        Returns the documents under the given equality prefixes, optionally restricted
+        to a range on the next field, and the number of index keys examined.
+        """
+        found: Set[Tuple] = set()
+        examined = 0
+        if bounds is None:
+            level = self._levels[len(prefixes[0]) - 1]
+            for prefix in prefixes:
+                entries = level.get(prefix)
+                if entries:
+                    examined += 1
+                    found |= entries
+            return found, examined
+
+        depth = len(prefixes[0])
+        rank, low, high = bounds
+        keys = self._sorted_keys(depth)
+        for prefix in prefixes:
+            position = bisect_left(keys, prefix + (low if low is not None else (rank,),))
+            while position < len(keys):
+                key = keys[position]
+                position += 1
+                if key[:depth] != prefix:
+                    break
+                field = key[depth]
+                if field[0] != rank:
+                    break
+                if high is not None and field > high:
+                    break
+                examined += 1
+                found |= self._levels[depth][key]
+        return found, examined
+
+    def _sorted_keys(self, depth: int) -> List[Tuple]:
+        if self._sorted[depth] is None:
+            self._sorted[depth] = sorted(self._levels[depth])
+        return self._sorted[depth]
+
+
+def _equality_values(condition: Any) -> Optional[List[Any]]:
+    """Returns the values an index can look up for a condition, None when it cannot."""
+    def usable(value):
+        return value is not None and not isinstance(value, (list, Mapping, re.Pattern, Regex))
+
+    if _is_operator_document(condition):
+        if set(condition) == {'$eq'}:
+            condition = condition['$eq']
+        elif set(condition) == {'$in'}:
+            values = list(condition['$in'])
+            return values if values and all(usable(value) for value in values) else None
+        else:
+            return None
+    return [condition] if usable(condition) else None
+
+
+def _range_bounds(condition: Any) -> Optional[Tuple]:
+    """Returns (type rank, low, high) for a condition made of range operators only."""
+    if not _is_operator_document(condition) or not set(condition) <= _RANGE_OPERATORS:
+        return None
+    keys = {operator: _sort_key(value) for operator, value in condition.items()}
+    ranks = {key[0] for key in keys.values()}
+    if len(ranks) != 1:
+        return None
+    low = max((key for operator, key in keys.items() if operator in ('$gt', '$gte')), default=None)
+    high = min((key for operator, key in keys.items() if operator in ('$lt', '$lte')), default=None)
+    return ranks.pop(), low, high
+
+
+# Storage
+
+class _CollectionData:
+    """Documents of one collection in natural order, keyed by their `_id`."""
+
+    def __init__(self):
+        self.documents: Dict[Tuple, Dict] = {}
+        self.order: Dict[Tuple, int] = {}
+        self.indexes: Dict[str, _Index] = {}
+        self.sequence = itertools.count()
+
+    def plan(self, query: Mapping) -> Tuple[Optional[str], Optional[Set[Tuple]], int]:
+        """
+        Picks the index covering the longest prefix of the filter.
+
+        Returns:
+            Index name (None for a collection scan), candidate document keys and
+            the number of index keys examined
+        """
+        query = query or {}
+        if '_id' in query:
+            ids = _equality_values(query['_id'])
+            if ids is not None:
+                keys = {_sort_key(value) for value in ids}
+                return '_id_', {key for key in keys if key in self.documents}, len(keys)
+
+        best = None
+        for index in self.indexes.values():
+            prefixes: List[Tuple] = [()]
+            bounds = None
+            score = 0.0
+            for field in index.fields:
+                if field not in query:
+                    break
+                values = _equality_values(query[field])
+                if values is not None:
+                    prefixes = [prefix + (_sort_key(value),) for prefix in prefixes for value in values]
+                    score += 1
+                    continue
+                bounds = _range_bounds(query[field])
+                if bounds is not None:
+                    score += 0.5
+                break
+            if score and len(prefixes) <= 1000 and (best is None or score > best[0]):
+                best = (score, index, prefixes, bounds)
+
+        if best is None:
+            return None, None, 0
+        _, index, prefixes, bounds = best
+        if prefixes == [()]:
+            prefixes = [()]
+            candidates, examined = self._range_without_prefix(index, bounds)
+        else:
+            candidates, examined = index.lookup(prefixes, bounds)
+        return index.name, candidates, examined
+
+    def _range_without_prefix(self, index: _Index, bounds: Tuple) -> Tuple[Set[Tuple], int]:
+        rank, low, high = bounds
+        keys = index._sorted_keys(0)
+        found: Set[Tuple] = set()
+        examined = 0
+        position = bisect_left(keys, (low if low is not None else (rank,),))
+        while position < len(keys):
+            key = keys[position]
+            position += 1
+            if key[0][0] != rank or (high is not None and key[0] > high):
+                break
+            examined += 1
+            found |= index._levels[0][key]
+        return found, examined
+
+    def scan(self, query: Mapping) -> Tuple[List[Dict], Dict[str, Any]]:
+        """Returns the matching documents in natural order, with the plan statistics."""
+        started = time.perf_counter()
+        # Like the server, reject unknown operators and bad regexes even when nothing matches
+        matches({}, query)
+        index_name, candidates, keys_examined = self.plan(query)
+        if candidates is None:
+            keys = list(self.documents)
+        else:
+            keys = sorted(candidates, key=self.order.__getitem__)
+        found = [self.documents[key] for key in keys if matches(self.documents[key], query)]
+        stats = {
+            'index': index_name,
+            'keys_examined': keys_examined,
+            'docs_examined': len(keys),
+            'n_returned': len(found),
+            'millis': int((time.perf_counter() - started) * 1000),
+        }
+        return found, stats
+
+    def check_unique(self, document: Mapping, document_key: Tuple, namespace: str) -> None:
+        for index in self.indexes.values():
+            key = index.conflicts(document, document_key)
+            if key is not None:
+                _raise_duplicate(namespace, index, document)
+
+    def insert(self, document: Dict, namespace: str) -> None:
+        document_key = _sort_key(document['_id'])
+        if document_key in self.documents:
+            _raise_duplicate(namespace, None, document)
+        self.check_unique(document, document_key, namespace)
+        self.documents[document_key] = document
+        self.order[document_key] = next(self.sequence)
+        for index in self.indexes.values():
+            index.add(document, document_key)
+
+    def replace(self, document_key: Tuple, document: Dict, namespace: str) -> None:
+        previous = self.documents[document_key]
+        self.check_unique(document, document_key, namespace)
+        for index in self.indexes.values():
+            index.remove(previous, document_key)
+            index.add(document, document_key)
+        self.documents[document_key] = document
+
+    def delete(self, document_key: Tuple) -> None:
+        document = self.documents.pop(document_key)
+        self.order.pop(document_key)
+        for index in self.indexes.values():
+            index.remove(document, document_key)
+
+
+def _raise_duplicate(namespace: str, index: Optional[_Index], document: Mapping) -> None:
+    fields = index.fields if index is not None else ['_id']
+    key_value = {field: _get_path(document, field) for field in fields}
+    shown = ', '.join(f"{field}: {value!r}" for field, value in key_value.items())
+    message = (f"E11000 duplicate key error collection: {namespace} "
+               f"index: {index.name if index is not None else '_id_'} dup key: {{ {shown} }}")
+    raise DuplicateKeyError(message, code=11000, details={
+        'index': 0, 'code': 11000, 'errmsg': message,
+        'keyPattern': dict(index.keys) if index is not None else {'_id': 1},
+        'keyValue': key_value,
+    })
+
+
+class _Store:
+    """The databases of one `memory://` URI."""
+
+    def __init__(self):
+        self.databases: Dict[str, Dict[str, _CollectionData]] = {}
+        self.lock = threading.RLock()
+
+    def collection(self, database_name: str, collection_name: str, create: bool = False) -> Optional[_CollectionData]:
+        database = self.databases.get(database_name)
+        if database is None or collection_name not in database:
+            if not create:
+                return None
+            database = self.databases.setdefault(database_name, {})
+            database[collection_name] = _CollectionData()
+        return database[collection_name]
+
+
+def _store_for(uri: str) -> _Store:
+    name = urlsplit(uri).netloc
+    with _STORES_LOCK:
+        return _STORES.setdefault(name, _Store())
+
+
+def _encode(document: Mapping) -> Dict:
+    """Returns an independent copy of a document, normalised the way the server stores it."""
+    return bson.decode(bson.encode(document), codec_options=DEFAULT_CODEC_OPTIONS)
+
+
+# pymongo-like API
+
+class MemoryClient:
+    """Drop-in replacement of `MongoClient` for `memory://` URIs."""
+
+    def __init__(self, uri: str = MEMORY_SCHEME, **options):
+        self._uri = uri
+        self._store = _store_for(uri)
+        self.options = options
+
+    def get_database(self, name: str, codec_options: Optional[CodecOptions] = None, **kwargs) -> 'MemoryDatabase':
+        return MemoryDatabase(self, name, codec_options or DEFAULT_CODEC_OPTIONS)
+
+    def __getitem__(self, name: str) -> 'MemoryDatabase':
+        return self.get_database(name)
+
+    @property
+    def admin(self) -> 'MemoryDatabase':
+        return self.get_database('admin')
+
+    def list_database_names(self) -> List[str]:
+        with self._store.lock:
+            return [name for name, collections in self._store.databases.items() if collections]
+
+    def drop_database(self, name: str) -> None:
+        with self._store.lock:
+            self._store.databases.pop(getattr(name, 'name', name), None)
+
+    def close(self) -> None:
+        """Data stays in the process-wide store, like on a server."""
+
+    def __repr__(self):
+        return f"MemoryClient({self._uri!r})"
+
+
+class MemoryDatabase:
+
+    def __init__(self, client: MemoryClient, name: str, codec_options: CodecOptions):
+        self.client = client
+        self.name = name
+        self.codec_options = codec_options
+        self._store = client._store
+
+    def __getitem__(self, name: str) -> 'MemoryCollection':
+        return MemoryCollection(self, name)
+
+    def get_collection(self, name: str, codec_options: Optional[CodecOptions] = None, **kwargs) -> 'MemoryCollection':
+        return MemoryCollection(self, name, codec_options)
+
+    def create_collection(self, name: str, **kwargs) -> 'MemoryCollection':
+        with self._store.lock:
+            if self._store.collection(self.name, name) is not None:
+                raise OperationFailure(f"Collection {self.name}.{name} already exists", code=48)
+            self._store.collection(self.name, name, create=True)
+        return self[name]
+
+    def list_collections(self, filter: Optional[Mapping] = None, **kwargs) -> 'MemoryCommandCursor':
+        with self._store.lock:
+            names = list(self._store.databases.get(self.name, {}))
+        infos = [{'name': name, 'type': 'collection', 'options': {}} for name in names]
+        return MemoryCommandCursor([info for info in infos if matches(info, filter)])
+
+    def list_collection_names(self, filter: Optional[Mapping] = None, **kwargs) -> List[str]:
+        return [info['name'] for info in self.list_collections(filter)]
+
+    def drop_collection(self, name: Any, **kwargs) -> Dict:
+        with self._store.lock:
+            self._store.databases.get(self.name, {}).pop(getattr(name, 'name', name), None)
+        return {'ok': 1.0}
+
+    def command(self, command: Any, value: Any = 1, **kwargs) -> Dict:
+        if isinstance(command, Mapping):
+            command, value, kwargs = next(iter(command)), next(iter(command.values())), {
+                **dict(list(command.items())[1:]), **kwargs
+            }
+        if command in ('ping', 'hello', 'ismaster', 'isMaster'):
+            return {'ok': 1.0}
+        if command == 'explain':
+            return self[value.get('find') or value.get('count')]._explain(value)
+        if command == 'collStats':
+            return dict(self[value]._storage_stats(), ok=1.0)
+        if command == 'dropDatabase':
+            self.client.drop_database(self.name)
+            return {'ok': 1.0}
+        raise OperationFailure(f"no such command: '{command}'", code=59)
+
+    def __repr__(self):
+        return f"MemoryDatabase({self.client!r}, {self.name!r})"
+
+
+class MemoryCollection:
+
+    def __init__(self, database: MemoryDatabase, name: str, codec_options: Optional[CodecOptions] = None):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.codec_options = codec_options or database.codec_options
+        self._store = database._store
+
+    # Helpers
+
+    def _data(self, create: bool = False) -> Optional[_CollectionData]:
+        return self._store.collection(self.database.name, self.name, create)
+
+    def _decode(self, document: Mapping) -> Any:
+        return bson.decode(bson.encode(document), codec_options=self.codec_options)
+
+    def _matching(self, query: Optional[Mapping]) -> Tuple[List[Dict], Dict[str, Any]]:
+        data = self._data()
+        if data is None:
+            return [], {'index': None, 'keys_examined': 0, 'docs_examined': 0, 'n_returned': 0, 'millis': 0}
+        return data.scan(query or {})
+
+    # Reads
+
+    def find(self, filter: Optional[Mapping] = None, projection: Any = None, skip: int = 0,
+             limit: int = 0, sort: Any = None, batch_size: int = 0, **kwargs) -> 'MemoryCursor':
+        cursor = MemoryCursor(self, filter or {}, projection)
+        cursor.skip(skip).limit(limit)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    def find_one(self, filter: Any = None, *args, **kwargs) -> Optional[Any]:
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {'_id': filter}
+        for document in self.find(filter, *args, **kwargs).limit(-1):
+            return document
+        return None
+
+    def count_documents(self, filter: Mapping, **kwargs) -> int:
+        hint = kwargs.get('hint')
+        with self._store.lock:
+            data = self._data()
+            if hint and (data is None or self._index_name_for(hint) not in set(data.indexes) | {'_id_'}):
+                raise OperationFailure("hint provided does not correspond to an existing index", code=2)
+            documents, _ = self._matching(filter)
+        documents = documents[int(kwargs.get('skip', 0)):]
+        if kwargs.get('limit'):
+            documents = documents[:int(kwargs['limit'])]
+        return len(documents)
+
+    def estimated_document_count(self, **kwargs) -> int:
+        with self._store.lock:
+            data = self._data()
+            return len(data.documents) if data is not None else 0
+
+    def distinct(self, key: str, filter: Optional[Mapping] = None, **kwargs) -> List[Any]:
+        with self._store.lock:
+            documents, _ = self._matching(filter)
+            values: List[Any] = []
+            for document in documents:
+                for value in _candidates(document, key)[0]:
+                    for item in (value if isinstance(value, list) else [value]):
+                        if not any(_equal(item, seen) for seen in values):
+                            values.append(item)
+            return [self._decode({'v': value})['v'] for value in values]
+
+    # Writes
+
+    def insert_one(self, document: Dict, **kwargs) -> InsertOneResult:
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        stored = _encode(document)
+        with self._store.lock:
+            self._data(create=True).insert(stored, self.full_name)
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents: List[Dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        requests = [_Request('insert', document=document) for document in documents]
+        for request in requests:
+            if '_id' not in request.document:
+                request.document['_id'] = ObjectId()
+        self._execute_bulk(requests, ordered)
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    def update_one(self, filter: Mapping, update: Any, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, update, upsert, multi=False))
+
+    def update_many(self, filter: Mapping, update: Any, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, update, upsert, multi=True))
+
+    def replace_one(self, filter: Mapping, replacement: Mapping, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update_result(self._update(filter, replacement, upsert, multi=False, replace=True))
+
+    def find_one_and_update(self, filter: Mapping, update: Any, projection: Any = None, sort: Any = None,
+                            upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                            **kwargs) -> Optional[Any]:
+        with self._store.lock:
+            documents, _ = self._matching(filter)
+            if sort:
+                documents = _sort_documents(documents, _normalise_sort(sort))
+            before = copy.deepcopy(documents[0]) if documents else None
+            result = self._update(
+                {'_id': documents[0]['_id']} if documents else filter, update, upsert, multi=False
+            )
+            if before is None and not result['upserted']:
+                return None
+            if return_document == ReturnDocument.AFTER:
+                key = _sort_key(result['upserted'] if result['upserted'] is not None else before['_id'])
+                after = self._data().documents[key]
+                return self._decode(project(after, projection))
+            if before is None:
+                return None
+            return self._decode(project(before, projection))
+
+    def delete_one(self, filter: Mapping, **kwargs) -> DeleteResult:
+        return DeleteResult({'n': self._delete(filter, multi=False), 'ok': 1.0}, True)
+
+    def delete_many(self, filter: Mapping, **kwargs) -> DeleteResult:
+        return DeleteResult({'n': self._delete(filter, multi=True), 'ok': 1.0}, True)
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        recorder = _BulkRecorder()
+        for request in requests:
+            request._add_to_bulk(recorder)
+        return BulkWriteResult(self._execute_bulk(recorder.requests, ordered), True)
+
+    def drop(self, **kwargs) -> None:
+        self.database.drop_collection(self.name)
+
+    def watch(self, *args, **kwargs) -> None:
+        # Same answer as a standalone server: callers fall back to polling
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    # Indexes
+
+    def create_index(self, keys: Any, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        keys = _normalise_index_keys(keys)
+        name = name or _index_name(keys)
+        with self._store.lock:
+            data = self._data(create=True)
+            existing = data.indexes.get(name)
+            if existing is not None:
+                if existing.keys != keys or existing.unique != bool(unique):
+                    raise OperationFailure(
+                        f"An existing index has the same name as the requested index: {name}", code=86
+                    )
+                return name
+            index = _Index(name, keys, bool(unique))
+            for document_key, document in data.documents.items():
+                if index.conflicts(document, document_key):
+                    _raise_duplicate(self.full_name, index, document)
+                index.add(document, document_key)
+            data.indexes[name] = index
+        return name
+
+    def create_indexes(self, indexes: List[Any], **kwargs) -> List[str]:
+        return [self.create_index(model.document['key'], **{
+            key: value for key, value in model.document.items() if key != 'key'
+        }) for model in indexes]
+
+    def drop_index(self, index_or_name: Any, **kwargs) -> None:
+        name = self._index_name_for(index_or_name)
+        with self._store.lock:
+            data = self._data()
+            if data is None or name not in data.indexes:
+                raise OperationFailure(f"index not found with name [{name}]", code=27)
+            del data.indexes[name]
+
+    def drop_indexes(self, **kwargs) -> None:
+        with self._store.lock:
+            data = self._data()
+            if data is not None:
+                data.indexes.clear()
+
+    def index_information(self, **kwargs) -> Dict[str, Dict]:
+        with self._store.lock:
+            data = self._data()
+            information = {'_id_': {'v': 2, 'key': [('_id', 1)]}} if data is not None else {}
+            for index in (data.indexes.values() if data is not None else []):
+                information[index.name] = {'v': 2, 'key': list(index.keys)}
+                if index.unique:
+                    information[index.name]['unique'] = True
+            return information
+
+    # Aggregation
+
+    def aggregate(self, pipeline: List[Mapping], **kwargs) -> 'MemoryCommandCursor':
+        with self._store.lock:
+            documents = self._run_pipeline(pipeline)
+        return MemoryCommandCursor([self._decode(document) for document in documents])
+
+    def _run_pipeline(self, pipeline: List[Mapping]) -> List[Mapping]:
+        stages = list(pipeline)
+        documents: Optional[List[Mapping]] = None
+        if stages and '$collStats' in stages[0]:
+            return [{'ns': self.full_name, 'storageStats': self._storage_stats()}]
+        # A leading $match uses the indexes like a find
+        if stages and '$match' in stages[0]:
+            documents, _ = self._matching(stages.pop(0)['$match'])
+        elif documents is None:
+            documents, _ = self._matching({})
+
+        for position, stage in enumerate(stages):
+            if len(stage) != 1:
+                raise OperationFailure("A pipeline stage specification object must contain exactly one field.",
+                                       code=40323)
+            name, argument = next(iter(stage.items()))
+            if name in ('$out', '$merge') and position != len(stages) - 1:
+                raise OperationFailure(f"{name} can only be the final stage in the pipeline", code=40601)
+            documents = self._apply_stage(name, argument, documents)
+        return documents
+
+    def _apply_stage(self, name: str, argument: Any, documents: List[Mapping]) -> List[Mapping]:
+        if name == '$match':
+            return [document for document in documents if matches(document, argument)]
+        if name == '$project':
+            return [project(document, argument) for document in documents]
+        if name in ('$addFields', '$set'):
+            result = []
+            for document in documents:
+                document = copy.deepcopy(dict(document))
+                for path, expression in argument.items():
+                    _set_path(document, path, evaluate(expression, document))
+                result.append(document)
+            return result
+        if name == '$unset':
+            fields = [argument] if isinstance(argument, str) else argument
+            return [project(document, {field: 0 for field in fields}) for document in documents]
+        if name == '$sort':
+            return _sort_documents(list(documents), _normalise_sort(argument))
+        if name == '$limit':
+            return documents[:int(argument)]
+        if name == '$skip':
+            return documents[int(argument):]
+        if name == '$count':
+            return [{argument: len(documents)}] if documents else []
+        if name == '$unwind':
+            return self._unwind(argument, documents)
+        if name == '$group':
+            return self._group(argument, documents)
+        if name == '$sortByCount':
+            grouped = self._group({'_id': argument, 'count': {'$sum': 1}}, documents)
+            return _sort_documents(grouped, [('count', -1)])
+        if name == '$replaceRoot':
+            return [evaluate(argument['newRoot'], document) for document in documents]
+        if name == '$replaceWith':
+            return [evaluate(argument, document) for document in documents]
+        if name == '$lookup':
+            return self._lookup(argument, documents)
+        if name == '$out':
+            self._out(argument, documents)
+            return []
+        if name == '$merge':
+            self._merge(argument, documents)
+            return []
+        raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", code=40324)
+
+    def _unwind(self, argument: Any, documents: List[Mapping]) -> List[Mapping]:
+        if isinstance(argument, str):
+            argument = {'path': argument}
+        path = argument['path'].lstrip('$')
+        keep_empty = argument.get('preserveNullAndEmptyArrays', False)
+        index_field = argument.get('includeArrayIndex')
+        result = []
+        for document in documents:
+            value = _get_path(document, path, _MISSING)
+            if isinstance(value, list) and value:
+                for position, item in enumerate(value):
+                    unwound = copy.deepcopy(dict(document))
+                    _set_path(unwound, path, item)
+                    if index_field:
+                        unwound[index_field] = position
+                    result.append(unwound)
+            elif isinstance(value, list) or value is _MISSING or value is None:
+                if keep_empty:
+                    unwound = copy.deepcopy(dict(document))
+                    if isinstance(value, list):
+                        _unset_path(unwound, path)
+                    if index_field:
+                        unwound[index_field] = None
+                    result.append(unwound)
+            else:
+                unwound = copy.deepcopy(dict(document))
+                if index_field:
+                    unwound[index_field] = None
+                result.append(unwound)
+        return result
+
+    def _group(self, argument: Mapping, documents: List[Mapping]) -> List[Dict]:
+        if '_id' not in argument:
+            raise OperationFailure("a group specification must include an _id", code=15955)
+        groups: Dict[Tuple, Dict[str, Any]] = {}
+        for document in documents:
+            group_id = evaluate(argument['_id'], document)
+            state = groups.setdefault(_sort_key(group_id), {'_id': group_id, 'values': {}})
+            for field, accumulator in argument.items():
+                if field == '_id':
+                    continue
+                operator, expression = next(iter(accumulator.items()))
+                value = 1 if operator == '$count' else evaluate(expression, document)
+                state['values'].setdefault(field, []).append(value)
+
+        result = []
+        for state in groups.values():
+            output = {'_id': state['_id']}
+            for field, accumulator in argument.items():
+                if field == '_id':
+                    continue
+                operator = next(iter(accumulator))
+                values = state['values'].get(field, [])
+                output[field] = _accumulate(operator, values)
+            result.append(output)
+        return result
+
+    def _lookup(self, argument: Mapping, documents: List[Mapping]) -> List[Dict]:
+        if 'pipeline' in argument:
+            raise OperationFailure("$lookup with a pipeline is not supported by the memory:// backend", code=2)
+        foreign = self._store.collection(self.database.name, argument['from'])
+        foreign_documents = list(foreign.documents.values()) if foreign is not None else []
+        result = []
+        for document in documents:
+            local = _candidates(document, argument['localField'])[1] or [None]
+            joined = [
+                copy.deepcopy(other) for other in foreign_documents
+                if any(_value_matches(_candidates(other, argument['foreignField'])[1], value) for value in local)
+            ]
+            document = copy.deepcopy(dict(document))
+            _set_path(document, argument['as'], joined)
+            result.append(document)
+        return result
+
+    def _out(self, argument: Any, documents: List[Mapping]) -> None:
+        target_name = argument if isinstance(argument, str) else argument['coll']
+        target_database = self.database.name if isinstance(argument, str) else argument.get('db', self.database.name)
+        previous = self._store.collection(target_database, target_name)
+
+        # The output is built aside and swapped in, so a failure leaves the target untouched
+        replacement = _CollectionData()
+        if previous is not None:
+            for index in previous.indexes.values():
+                replacement.indexes[index.name] = _Index(index.name, index.keys, index.unique)
+        namespace = f"{target_database}.{target_name}"
+        for document in documents:
+            document = _encode(document)
+            document.setdefault('_id', ObjectId())
+            replacement.insert(document, namespace)
+        self._store.databases.setdefault(target_database, {})[target_name] = replacement
+
+    def _merge(self, argument: Any, documents: List[Mapping]) -> None:
+        if isinstance(argument, str):
+            argument = {'into': argument}
+        into = argument['into']
+        target_database = self.database.name if isinstance(into, str) else into.get('db', self.database.name)
+        target_name = into if isinstance(into, str) else into['coll']
+        on = argument.get('on', '_id')
+        on_fields = [on] if isinstance(on, str) else list(on)
+        when_matched = argument.get('whenMatched', 'merge')
+        when_not_matched = argument.get('whenNotMatched', 'insert')
+        target = self._store.collection(target_database, target_name, create=True)
+        namespace = f"{target_database}.{target_name}"
+
+        for document in documents:
+            document = _encode(document)
+            query = {field: _get_path(document, field) for field in on_fields}
+            existing, _ = target.scan(query)
+            if existing:
+                current = existing[0]
+                if when_matched == 'keepExisting':
+                    continue
+                if when_matched == 'fail':
+                    _raise_duplicate(namespace, None, document)
+                merged = document if when_matched == 'replace' else {**copy.deepcopy(current), **document}
+                merged['_id'] = current['_id']
+                target.replace(_sort_key(current['_id']), merged, namespace)
+            elif when_not_matched == 'insert':
+                document.setdefault('_id', ObjectId())
+                target.insert(document, namespace)
+            elif when_not_matched == 'fail':
+                raise OperationFailure("$merge could not find a matching document in the target collection",
+                                       code=13113)
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        data = self._data()
+        if data is None:
+            return {'count': 0, 'size': 0, 'storageSize': 0, 'nindexes': 0, 'totalIndexSize': 0, 'indexSizes': {}}
+        size = sum(len(bson.encode(document)) for document in data.documents.values())
+        index_sizes = {'_id_': len(data.documents) * 16}
+        for index in data.indexes.values():
+            index_sizes[index.name] = sum(len(entries) for entries in index._levels[-1].values()) * 16
+        return {
+            'count': len(data.documents),
+            'size': size,
+            'avgObjSize': size // len(data.documents) if data.documents else 0,
+            'storageSize': size,
+            'nindexes': len(index_sizes),
+            'totalIndexSize': sum(index_sizes.values()),
+            'indexSizes': index_sizes,
+        }
+
+    def _explain(self, command: Mapping) -> Dict[str, Any]:
+        query = command.get('filter') or command.get('query') or {}
+        with self._store.lock:
+            data = self._data()
+            documents, stats = self._matching(query)
+            index = data.indexes.get(stats['index']) if data is not None and stats['index'] else None
+        if stats['index'] is None:
+            winning_plan = {'stage': 'COLLSCAN', 'filter': query, 'direction': 'forward'}
+        else:
+            key_pattern = dict(index.keys) if index is not None else {'_id': 1}
+            winning_plan = {'stage': 'FETCH', 'inputStage': {
+                'stage': 'IXSCAN', 'indexName': stats['index'], 'keyPattern': key_pattern,
+                'isUnique': index.unique if index is not None else True,
+            }}
+        if command.get('sort'):
+            winning_plan = {'stage': 'SORT', 'sortPattern': command['sort'], 'inputStage': winning_plan}
+        return {
+            'queryPlanner': {'namespace': self.full_name, 'parsedQuery': query, 'winningPlan': winning_plan},
+            'executionStats': {
+                'executionSuccess': True,
+                'nReturned': stats['n_returned'],
+                'executionTimeMillis': stats['millis'],
+                'totalKeysExamined': stats['keys_examined'],
+                'totalDocsExamined': stats['docs_examined'],
+            },
+            'ok': 1.0,
+        }
+
+    # Write internals
+
+    def _update(self, query: Mapping, update: Any, upsert: bool, multi: bool,
+                replace: bool = False) -> Dict[str, Any]:
+        if isinstance(update, list):
+            raise OperationFailure("Update pipelines are not supported by the memory:// backend", code=2)
+        operators = bool(update) and all(str(key).startswith('$') for key in update)
+        if replace and operators:
+            raise ValueError("replacement can not include $ operators")
+        if not replace and not operators:
+            raise ValueError("update only works with $ operators")
+
+        with self._store.lock:
+            data = self._data(create=upsert)
+            documents = data.scan(query)[0] if data is not None else []
+            if not multi:
+                documents = documents[:1]
+            modified = 0
+            for current in documents:
+                document_key = _sort_key(current['_id'])
+                if replace:
+                    updated = _encode(update)
+                    if '_id' in updated and not _equal(updated['_id'], current['_id']):
+                        raise OperationFailure(
+                            "After applying the update, the (immutable) field '_id' was found to have been altered",
+                            code=66
+                        )
+                    updated = {'_id': current['_id'], **{k: v for k, v in updated.items() if k != '_id'}}
+                else:
+                    updated = copy.deepcopy(current)
+                    apply_update(updated, update)
+                    updated = _encode(updated)
+                if bson.encode(updated) != bson.encode(current):
+                    data.replace(document_key, updated, self.full_name)
+                    modified += 1
+
+            upserted = None
+            if not documents and upsert:
+                document = _upsert_seed(query)
+                if replace:
+                    document.update(copy.deepcopy(dict(update)))
+                else:
+                    apply_update(document, update, inserting=True)
+                document.setdefault('_id', ObjectId())
+                document = _encode({'_id': document.pop('_id'), **document})
+                data.insert(document, self.full_name)
+                upserted = document['_id']
+        return {'n': len(documents) if upserted is None else 1, 'nModified': modified, 'upserted': upserted}
+
+    @staticmethod
+    def _update_result(raw: Dict[str, Any]) -> UpdateResult:
+        if raw['upserted'] is None:
+            raw = {key: value for key, value in raw.items() if key != 'upserted'}
+        return UpdateResult(dict(raw, ok=1.0), True)
+
+    def _delete(self, query: Mapping, multi: bool) -> int:
+        with self._store.lock:
+            data = self._data()
+            if data is None:
+                return 0
+            documents = data.scan(query)[0]
+            if not multi:
+                documents = documents[:1]
+            for document in documents:
+                data.delete(_sort_key(document['_id']))
+            return len(documents)
+
+    def _execute_bulk(self, requests: List['_Request'], ordered: bool) -> Dict[str, Any]:
+        result = {'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+                  'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            try:
+                if request.kind == 'insert':
+                    if '_id' not in request.document:
+                        request.document['_id'] = ObjectId()
+                    stored = _encode(request.document)
+                    with self._store.lock:
+                        self._data(create=True).insert(stored, self.full_name)
+                    result['nInserted'] += 1
+                elif request.kind in ('update', 'replace'):
+                    raw = self._update(request.filter, request.document, request.upsert,
+                                       request.multi, replace=request.kind == 'replace')
+                    if raw['upserted'] is not None:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': index, '_id': raw['upserted']})
+                    else:
+                        result['nMatched'] += raw['n']
+                        result['nModified'] += raw['nModified']
+                else:
+                    result['nRemoved'] += self._delete(request.filter, request.multi)
+            except (DuplicateKeyError, OperationFailure) as e:
+                result['writeErrors'].append({
+                    'index': index, 'code': e.code, 'errmsg': str(e),
+                    'op': request.document if request.kind == 'insert' else {'q': request.filter},
+                })
+                if ordered:
+                    break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return result
+
+    def __repr__(self):
+        return f"MemoryCollection({self.database!r}, {self.name!r})"
+
+    @staticmethod
+    def _index_name_for(index: Any) -> str:
+        if isinstance(index, str):
+            return index
+        return _index_name(_normalise_index_keys(index))
+
+
+def _accumulate(operator: str, values: List[Any]) -> Any:
+    numbers = [value for value in values if _is_number(value)]
+    if operator in ('$sum', '$count'):
+        return sum(numbers)
+    if operator == '$avg':
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator in ('$min', '$max'):
+        present = [value for value in values if value is not None]
+        return (min if operator == '$min' else max)(present, key=_sort_key) if present else None
+    if operator == '$first':
+        return values[0] if values else None
+    if operator == '$last':
+        return values[-1] if values else None
+    if operator == '$push':
+        return list(values)
+    if operator == '$addToSet':
+        unique: List[Any] = []
+        for value in values:
+            if not any(_equal(value, seen) for seen in unique):
+                unique.append(value)
+        return unique
+    raise OperationFailure(f"unknown group operator '{operator}'", code=15952)
+
+
+class _Request:
+    """A write operation of a bulk, as described by pymongo's operation classes."""
+
+    def __init__(self, kind: str, filter: Optional[Mapping] = None, document: Any = None,
+                 upsert: bool = False, multi: bool = False):
+        self.kind = kind
+        self.filter = filter
+        self.document = document
+        self.upsert = upsert
+        self.multi = multi
+
+
+class _BulkRecorder:
+    """Receives `InsertOne`, `UpdateOne`... operations through their `_add_to_bulk` hook."""
+
+    def __init__(self):
+        self.requests: List[_Request] = []
+
+    def add_insert(self, document, *args, **kwargs):
+        self.requests.append(_Request('insert', document=document))
+
+    def add_update(self, selector, update, multi, upsert, *args, **kwargs):
+        self.requests.append(_Request('update', selector, update, bool(upsert), bool(multi)))
+
+    def add_replace(self, selector, replacement, upsert, *args, **kwargs):
+        self.requests.append(_Request('replace', selector, replacement, bool(upsert)))
+
+    def add_delete(self, selector, limit, *args, **kwargs):
+        self.requests.append(_Request('delete', selector, multi=not limit))
+
+
+class MemoryCursor:
+    """Cursor over the documents matching a find, evaluated on first iteration."""
+
+    def __init__(self, collection: MemoryCollection, query: Mapping, projection: Any = None):
+        self.collection = collection
+        self._query = query
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+        self._sort: List[Tuple[str, int]] = []
+        self._results: Optional[Iterator[Any]] = None
+        self._remaining = 0
+        self._closed = False
+
+    def _check_not_started(self) -> None:
+        if self._results is not None:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._check_not_started()
+        self._limit = int(limit)
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._check_not_started()
+        self._skip = int(skip)
+        return self
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> 'MemoryCursor':
+        self._check_not_started()
+        self._sort = _normalise_sort(key_or_list, direction)
+        return self
+
+    def batch_size(self, batch_size: int) -> 'MemoryCursor':
+        self._check_not_started()
+        return self
+
+    def hint(self, index: Any) -> 'MemoryCursor':
+        self._check_not_started()
+        return self
+
+    def max_time_ms(self, max_time_ms: Optional[int]) -> 'MemoryCursor':
+        self._check_not_started()
+        return self
+
+    def explain(self) -> Dict[str, Any]:
+        command = {'find': self.collection.name, 'filter': self._query}
+        if self._sort:
+            command['sort'] = dict(self._sort)
+        return self.collection._explain(command)
+
+    def _execute(self) -> None:
+        with self.collection._store.lock:
+            documents, _ = self.collection._matching(self._query)
+            if self._sort:
+                documents = _sort_documents(documents, self._sort)
+            documents = documents[self._skip:]
+            if self._limit:
+                documents = documents[:abs(self._limit)]
+            # Copy under the lock: later writes must not change what this cursor returns
+            projected = [bson.encode(project(document, self._projection)) for document in documents]
+        self._remaining = len(projected)
+        codec_options = self.collection.codec_options
+        self._results = (bson.decode(raw, codec_options=codec_options) for raw in projected)
+
+    def __iter__(self) -> 'MemoryCursor':
+        return self
+
+    def __next__(self) -> Any:
+        if self._closed:
+            raise StopIteration
+        if self._results is None:
+            self._execute()
+        if not self._remaining:
+            raise StopIteration
+        self._remaining -= 1
+        return next(self._results)
+
+    @property
+    def alive(self) -> bool:
+        return not self._closed and (self._results is None or self._remaining > 0)
+
+    def close(self) -> None:
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemoryCommandCursor:
+    """Cursor over the result of an aggregation."""
+
+    def __init__(self, documents: List[Any]):
+        self._documents = iter(documents)
+        self._remaining = len(documents)
+        self._closed = False
+
+    def __iter__(self) -> 'MemoryCommandCursor':
+        return self
+
+    def __next__(self) -> Any:
+        if self._closed or not self._remaining:
+            raise StopIteration
+        self._remaining -= 1
+        return next(self._documents)
+
+    def next(self) -> Any:
+        return self.__next__()
+
+    @property
+    def alive(self) -> bool:
+        return not self._closed and self._remaining > 0
+
+    def close(self) -> None:
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MetadataCache:
+    """
+    Per-database cache of collection names and index information with a time-to-live.
+
+    A TTL of 0 disables caching: every lookup calls its loader.
+    """
+
+    def __init__(self, ttl: float = 30):
+        self.ttl = float(ttl)
+        self._collection_names: Dict[Tuple, Tuple[float, set]] = {}
+        self._indexes: Dict[Tuple, Tuple[float, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def collection_names(self, database_key: Tuple, loader: Callable[[], List[str]]) -> List[str]:
+        """Returns the cached collection names of a database, loading them when stale."""
+        names = self._lookup(self._collection_names, database_key)
+        if names is None:
+            names = set(loader())
+            self._store(self._collection_names, database_key, names)
+        return sorted(names)
+
+    def index_information(self, database_key: Tuple, collection_name: str,
+                          loader: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Returns the cached index information of a collection, loading it when stale."""
+        key = database_key + (collection_name,)
+        indexes = self._lookup(self._indexes, key)
+        if indexes is None:
+            indexes = loader()
+            self._store(self._indexes, key, indexes)
+        return dict(indexes)
+
+    def add_collection(self, database_key: Tuple, collection_name: str) -> None:
+        """Records a collection created implicitly, e.g. by its first insert."""
+        with self._lock:
+            entry = self._collection_names.get(database_key)
+            if entry is not None:
+                entry[1].add(collection_name)
+
+    def invalidate(self, database_key: Optional[Tuple] = None,
+                   collection_name: Optional[str] = None) -> None:
+        """
+        Forgets cached metadata of a collection, of a database, or of everything.
+
+        Forgetting a collection also forgets the collection names of its database.
+        """
+        with self._lock:
+            if database_key is None:
+                self._collection_names.clear()
+                self._indexes.clear()
+                return
+            self._collection_names.pop(database_key, None)
+            for key in list(self._indexes):
+                if key[:-1] == database_key and collection_name in (None, key[-1]):
+                    del self._indexes[key]
+
+    def invalidate_indexes(self, database_key: Tuple, collection_name: str) -> None:
+        """Forgets the cached index information of one collection."""
+        with self._lock:
+            self._indexes.pop(database_key + (collection_name,), None)
+
+    def _lookup(self, entries: Dict, key: Tuple) -> Any:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            return entry[1]
+
+    def _store(self, entries: Dict, key: Tuple, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            entries[key] = (time.monotonic(), value)
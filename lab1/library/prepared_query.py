@@ -0,0 +1,115 @@
+import re
+from typing import Any, Callable, Dict, Optional, Set
+
+
+# A placeholder is a whole string value such as "{{user_id}}"
+_PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+PREPARED_OPERATIONS = ('find', 'update_one', 'update_many', 'delete_many', 'count')
+
+
+class PreparedQuery:
+    """
+    A filter, projection and update parsed once, with named placeholders bound per execution.
+
+    Binding rebuilds only the containers that hold placeholders; every other
+    sub-document of the template is shared between executions.
+    """
+
+    def __init__(self, database_name: str, collection_name: str, operation: str,
+                 filter_query: Dict, projection: Optional[Dict] = None,
+                 update_query: Optional[Dict] = None, limit: int = 0,
+                 alias: Optional[str] = None,
+                 id_converter: Callable[[Any], Any] = lambda value: value):
+        if operation not in PREPARED_OPERATIONS:
+            raise ValueError(
+                f"Unsupported prepared operation '{operation}'. "
+                f"Expected one of: {', '.join(PREPARED_OPERATIONS)}"
+            )
+        if operation in ('update_one', 'update_many') and update_query is None:
+            raise ValueError(f"Prepared operation '{operation}' requires an update document")
+
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.operation = operation
+        self.limit = int(limit)
+        self.alias = alias
+        self._id_converter = id_converter
+        self.placeholders: Set[str] = set()
+
+        if '_id' in filter_query and not self._is_placeholder(filter_query['_id']):
+            filter_query['_id'] = id_converter(filter_query['_id'])
+        self.filter_query = filter_query
+        self.projection = projection
+        self.update_query = update_query
+        self._filter_binder = self._compile(filter_query, top_level_filter=True)
+        self._projection_binder = self._compile(projection)
+        self._update_binder = self._compile(update_query)
+
+    def bind(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Substitutes the placeholders with the given values.
+
+        Returns:
+            The bound filter, projection and update documents
+        """
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise ValueError(f"Missing values for placeholders: {', '.join(sorted(missing))}")
+        unknown = values.keys() - self.placeholders
+        if unknown:
+            raise ValueError(f"Unknown placeholders: {', '.join(sorted(unknown))}")
+        return {
+            'filter_query': self._filter_binder(values),
+            'projection': self._projection_binder(values),
+            'update_query': self._update_binder(values),
+        }
+
+    @staticmethod
+    def _is_placeholder(value: Any) -> bool:
+        return isinstance(value, str) and _PLACEHOLDER.fullmatch(value) is not None
+
+    def _compile(self, template: Any, top_level_filter: bool = False) -> Callable[[Dict], Any]:
+        """Returns a function rebuilding the template with bound values."""
+        if isinstance(template, str):
+            match = _PLACEHOLDER.fullmatch(template)
+            if match is None:
+                return lambda values: template
+            name = match.group(1)
+            self.placeholders.add(name)
+            return lambda values: values[name]
+
+        if isinstance(template, dict):
+            binders = {
+                key: self._compile(value)
+                for key, value in template.items() if self._has_placeholder(value)
+            }
+            if not binders:
+                return lambda values: template
+            if top_level_filter and '_id' in binders:
+                id_binder, convert = binders['_id'], self._id_converter
+                binders['_id'] = lambda values: convert(id_binder(values))
+
+            def bind_dict(values):
+                bound = dict(template)
+                for key, binder in binders.items():
+                    bound[key] = binder(values)
+                return bound
+            return bind_dict
+
+        if isinstance(template, list):
+            if not self._has_placeholder(template):
+                return lambda values: template
+            binders = [self._compile(item) for item in template]
+            return lambda values: [binder(values) for binder in binders]
+
+        return lambda values: template
+
+    def _has_placeholder(self, template: Any) -> bool:
+        if isinstance(template, str):
+            return self._is_placeholder(template)
+        if isinstance(template, dict):
+            return any(self._has_placeholder(value) for value in template.values())
+        if isinstance(template, list):
+            return any(self._has_placeholder(item) for item in template)
+        return False
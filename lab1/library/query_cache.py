@@ -0,0 +1,113 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+class QueryResultCache:
+    """
+    LRU cache of query results with a time-to-live and per-collection invalidation.
+
+    Results are deep-copied in and out of the cache so that tests modifying a
+    returned document never alter what later lookups see.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        self._namespaces: Dict[Tuple[str, str], Set[Tuple]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(connection: Optional[str], database_name: str, collection_name: str,
+                 filter_query: Any, projection: Any, limit: int) -> Tuple:
+        """Builds a cache key with the filter and projection normalised to sorted JSON."""
+        return (
+            connection,
+            database_name,
+            collection_name,
+            json.dumps(filter_query, sort_keys=True, default=repr),
+            json.dumps(projection, sort_keys=True, default=repr),
+            int(limit)
+        )
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        """
+        Looks up a key.
+
+        Returns:
+            Whether the key was found, and a copy of the cached result
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return True, copy.deepcopy(result)
+
+    def put(self, key: Tuple, result: Any) -> None:
+        """Stores a copy of a result, evicting the least recently used entries."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result))
+            self._namespaces.setdefault(key[1:3], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, database_name: Optional[str] = None,
+                   collection_name: Optional[str] = None) -> int:
+        """
+        Drops the entries of one collection, of one database, or of everything.
+
+        Returns:
+            Number of entries dropped
+        """
+        with self._lock:
+            namespaces = [
+                namespace for namespace in self._namespaces
+                if (database_name is None or namespace[0] == database_name)
+                and (collection_name is None or namespace[1] == collection_name)
+            ]
+            dropped = 0
+            for namespace in namespaces:
+                for key in list(self._namespaces.get(namespace, ())):
+                    self._remove(key)
+                    dropped += 1
+            if dropped:
+                self._stats['invalidations'] += dropped
+            return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit, miss, eviction, expiration and invalidation counters."""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                size=len(self._entries),
+                max_entries=self.max_entries,
+                ttl=self.ttl,
+                hit_ratio=self._stats['hits'] / lookups if lookups else 0.0
+            )
+
+    def _remove(self, key: Tuple) -> None:
+        self._entries.pop(key, None)
+        keys = self._namespaces.get(key[1:3])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[key[1:3]]
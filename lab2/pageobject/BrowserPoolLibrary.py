@@ -0,0 +1,153 @@
+from typing import Dict, Optional
+
+from robot.api import logger
+from robot.api.deco import keyword, library
+from robot.libraries.BuiltIn import BuiltIn
+
+from browser_pool import BrowserSessionPool, PooledSession, create_driver
+from variables import URL_AUTOMATION
+
+
+@library(scope='GLOBAL', version='1.0.0')
+class BrowserPoolLibrary:
+    """
+    Robot Framework keywords handing out warm, headless browser sessions to SeleniumLibrary.
+
+    Browsers are started once per run (once per worker with pabot, each worker
+    process having its own pool) and reused from suite to suite: an acquired
+    session is reset to a clean state and becomes the current SeleniumLibrary
+    browser, so the usual SeleniumLibrary keywords drive it.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 3
+
+    def __init__(self):
+        self.ROBOT_LIBRARY_LISTENER = self
+        self._pool: Optional[BrowserSessionPool] = None
+        self._current: Optional[PooledSession] = None
+
+    @keyword("Configure Browser Pool")
+    def configure_browser_pool(self, browser: str = 'chrome', headless: bool = True, size: int = 1,
+                               max_uses: int = 20, window_size: str = '1920x1080',
+                               url: str = URL_AUTOMATION) -> None:
+        """
+        Replaces the browser pool and starts its sessions in the background.
+
+        Without this keyword, the first `Acquire Browser Session` uses the defaults.
+
+        Args:
+            browser: chrome, edge or firefox
+            headless: Run without a visible window
+            size: Sessions kept started
+            max_uses: Acquisitions of a session before it is replaced (0 = no limit),
+                one per `Acquire Browser Session`
+            window_size: Window size as WIDTHxHEIGHT
+            url: URL every acquired session starts on
+
+        Examples:
+            | Configure Browser Pool | chrome | headless=${False} |
+            | Configure Browser Pool | size=2 | max_uses=10 |
+        """
+        self.close_browser_pool()
+        self._pool = BrowserSessionPool(lambda: create_driver(browser, headless, window_size),
+                                        int(size), int(max_uses), url, on_discard=self._close_session)
+        self._pool.warm_up()
+        logger.info(f"Browser pool of {size} {browser} session(s), replaced after {max_uses} use(s)")
+
+    @keyword("Acquire Browser Session")
+    def acquire_browser_session(self, url: Optional[str] = None) -> str:
+        """
+        Makes a clean pooled session the current SeleniumLibrary browser.
+
+        The session has a single window, no cookies and empty web storage, and
+        is on `url`. A crashed session is replaced transparently.
+
+        Args:
+            url: Start URL (default: the pool URL, `URL_AUTOMATION`)
+
+        Returns:
+            The SeleniumLibrary alias of the session
+
+        Examples:
+            | Acquire Browser Session |
+            | Acquire Browser Session | https://automationplayground.com/crm/customer-add.html |
+        """
+        if self._current is not None:
+            self.release_browser_session()
+        try:
+            session = self._get_pool().acquire(url)
+        except Exception as e:
+            raise Exception(f"Error starting a browser session: {str(e)}")
+        selenium = self._selenium()
+        try:
+            selenium.switch_browser(session.alias)
+        except RuntimeError:
+            selenium.register_driver(session.driver, session.alias)
+        self._current = session
+        logger.info(f"Browser session {session.alias} acquired (use {session.uses})")
+        return session.alias
+
+    @keyword("Release Browser Session")
+    def release_browser_session(self, recycle: bool = False) -> None:
+        """
+        Gives the current session back to the pool instead of closing the browser.
+
+        Args:
+            recycle: Replace the session instead of reusing it (e.g. after a failed suite)
+
+        Examples:
+            | Release Browser Session |
+            | Release Browser Session | recycle=${True} |
+        """
+        if self._current is None or self._pool is None:
+            return
+        session, self._current = self._current, None
+        self._pool.release(session, recycle)
+
+    @keyword("Get Browser Pool Stats")
+    def get_browser_pool_stats(self) -> Dict[str, float]:
+        """
+        Returns the counters of the pool.
+
+        Returns:
+            Dictionary with started, acquired, reused, recycled, crashed and startup_seconds
+
+        Examples:
+            | ${stats}= | Get Browser Pool Stats |
+            | Should Be True | ${stats}[reused] > 0 |
+        """
+        stats = dict(self._pool.stats) if self._pool is not None else {}
+        logger.info(f"Browser pool stats: {stats}")
+        return stats
+
+    @keyword("Close Browser Pool")
+    def close_browser_pool(self) -> None:
+        """Quits every pooled browser."""
+        self._current = None
+        if self._pool is not None:
+            logger.info(f"Browser pool stats: {self._pool.stats}")
+            self._pool.close()
+            self._pool = None
+
+    def close(self) -> None:
+        """Quits the pooled browsers when the library goes out of scope."""
+        self.close_browser_pool()
+
+    def _get_pool(self) -> BrowserSessionPool:
+        if self._pool is None:
+            self.configure_browser_pool()
+        return self._pool
+
+    @staticmethod
+    def _selenium():
+        return BuiltIn().get_library_instance('SeleniumLibrary')
+
+    def _close_session(self, session: PooledSession) -> None:
+        """Quits a discarded session, through SeleniumLibrary when it knows the session."""
+        try:
+            selenium = self._selenium()
+            selenium.switch_browser(session.alias)
+        except Exception:
+            session.driver.quit()
+            return
+        selenium.close_browser()
@@ -0,0 +1,263 @@
+"""
+Pool of warm WebDriver sessions for the CRM tests.
+
+Starting Chrome and its driver costs seconds, while the CRM tests take a few
+hundred milliseconds each. The pool starts its sessions once, hands them out
+reset to a clean state (one window, no cookies, empty storage, on the start
+URL) and takes them back after the test. A session is replaced after
+`max_uses` acquisitions, or as soon as it stops answering; its replacement is
+started in the background so that the next test does not wait for it.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from selenium import webdriver
+from selenium.common.exceptions import NoAlertPresentException, WebDriverException
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from variables import URL_AUTOMATION
+
+
+BROWSERS = ('chrome', 'edge', 'firefox')
+
+# Chromium flags for headless runs in containers and CI agents
+_CHROMIUM_ARGUMENTS = ('--disable-gpu', '--no-sandbox', '--disable-dev-shm-usage', '--disable-extensions')
+
+
+def create_driver(browser: str = 'chrome', headless: bool = True,
+                  window_size: str = '1920x1080') -> WebDriver:
+    """
+    Starts a WebDriver session.
+
+    Args:
+        browser: chrome, edge or firefox
+        headless: Run without a visible window
+        window_size: Window size as WIDTHxHEIGHT (replaces Maximize Browser Window)
+    """
+    browser = browser.lower().replace('headless', '')
+    width, height = (int(value) for value in window_size.lower().split('x'))
+    if browser in ('chrome', 'gc', 'edge'):
+        options = webdriver.ChromeOptions() if browser != 'edge' else webdriver.EdgeOptions()
+        if headless:
+            options.add_argument('--headless=new')
+        options.add_argument(f'--window-size={width},{height}')
+        for argument in _CHROMIUM_ARGUMENTS:
+            options.add_argument(argument)
+        return webdriver.Chrome(options=options) if browser != 'edge' else webdriver.Edge(options=options)
+    if browser in ('firefox', 'ff'):
+        options = webdriver.FirefoxOptions()
+        if headless:
+            options.add_argument('-headless')
+        driver = webdriver.Firefox(options=options)
+        driver.set_window_size(width, height)
+        return driver
+    raise ValueError(f"Unsupported browser '{browser}'. Use one of: {', '.join(BROWSERS)}")
+
+
+def reset_session(driver: WebDriver, url: str) -> None:
+    """
+    Brings a session back to a clean state on `url`.
+
+    Extra windows are closed and alerts dismissed. Cookies are cleared for every
+    domain on Chromium (through DevTools), for the current domain elsewhere.
+    Web storage is cleared for the origin of `url`; session storage belongs to
+    the window, so it is only reachable while the window is on that origin.
+    """
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    try:
+        driver.switch_to.alert.dismiss()
+    except NoAlertPresentException:
+        pass
+
+    target = urlsplit(url)
+    current = urlsplit(driver.current_url)
+    if (current.scheme, current.netloc) == (target.scheme, target.netloc):
+        driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    if hasattr(driver, 'execute_cdp_cmd'):
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+            'origin': f"{target.scheme}://{target.netloc}",
+            'storageTypes': 'local_storage,indexeddb,service_workers,cache_storage',
+        })
+    else:
+        driver.delete_all_cookies()
+    driver.get(url)
+
+
+class PooledSession:
+    """A WebDriver session and its use count."""
+
+    def __init__(self, driver: WebDriver, alias: str):
+        self.driver = driver
+        self.alias = alias
+        self.uses = 0
+        self.created_at = time.time()
+
+    def is_alive(self) -> bool:
+        """Returns False when the browser or its driver has crashed or was closed."""
+        try:
+            self.driver.current_window_handle
+            return True
+        except (WebDriverException, OSError):
+            return False
+
+    def __repr__(self):
+        return f"PooledSession({self.alias!r}, uses={self.uses})"
+
+
+class BrowserSessionPool:
+    """
+    Keeps `size` WebDriver sessions started and hands them out one test at a time.
+
+    Sessions are started in parallel on a small thread pool. `acquire` takes an
+    idle session, or waits for one being started, and resets it; `release` gives
+    it back, or discards it once it has been acquired `max_uses` times.
+    """
+
+    def __init__(self, factory: Callable[[], WebDriver], size: int = 1, max_uses: int = 20,
+                 url: str = URL_AUTOMATION,
+                 on_discard: Optional[Callable[[PooledSession], None]] = None):
+        """
+        Args:
+            factory: Starts a WebDriver session
+            size: Sessions kept started
+            max_uses: Acquisitions of a session before it is replaced (0 = no limit)
+            url: URL every handed-out session starts on
+            on_discard: Called to quit a discarded session (default: driver.quit)
+        """
+        if int(size) < 1:
+            raise ValueError("The pool needs at least one session")
+        self.factory = factory
+        self.size = int(size)
+        self.max_uses = int(max_uses)
+        self.url = url
+        self.on_discard = on_discard
+        self.stats: Dict[str, float] = {'started': 0, 'acquired': 0, 'reused': 0, 'recycled': 0,
+                                        'crashed': 0, 'startup_seconds': 0.0}
+        self._idle: Deque[PooledSession] = deque()
+        self._starting: List[Future] = []
+        self._in_use: Dict[str, PooledSession] = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='browser-start')
+
+    def warm_up(self) -> None:
+        """Starts sessions in the background until `size` are started or starting."""
+        with self._lock:
+            missing = self.size - len(self._idle) - len(self._in_use) - len(self._starting)
+            for _ in range(missing):
+                self._starting.append(self._executor.submit(self._start))
+
+    def acquire(self, url: Optional[str] = None) -> PooledSession:
+        """
+        Returns a clean session on `url` (default: the pool URL).
+
+        A crashed session is replaced once; a session that still answers but
+        cannot be reset (e.g. `url` does not load) goes back to the pool.
+
+        Raises:
+            WebDriverException: When no browser can be started, or the session
+                cannot be reset on `url`
+        """
+        self.warm_up()
+        replaced = False
+        while True:
+            session = self._take()
+            if session.is_alive():
+                try:
+                    reset_session(session.driver, url or self.url)
+                    break
+                except (WebDriverException, OSError):
+                    if session.is_alive():
+                        # The browser answers: the reset failed, not the session
+                        with self._lock:
+                            self._idle.append(session)
+                        raise
+            with self._lock:
+                self.stats['crashed'] += 1
+            self._discard(session)
+            self.warm_up()
+            if replaced:
+                raise WebDriverException(f"Browser session {session.alias} crashed, as did the one it replaced")
+            replaced = True
+        with self._lock:
+            if session.uses:
+                self.stats['reused'] += 1
+            session.uses += 1
+            self.stats['acquired'] += 1
+            self._in_use[session.alias] = session
+        return session
+
+    def release(self, session: PooledSession, recycle: bool = False) -> None:
+        """
+        Gives a session back to the pool.
+
+        Args:
+            session: The session returned by `acquire`
+            recycle: Replace the session instead of reusing it (e.g. after a failed test)
+        """
+        with self._lock:
+            self._in_use.pop(session.alias, None)
+        if recycle or (self.max_uses and session.uses >= self.max_uses) or not session.is_alive():
+            with self._lock:
+                self.stats['recycled'] += 1
+            self._discard(session)
+            self.warm_up()
+            return
+        with self._lock:
+            self._idle.append(session)
+
+    def close(self) -> None:
+        """Quits every session, including those still in use."""
+        with self._lock:
+            starting, self._starting = self._starting, []
+            sessions = list(self._idle) + list(self._in_use.values())
+            self._idle.clear()
+            self._in_use.clear()
+        for future in starting:
+            try:
+                sessions.append(future.result())
+            except Exception:
+                continue
+        for session in sessions:
+            self._discard(session)
+        self._executor.shutdown(wait=False)
+
+    # Helpers
+
+    def _start(self) -> PooledSession:
+        started = time.perf_counter()
+        driver = self.factory()
+        with self._lock:
+            self._counter += 1
+            alias = f"pool-{self._counter}"
+            self.stats['started'] += 1
+            self.stats['startup_seconds'] += time.perf_counter() - started
+        return PooledSession(driver, alias)
+
+    def _take(self) -> PooledSession:
+        with self._lock:
+            if self._idle:
+                return self._idle.popleft()
+            future = self._starting.pop(0) if self._starting else None
+        if future is None:
+            return self._start()
+        return future.result()
+
+    def _discard(self, session: PooledSession) -> None:
+        try:
+            if self.on_discard is not None:
+                self.on_discard(session)
+            else:
+                session.driver.quit()
+        except Exception:
+            # A crashed browser cannot be quit cleanly: nothing more to free
+            pass
@@ -0,0 +1,486 @@
+import json
+from typing import Dict, List, Optional, Union
+
+import requests
+from robot.api import logger
+from robot.api.deco import keyword, library
+
+from fulfillment_client import FulfillmentClient
+from fulfillment_stub import FulfillmentStubServer
+from api_endpoints import FULFILLMENT_SCOPE
+from http_replay import CassetteStore, RecordReplayAdapter, ReplayServer
+from load_test import run_load_test
+from order_coalescer import OrderCoalescer, OrderLookupError
+from token_cache import DEFAULT_CACHE_PATH, REFRESH_MARGIN, TokenManager
+from variables import ERROR_ORDER_NOT_FOUND, REQUEST_TIMEOUT, RETRY_COUNT
+
+
+@library(scope='GLOBAL', version='1.0.0')
+class EbayFulfillmentLibrary:
+    """
+    Robot Framework keywords for the eBay Fulfillment API.
+
+    Requests go through a pooled `FulfillmentClient`: connections are kept alive
+    between keywords, and rate-limited or failed calls are retried with jittered
+    backoff. Keywords return the `requests` response, so tests check
+    `${response.status_code}` and `${response.json()}` as with RequestsLibrary.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 3
+
+    def __init__(self):
+        self.ROBOT_LIBRARY_LISTENER = self
+        self._client: Optional[FulfillmentClient] = None
+        self._replay_server: Optional[ReplayServer] = None
+        self._stub_server: Optional[FulfillmentStubServer] = None
+        self._token_manager: Optional[TokenManager] = None
+        self._coalescer: Optional[OrderCoalescer] = None
+
+    @keyword("Connect To Fulfillment API")
+    def connect_to_fulfillment_api(self, environment: str = 'sandbox', access_token: str = '',
+                                   base_url: Optional[str] = None,
+                                   timeout: float = REQUEST_TIMEOUT,
+                                   retry_count: int = RETRY_COUNT,
+                                   pool_size: int = 10) -> None:
+        """
+        Creates the pooled client used by the other keywords.
+
+        Args:
+            environment: sandbox or production
+            access_token: OAuth access token (default: the one of `Configure Access Token`)
+            base_url: API root overriding the environment (e.g. a local stub server)
+            timeout: Seconds to wait for a response
+            retry_count: Retries of rate-limited, 5xx and unreachable calls
+            pool_size: Connections kept alive to the API host
+
+        Examples:
+            | Connect To Fulfillment API | sandbox | ${TOKEN} |
+            | Connect To Fulfillment API | base_url=http://127.0.0.1:8080/sell/fulfillment/v1 |
+        """
+        self.close_fulfillment_api()
+        token_manager = self._token_manager if not access_token else None
+        self._client = FulfillmentClient(environment, access_token, base_url, timeout,
+                                         retry_count, pool_size=pool_size, token_manager=token_manager)
+        logger.info(f"Fulfillment API client ready for {self._client.base_url}")
+
+    @keyword("Configure Access Token")
+    def configure_access_token(self, client_id: str = '', client_secret: str = '',
+                               environment: str = 'sandbox', token_url: Optional[str] = None,
+                               scope: str = FULFILLMENT_SCOPE, refresh_token: Optional[str] = None,
+                               cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+                               refresh_margin: float = REFRESH_MARGIN) -> None:
+        """
+        Mints access tokens from the application credentials instead of a hardcoded token.
+
+        The token is minted once, then shared through memory and through
+        `cache_path` by every pabot worker, and replaced `refresh_margin` seconds
+        before it expires. `Connect To Fulfillment API` without `access_token`
+        uses it, as do `Get Access Token` and `Get Authorization Headers`.
+
+        Args:
+            client_id: Application client id
+            client_secret: Application client secret
+            environment: sandbox, production, or stub for the token endpoint of
+                `Start Fulfillment Stub Server` (default credentials included)
+            token_url: Token endpoint overriding the environment
+            scope: Space-separated OAuth scopes
+            refresh_token: User refresh token (default: client_credentials grant)
+            cache_path: JSON file shared by parallel workers (${None} = memory only)
+            refresh_margin: Seconds before expiry at which the token is replaced
+
+        Examples:
+            | Configure Access Token | ${CLIENT_ID} | ${CLIENT_SECRET} | refresh_token=${REFRESH_TOKEN} |
+            | Connect To Fulfillment API | sandbox |
+        """
+        if environment == 'stub':
+            if self._stub_server is None:
+                raise RuntimeError("No stub server. Use 'Start Fulfillment Stub Server' first.")
+            token_url = token_url or self._stub_server.token_url
+            client_id = client_id or self._stub_server.client_id
+            client_secret = client_secret or self._stub_server.client_secret
+        if not client_id or not client_secret:
+            raise ValueError("client_id and client_secret are required")
+        self._token_manager = TokenManager(client_id, client_secret, environment,
+                                           token_url, scope, refresh_token, cache_path or None,
+                                           float(refresh_margin))
+        if self._client is not None and not self._client.access_token:
+            self._client.token_manager = self._token_manager
+        logger.info(f"Access tokens from {self._token_manager.token_url}, cached in {cache_path or 'memory'}")
+
+    @keyword("Get Access Token")
+    def get_access_token(self) -> str:
+        """
+        Returns the cached access token, minting or refreshing it when needed.
+
+        Examples:
+            | ${token}= | Get Access Token |
+        """
+        try:
+            return self._get_token_manager().get_token()
+        except requests.RequestException as e:
+            raise Exception(f"Error fetching access token: {str(e)}")
+
+    @keyword("Get Authorization Headers")
+    def get_authorization_headers(self) -> Dict[str, str]:
+        """
+        Returns `DEFAULT_HEADERS` with the cached access token, for RequestsLibrary calls.
+
+        Examples:
+            | ${headers}= | Get Authorization Headers |
+            | ${response}= | GET On Session | ebay | /order/${ORDER_ID} | headers=${headers} |
+        """
+        try:
+            return self._get_token_manager().headers()
+        except requests.RequestException as e:
+            raise Exception(f"Error fetching access token: {str(e)}")
+
+    @keyword("Close Fulfillment API")
+    def close_fulfillment_api(self) -> None:
+        """Closes the pooled connections of the client."""
+        if self._coalescer is not None:
+            self._coalescer.close()
+            self._coalescer = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    @keyword("Enable HTTP Record Replay")
+    def enable_http_record_replay(self, store_dir: str, mode: str = 'replay') -> None:
+        """
+        Records the client's exchanges to, or replays them from, an on-disk store.
+
+        Exchanges are keyed by method, `ENDPOINTS` template, path parameters, sorted
+        query parameters and canonical JSON body, so the host and the token do not
+        matter. In replay mode an exchange never recorded fails the keyword instead
+        of reaching the network.
+
+        Args:
+            store_dir: Directory of the recordings
+            mode: record, replay, or auto (replay what exists, record the rest)
+
+        Examples:
+            | Connect To Fulfillment API | sandbox | ${TOKEN} |
+            | Enable HTTP Record Replay | ${CURDIR}/../recordings | mode=${REPLAY_MODE} |
+        """
+        client = self._get_client()
+        adapter = RecordReplayAdapter(CassetteStore(store_dir), mode)
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+        logger.info(f"HTTP {mode} enabled with {len(adapter.store)} recorded exchange(s) in {store_dir}")
+
+    @keyword("Start HTTP Replay Server")
+    def start_http_replay_server(self, store_dir: str, mode: str = 'replay',
+                                 upstream: Optional[str] = None, port: int = 0) -> str:
+        """
+        Starts a local stub server replaying recorded exchanges.
+
+        Tests using RequestsLibrary point their `${BASE_URL}` to it. In record and
+        auto modes, missing exchanges are forwarded to `upstream` and recorded.
+
+        Args:
+            store_dir: Directory of the recordings
+            mode: record, replay or auto
+            upstream: API host to record from, e.g. https://api.sandbox.ebay.com
+            port: Port to listen on (0 = any free port)
+
+        Returns:
+            URL of the server, e.g. http://127.0.0.1:8080
+
+        Examples:
+            | ${stub}= | Start HTTP Replay Server | ${CURDIR}/../recordings |
+            | Create Session | ebay | ${stub}/sell/fulfillment/v1 |
+        """
+        self.stop_http_replay_server()
+        self._replay_server = ReplayServer(CassetteStore(store_dir), mode, upstream, port=int(port))
+        url = self._replay_server.start()
+        logger.info(f"HTTP {mode} server listening on {url}")
+        return url
+
+    @keyword("Stop HTTP Replay Server")
+    def stop_http_replay_server(self) -> None:
+        """Stops the stub server and saves the index of its store."""
+        if self._replay_server is not None:
+            self._replay_server.stop()
+            self._replay_server = None
+
+    @keyword("Start Fulfillment Stub Server")
+    def start_fulfillment_stub_server(self, orders: int = 1000, latency_ms: float = 0,
+                                      jitter_ms: float = 0, error_rate: float = 0.0,
+                                      rate_limit_rate: float = 0.0, port: int = 0,
+                                      check_tokens: bool = False, token_lifetime: int = 7200) -> str:
+        """
+        Starts a local stub of the Fulfillment API over generated orders.
+
+        The first generated order is `VALID_ORDER_ID`; `INVALID_ORDER_ID` and
+        `NON_EXISTENT_ORDER_ID` get the errors of `variables.py`.
+
+        Args:
+            orders: Number of generated orders
+            latency_ms: Delay added to every response
+            jitter_ms: Random extra delay, up to this many milliseconds
+            error_rate: Share of requests answered 500
+            rate_limit_rate: Share of requests answered 429
+            port: Port to listen on (0 = any free port)
+            check_tokens: Only accept tokens minted by the stub's token endpoint
+            token_lifetime: Seconds a minted token is valid
+
+        Returns:
+            API root of the stub, e.g. http://127.0.0.1:8080/sell/fulfillment/v1
+
+        Examples:
+            | ${api}= | Start Fulfillment Stub Server | latency_ms=20 | error_rate=0.05 |
+            | Connect To Fulfillment API | access_token=test | base_url=${api} |
+        """
+        self.stop_fulfillment_stub_server()
+        self._stub_server = FulfillmentStubServer(int(orders), float(latency_ms), float(jitter_ms),
+                                                  float(error_rate), float(rate_limit_rate), port=int(port),
+                                                  token_lifetime=int(token_lifetime), check_tokens=check_tokens)
+        url = self._stub_server.start()
+        logger.info(f"Fulfillment stub listening on {url} with {len(self._stub_server.orders)} order(s)")
+        return url
+
+    @keyword("Stop Fulfillment Stub Server")
+    def stop_fulfillment_stub_server(self) -> None:
+        """Stops the stub server started by `Start Fulfillment Stub Server`."""
+        if self._stub_server is not None:
+            self._stub_server.stop()
+            self._stub_server = None
+
+    @keyword("Run Fulfillment Load Test")
+    def run_fulfillment_load_test(self, mix: str = 'get_order=6,get_orders=3,issue_refund=1',
+                                  concurrency: int = 8, rate: float = 0, duration: float = 10,
+                                  requests: int = 0, base_url: Optional[str] = None,
+                                  access_token: str = 'load-test',
+                                  order_ids: Optional[Union[str, List[str]]] = None,
+                                  retry_count: int = 0, latency_ms: float = 0,
+                                  error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                                  output_path: Optional[str] = None) -> Dict:
+        """
+        Sends a concurrent mix of getOrder, getOrders and issueRefund calls and reports on it.
+
+        Without `base_url`, a stub server is started for the run with the given
+        latency and error rates. With `rate`, requests start at that rate whatever
+        the response times (open loop); otherwise `concurrency` workers send
+        requests back to back.
+
+        Args:
+            mix: Relative weight of each operation
+            concurrency: Maximum requests in flight
+            rate: Requests started per second (0 = closed loop)
+            duration: Seconds to run (0 = until `requests` are sent)
+            requests: Requests to send (0 = until `duration` is over)
+            base_url: API root to load (default: a stub started for the run)
+            access_token: OAuth access token
+            order_ids: Orders used by getOrder and issueRefund, as a list or comma-separated string
+            retry_count: Client retries (0 reports every failed answer)
+            latency_ms: Stub latency
+            error_rate: Share of stub answers that are 500
+            rate_limit_rate: Share of stub answers that are 429
+            output_path: JSON file receiving the report
+
+        Returns:
+            The report: requests, errors, error_rate, throughput_rps, latency_ms
+            (min, mean, p50, p90, p95, p99, max), error_breakdown and per-operation details
+
+        Examples:
+            | ${report}= | Run Fulfillment Load Test | concurrency=16 | duration=5 | latency_ms=10 |
+            | Should Be True | ${report}[latency_ms][p99] < 200 |
+            | ${report}= | Run Fulfillment Load Test | rate=100 | requests=1000 | output_path=${OUTPUT DIR}/load.json |
+        """
+        if isinstance(order_ids, str):
+            order_ids = [order_id.strip() for order_id in order_ids.split(',') if order_id.strip()]
+        options = {'mix': mix, 'concurrency': int(concurrency), 'rate': float(rate),
+                   'duration': float(duration), 'requests': int(requests),
+                   'access_token': access_token, 'retry_count': int(retry_count)}
+        if order_ids:
+            options['order_ids'] = order_ids
+        stub_options = {'latency_ms': float(latency_ms), 'error_rate': float(error_rate),
+                        'rate_limit_rate': float(rate_limit_rate)}
+        try:
+            report = run_load_test(base_url, output_path, stub_options, **options)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error running load test: {str(e)}")
+        latency = report['latency_ms']
+        logger.info(f"{report['requests']} request(s) in {report['duration_s']}s: "
+                    f"{report['throughput_rps']} req/s, {report['errors']} error(s), "
+                    f"p50 {latency.get('p50')} ms, p99 {latency.get('p99')} ms")
+        return report
+
+    @keyword("Get Order")
+    def get_order(self, order_id: str) -> requests.Response:
+        """
+        Calls getOrder.
+
+        Args:
+            order_id: Identifier of the order
+
+        Returns:
+            The response, whatever its status
+
+        Examples:
+            | ${response}= | Get Order | ${ORDER_ID} |
+            | Should Be Equal As Integers | ${response.status_code} | 200 |
+        """
+        return self._call('getOrder', self._get_client().get_order, order_id)
+
+    @keyword("Get Orders")
+    def get_orders(self, filter: Optional[str] = None, limit: Optional[int] = None,
+                   offset: Optional[int] = None,
+                   order_ids: Optional[Union[str, List[str]]] = None) -> requests.Response:
+        """
+        Calls getOrders. Unset parameters take their value from `GET_ORDERS_PARAMS`.
+
+        Args:
+            filter: getOrders filter, e.g. a creationdate range
+            limit: Orders per page
+            offset: Orders to skip
+            order_ids: Comma-separated string or list of order ids
+
+        Returns:
+            The response, whatever its status
+
+        Examples:
+            | ${response}= | Get Orders | limit=50 |
+            | ${response}= | Get Orders | order_ids=${ids} |
+        """
+        params = {'filter': filter, 'limit': limit, 'offset': offset, 'orderIds': order_ids}
+        return self._call('getOrders', self._get_client().get_orders,
+                          **{name: value for name, value in params.items() if value is not None})
+
+    @keyword("Issue Refund")
+    def issue_refund(self, order_id: str, payload: Optional[Union[str, Dict]] = None) -> requests.Response:
+        """
+        Calls issueRefund.
+
+        Args:
+            order_id: Identifier of the order
+            payload: JSON string or dictionary (default: `REFUND_PAYLOAD_TEMPLATE`)
+
+        Returns:
+            The response, whatever its status
+        """
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid payload JSON: {str(e)}")
+        return self._call('issueRefund', self._get_client().issue_refund, order_id, payload)
+
+    @keyword("Get Orders By Id")
+    def get_orders_by_id(self, order_ids: Union[str, List[str]], allow_missing: bool = False,
+                         window: float = 0.01) -> Dict[str, Dict]:
+        """
+        Looks orders up by id with batched getOrders requests instead of one getOrder each.
+
+        Ids are sent `MAX_ORDER_IDS` at a time in `orderIds`. Lookups made by other
+        threads within `window` seconds share the same requests.
+
+        Args:
+            order_ids: Comma-separated string or list of order ids
+            allow_missing: Leave unknown ids out instead of failing
+            window: Seconds a lookup waits for others to join its batch (first call only)
+
+        Returns:
+            Dictionary of the found orders by id
+
+        Examples:
+            | ${orders}= | Get Orders By Id | ${ORDER_IDS} |
+            | Should Be Equal | ${orders}[${ORDER_ID}][orderPaymentStatus] | PAID |
+        """
+        if isinstance(order_ids, str):
+            order_ids = [order_id.strip() for order_id in order_ids.split(',') if order_id.strip()]
+        if self._coalescer is None:
+            self._coalescer = OrderCoalescer(self._get_client(), float(window))
+        requests_before = self._coalescer.requests
+        try:
+            orders = self._coalescer.get_orders(order_ids)
+        except (OrderLookupError, requests.RequestException) as e:
+            raise Exception(f"Error retrieving orders by id: {str(e)}")
+        missing = [order_id for order_id in dict.fromkeys(order_ids) if order_id not in orders]
+        logger.info(f"Found {len(orders)} of {len(set(order_ids))} order(s) "
+                    f"in {self._coalescer.requests - requests_before} request(s)")
+        if missing and not allow_missing:
+            raise AssertionError(f"{ERROR_ORDER_NOT_FOUND}: {', '.join(missing)}")
+        return orders
+
+    @keyword("Get All Orders")
+    def get_all_orders(self, filter: Optional[str] = None, page_size: Optional[int] = None,
+                       max_orders: int = 0) -> List[Dict]:
+        """
+        Returns the orders of every getOrders page as a list.
+
+        Meant for small ranges: use `Pull All Orders` to stream large ones to a file.
+
+        Args:
+            filter: getOrders filter (default: the one of `GET_ORDERS_PARAMS`)
+            page_size: Orders per page
+            max_orders: Stops after this many orders (0 = all)
+        """
+        try:
+            return list(self._iter_orders(filter, page_size, max_orders))
+        except Exception as e:
+            raise Exception(f"Error retrieving orders: {str(e)}")
+
+    @keyword("Pull All Orders")
+    def pull_all_orders(self, output_path: str, filter: Optional[str] = None,
+                        page_size: Optional[int] = None, max_orders: int = 0) -> int:
+        """
+        Streams the orders of every getOrders page to a JSON lines file.
+
+        The next page is fetched while the current one is written, and no more than
+        two pages are held in memory, whatever the number of orders.
+
+        Args:
+            output_path: JSON lines file receiving one order per line
+            filter: getOrders filter (default: the one of `GET_ORDERS_PARAMS`)
+            page_size: Orders per page
+            max_orders: Stops after this many orders (0 = all)
+
+        Returns:
+            Number of orders written
+
+        Examples:
+            | ${count}= | Pull All Orders | ${OUTPUT DIR}/orders_2024.jsonl | page_size=200 |
+        """
+        count = 0
+        try:
+            with open(output_path, 'w', encoding='utf-8') as output:
+                for order in self._iter_orders(filter, page_size, max_orders):
+                    output.write(json.dumps(order) + '\n')
+                    count += 1
+        except Exception as e:
+            raise Exception(f"Error pulling orders: {str(e)}")
+        logger.info(f"Wrote {count} order(s) to {output_path}")
+        return count
+
+    # Helper methods
+
+    def close(self) -> None:
+        """Saves the recordings, stops the stub and closes the client when the library goes out of scope."""
+        self.stop_http_replay_server()
+        self.stop_fulfillment_stub_server()
+        self.close_fulfillment_api()
+
+    def _get_client(self) -> FulfillmentClient:
+        if self._client is None:
+            raise RuntimeError("No Fulfillment API client. Use 'Connect To Fulfillment API' first.")
+        return self._client
+
+    def _get_token_manager(self) -> TokenManager:
+        if self._token_manager is None:
+            raise RuntimeError("No access token configuration. Use 'Configure Access Token' first.")
+        return self._token_manager
+
+    def _iter_orders(self, filter: Optional[str], page_size: Optional[int], max_orders: int):
+        params = {'filter': filter} if filter else {}
+        return self._get_client().iter_orders(page_size=page_size, max_orders=int(max_orders), **params)
+
+    def _call(self, operation: str, method, *args, **kwargs) -> requests.Response:
+        try:
+            response = method(*args, **kwargs)
+        except requests.RequestException as e:
+            raise Exception(f"Error calling {operation}: {str(e)}")
+        logger.info(f"{operation}: {response.request.method} {response.url} -> {response.status_code}")
+        return response
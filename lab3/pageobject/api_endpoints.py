@@ -6,6 +6,15 @@ ENVIRONMENTS = {
     "production": "https://api.ebay.com/sell/fulfillment/v1"
 }
 
+# Endpoints OAuth (obtention du token d'accès)
+TOKEN_ENDPOINTS = {
+    "sandbox": "https://api.sandbox.ebay.com/identity/v1/oauth2/token",
+    "production": "https://api.ebay.com/identity/v1/oauth2/token"
+}
+
+# Scope requis par l'API Fulfillment
+FULFILLMENT_SCOPE = "https://api.ebay.com/oauth/api_scope/sell.fulfillment"
+
 # Endpoints de l'API
 ENDPOINTS = {
     "get_order": "/order/{order_id}",
@@ -28,6 +37,9 @@ GET_ORDERS_PARAMS = {
     "orderIds": None
 }
 
+# Nombre maximal d'identifiants par requête getOrders avec orderIds
+MAX_ORDER_IDS = 50
+
 # Structure de données pour issueRefund
 REFUND_PAYLOAD_TEMPLATE = {
     "reasonForRefund": "BUYER_CANCELLED",
@@ -0,0 +1,228 @@
+import copy
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from api_endpoints import DEFAULT_HEADERS, ENDPOINTS, ENVIRONMENTS, GET_ORDERS_PARAMS, REFUND_PAYLOAD_TEMPLATE
+from token_cache import TokenManager
+from variables import REQUEST_TIMEOUT, RETRY_COUNT
+
+
+# Statuses worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# A refund must not be issued twice: POSTs are only retried when the server refused them
+NON_IDEMPOTENT_RETRY_STATUSES = {429, 503}
+
+
+class FulfillmentClient:
+    """
+    Client of the eBay Fulfillment API built on `ENDPOINTS` and `GET_ORDERS_PARAMS`.
+
+    Requests share one keep-alive connection pool. Rate-limited (429) and 5xx
+    responses, as well as connection errors, are retried up to `retry_count` times
+    with full-jitter exponential backoff (POSTs only when the server refused them or
+    the connection could not be opened), honouring `Retry-After` when the server
+    sends one. With a `TokenManager`, a 401 invalidates the shared token and the
+    request is sent once more with a new one.
+    """
+
+    def __init__(self, environment: str = 'sandbox', access_token: str = '',
+                 base_url: Optional[str] = None, timeout: float = REQUEST_TIMEOUT,
+                 retry_count: int = RETRY_COUNT, backoff_base: float = 0.5,
+                 backoff_max: float = 8.0, pool_size: int = 10,
+                 session: Optional[requests.Session] = None,
+                 token_manager: Optional[TokenManager] = None):
+        """
+        Args:
+            environment: Key of `ENVIRONMENTS` (sandbox or production)
+            access_token: OAuth access token put in the Authorization header
+            base_url: API root overriding the environment (e.g. a local stub server)
+            timeout: Seconds to wait for a response
+            retry_count: Retries after the first attempt
+            backoff_base: Upper bound of the first retry delay, in seconds
+            backoff_max: Upper bound of any retry delay, in seconds
+            pool_size: Connections kept alive to the API host
+            session: Session to send requests with (default: a new pooled session)
+            token_manager: Source of the access token, used instead of `access_token`
+        """
+        if base_url is None and environment not in ENVIRONMENTS:
+            raise ValueError(f"Unknown environment '{environment}'. Use one of: {', '.join(ENVIRONMENTS)}")
+        self.base_url = (base_url or ENVIRONMENTS[environment]).rstrip('/')
+        self.access_token = access_token
+        self.token_manager = token_manager
+        self.timeout = float(timeout)
+        self.retry_count = int(retry_count)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(pool_size))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    # Requests
+
+    def headers(self, access_token: Optional[str] = None) -> Dict[str, str]:
+        """Returns `DEFAULT_HEADERS` with the access token filled in."""
+        if access_token is None:
+            access_token = self.token_manager.get_token() if self.token_manager else self.access_token
+        return {
+            name: value.format(access_token=access_token)
+            for name, value in DEFAULT_HEADERS.items()
+        }
+
+    def url(self, endpoint: str, **path_params) -> str:
+        """Builds the URL of an `ENDPOINTS` entry."""
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{endpoint}'. Use one of: {', '.join(ENDPOINTS)}")
+        return self.base_url + ENDPOINTS[endpoint].format(**path_params)
+
+    def request(self, method: str, url: str, params: Optional[Dict] = None,
+                json: Any = None) -> requests.Response:
+        """
+        Sends a request, retrying rate-limited, failed and unreachable attempts.
+
+        Returns:
+            The last response, whatever its status
+        """
+        idempotent = method.upper() in ('GET', 'HEAD')
+        retry_statuses = RETRY_STATUSES if idempotent else NON_IDEMPOTENT_RETRY_STATUSES
+        attempt = 0
+        token_renewed = False
+        while True:
+            access_token = self.token_manager.get_token() if self.token_manager else self.access_token
+            try:
+                response = self.session.request(method, url, params=params, json=json,
+                                                headers=self.headers(access_token), timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # After a read timeout or a dropped connection the server may have
+                # processed a POST already: only a request never sent is safe to resend
+                if attempt >= self.retry_count or not (idempotent or _never_sent(e)):
+                    raise
+                self._sleep_before_retry(attempt)
+            else:
+                if response.status_code == 401 and self.token_manager and not token_renewed:
+                    # Revoked or expired early: mint a new token, without using up a retry
+                    self.token_manager.invalidate(access_token)
+                    token_renewed = True
+                    response.close()
+                    continue
+                if response.status_code not in retry_statuses or attempt >= self.retry_count:
+                    return response
+                self._sleep_before_retry(attempt, response.headers.get('Retry-After'))
+                response.close()
+            attempt += 1
+
+    def _sleep_before_retry(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        # Full jitter spreads the retries of concurrent callers over the whole window
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        with self._lock:
+            self.retries += 1
+        time.sleep(delay)
+
+    # Fulfillment operations
+
+    def get_order(self, order_id: str) -> requests.Response:
+        """Calls getOrder."""
+        return self.request('GET', self.url('get_order', order_id=order_id))
+
+    def get_orders(self, **params) -> requests.Response:
+        """Calls getOrders with `GET_ORDERS_PARAMS` completed by the given parameters."""
+        return self.request('GET', self.url('get_orders'), params=self.orders_params(**params))
+
+    def issue_refund(self, order_id: str, payload: Optional[Dict] = None) -> requests.Response:
+        """Calls issueRefund, with `REFUND_PAYLOAD_TEMPLATE` when no payload is given."""
+        payload = copy.deepcopy(REFUND_PAYLOAD_TEMPLATE) if payload is None else payload
+        return self.request('POST', self.url('issue_refund', order_id=order_id), json=payload)
+
+    @staticmethod
+    def orders_params(**params) -> Dict[str, str]:
+        """Merges getOrders parameters over `GET_ORDERS_PARAMS`, dropping unset ones."""
+        merged = dict(GET_ORDERS_PARAMS, **params)
+        if isinstance(merged.get('orderIds'), (list, tuple)):
+            merged['orderIds'] = ','.join(str(order_id) for order_id in merged['orderIds'])
+        return {name: str(value) for name, value in merged.items() if value not in (None, '')}
+
+    def iter_orders(self, page_size: Optional[int] = None, max_orders: int = 0,
+                    **params) -> Iterator[Dict]:
+        """
+        Yields the orders of every getOrders page.
+
+        Pages are followed through the `next` link, or through limit/offset when the
+        response has none. While the orders of a page are consumed, the next page is
+        already being fetched, so at most two pages are held in memory.
+
+        Args:
+            page_size: Orders per page (default: the `limit` of `GET_ORDERS_PARAMS`)
+            max_orders: Stops after this many orders (0 = all)
+            params: Other getOrders parameters, e.g. `filter`
+
+        Raises:
+            requests.HTTPError: When a page cannot be fetched
+        """
+        if page_size:
+            params['limit'] = int(page_size)
+        params = self.orders_params(**params)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='getOrders-prefetch')
+        pending = executor.submit(self._fetch_page, self.url('get_orders'), params)
+        yielded = 0
+        try:
+            while pending is not None:
+                page = pending.result()
+                orders: List[Dict] = page.get('orders') or []
+                next_request = self._next_page(page, params, len(orders))
+                pending = executor.submit(self._fetch_page, *next_request) if next_request else None
+                for order in orders:
+                    yield order
+                    yielded += 1
+                    if max_orders and yielded >= int(max_orders):
+                        return
+        finally:
+            if pending is not None:
+                pending.cancel()
+            executor.shutdown(wait=False)
+
+    def _fetch_page(self, url: str, params: Optional[Dict]) -> Dict:
+        response = self.request('GET', url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def _next_page(self, page: Dict, params: Dict, count: int) -> Optional[tuple]:
+        """Returns the (url, params) of the page after `page`, None on the last page."""
+        if not count:
+            return None
+        if page.get('next'):
+            return page['next'], None
+        offset = int(page.get('offset', params.get('offset', 0))) + count
+        if 'total' in page and offset >= int(page['total']):
+            return None
+        if 'total' not in page and count < int(params.get('limit', count)):
+            return None
+        return self.url('get_orders'), dict(params, offset=str(offset))
+
+    def close(self) -> None:
+        """Closes the pooled connections."""
+        self.session.close()
+
+    def __repr__(self):
+        return f"FulfillmentClient({self.base_url!r})"
+
+
+def _never_sent(error: requests.RequestException) -> bool:
+    """Returns True when the connection could not be opened, so the request never reached the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
@@ -0,0 +1,333 @@
+"""
+Local stub of the eBay Fulfillment API for load and offline tests.
+
+It serves getOrder, getOrders (pagination, creationdate filter, orderIds) and
+issueRefund over a generated set of orders, answering with the error messages of
+`variables.py`. Latency, 5xx errors and 429 rate limiting can be injected. A fake
+OAuth token endpoint mints short-lived tokens, which the API can be told to check.
+
+Usage:
+    python fulfillment_stub.py --port 8080 --orders 5000 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from api_endpoints import MAX_ORDER_IDS
+from http_replay import describe_request
+from variables import (ERROR_INVALID_ORDER_ID, ERROR_INVALID_TOKEN, ERROR_ORDER_NOT_FOUND,
+                       ERROR_UNAUTHORIZED, VALID_ORDER_ID)
+
+
+# Largest page accepted by getOrders
+MAX_LIMIT = 200
+
+TOKEN_PATH = '/identity/v1/oauth2/token'
+
+_DATE_FILTER = re.compile(r'^creationdate:\[(.*?)\.\.(.*?)\]$')
+
+
+def order_id(index: int) -> str:
+    """Returns the id of the n-th generated order; the first one is `VALID_ORDER_ID`."""
+    return f"{(int(VALID_ORDER_ID) + index) % 10 ** 20:020d}"
+
+
+def _error(status: int, message: str, error_id: int, headers: Optional[Dict] = None) -> Tuple[int, Dict, Dict]:
+    """Returns the status, headers and body of an eBay-style error response."""
+    return status, headers or {}, {'errors': [{'errorId': error_id, 'domain': 'API_FULFILLMENT',
+                                               'category': 'REQUEST', 'message': message}]}
+
+
+class FulfillmentStubServer:
+    """
+    Threaded HTTP stub of the Fulfillment API.
+
+    Every request first waits `latency_ms` plus up to `jitter_ms`, then fails with
+    a 500 with probability `error_rate` or a 429 with probability
+    `rate_limit_rate`. Requests without a bearer token get a 401; with
+    `check_tokens`, so do requests whose token was not minted by `TOKEN_PATH` or
+    has expired.
+    """
+
+    def __init__(self, orders: int = 1000, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 42,
+                 host: str = '127.0.0.1', port: int = 0,
+                 base_path: str = '/sell/fulfillment/v1', client_id: str = 'stub-client',
+                 client_secret: str = 'stub-secret', token_lifetime: int = 7200,
+                 check_tokens: bool = False):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.error_rate = float(error_rate)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.base_path = base_path.rstrip('/')
+        self.random = random.Random(seed)
+        self.orders = self._generate_orders(int(orders))
+        self.order_ids = list(self.orders)
+        self.refunds: List[Dict] = []
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_lifetime = int(token_lifetime)
+        self.check_tokens = check_tokens
+        self.tokens: Dict[str, float] = {}
+        self.tokens_minted = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, int(port)), self._handler_class())
+        self._server.daemon_threads = True
+        self._serving = False
+
+    @property
+    def url(self) -> str:
+        """Root of the API, e.g. http://127.0.0.1:8080/sell/fulfillment/v1."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{self.base_path}"
+
+    @property
+    def token_url(self) -> str:
+        """URL of the fake OAuth token endpoint."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{TOKEN_PATH}"
+
+    def revoke_tokens(self) -> None:
+        """Makes every minted token invalid, as after a revocation."""
+        with self._lock:
+            self.tokens.clear()
+
+    def start(self) -> str:
+        """Serves requests in a background thread and returns the API root URL."""
+        self._serving = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='fulfillment-stub').start()
+        return self.url
+
+    def serve_forever(self) -> None:
+        self._serving = True
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        if self._serving:
+            self._server.shutdown()
+            self._serving = False
+        self._server.server_close()
+
+    # Generated data
+
+    def _generate_orders(self, count: int) -> Dict[str, Dict]:
+        start = datetime(2024, 1, 1)
+        orders = {}
+        for index in range(count):
+            created = start + timedelta(seconds=self.random.randrange(366 * 24 * 3600))
+            quantity = self.random.randint(1, 3)
+            price = self.random.randint(500, 20000) / 100
+            identifier = order_id(index)
+            orders[identifier] = {
+                'orderId': identifier,
+                'legacyOrderId': f"{110000000000 + index}-{220000000000 + index}",
+                'creationDate': created.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'orderFulfillmentStatus': self.random.choice(['NOT_STARTED', 'IN_PROGRESS', 'FULFILLED']),
+                'orderPaymentStatus': 'PAID',
+                'buyer': {'username': f"buyer_{index % 997}"},
+                'pricingSummary': {'total': {'value': f"{price * quantity:.2f}", 'currency': 'USD'}},
+                'lineItems': [{
+                    'lineItemId': str(10000000000 + index),
+                    'legacyItemId': str(20000000000 + index),
+                    'title': f"Item {index}",
+                    'quantity': quantity,
+                    'total': {'value': f"{price * quantity:.2f}", 'currency': 'USD'},
+                }],
+            }
+        return dict(sorted(orders.items(), key=lambda item: item[1]['creationDate']))
+
+    # Request handling
+
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: Optional[bytes]) -> Tuple[int, Dict, Dict]:
+        """Returns the status, extra headers and JSON body answering a request."""
+        with self._lock:
+            self.requests += 1
+            roll = self.random.random()
+            delay = self.latency_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if roll < self.error_rate:
+            return _error(500, 'There was a problem with an eBay internal system or process.', 2003)
+        if roll < self.error_rate + self.rate_limit_rate:
+            return _error(429, 'Too many requests', 2005, {'Retry-After': '0'})
+
+        parts = urlsplit(path)
+        if method.upper() == 'POST' and parts.path == TOKEN_PATH:
+            return self._mint_token(headers, body)
+
+        authorization = headers.get('Authorization', '')
+        if not authorization.startswith('Bearer ') or not authorization[len('Bearer '):].strip():
+            return _error(401, ERROR_UNAUTHORIZED, 1001)
+        if self.check_tokens:
+            expires_at = self.tokens.get(authorization[len('Bearer '):].strip())
+            if expires_at is None or time.time() >= expires_at:
+                return _error(401, ERROR_INVALID_TOKEN, 1001)
+
+        if not parts.path.startswith(self.base_path):
+            return _error(404, f"Unknown resource {parts.path}", 2002)
+        description = describe_request(method, parts.path)
+        params = dict(parse_qsl(parts.query))
+        endpoint = (method.upper(), description['endpoint'])
+        if endpoint == ('GET', 'get_order'):
+            return self._get_order(description['path_params']['order_id'])
+        if endpoint == ('GET', 'get_orders'):
+            return self._get_orders(params)
+        if endpoint == ('POST', 'issue_refund'):
+            return self._issue_refund(description['path_params']['order_id'], body)
+        return _error(404, f"Unknown resource {method} {parts.path}", 2002)
+
+    def _mint_token(self, headers: Dict[str, str], body: Optional[bytes]) -> Tuple[int, Dict, Dict]:
+        expected = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode('utf-8')).decode('ascii')
+        if headers.get('Authorization') != f"Basic {expected}":
+            return 401, {}, {'error': 'invalid_client', 'error_description': 'client authentication failed'}
+        form = dict(parse_qsl((body or b'').decode('utf-8')))
+        if form.get('grant_type') not in ('client_credentials', 'refresh_token'):
+            return 400, {}, {'error': 'unsupported_grant_type'}
+        with self._lock:
+            self.tokens_minted += 1
+            access_token = f"v^1.1#i^1#stub-{self.tokens_minted}-{self.random.getrandbits(64):016x}"
+            self.tokens[access_token] = time.time() + self.token_lifetime
+        return 200, {}, {'access_token': access_token, 'expires_in': self.token_lifetime,
+                         'token_type': 'User Access Token'}
+
+    def _get_order(self, identifier: str) -> Tuple[int, Dict, Dict]:
+        if not identifier.isdigit():
+            return _error(400, ERROR_INVALID_ORDER_ID, 32100)
+        order = self.orders.get(identifier)
+        if order is None:
+            return _error(404, ERROR_ORDER_NOT_FOUND, 32200)
+        return 200, {}, order
+
+    def _get_orders(self, params: Dict[str, str]) -> Tuple[int, Dict, Dict]:
+        try:
+            limit = int(params.get('limit', 50))
+            offset = int(params.get('offset', 0))
+        except ValueError:
+            return _error(400, 'Invalid limit or offset', 30700)
+        if not 1 <= limit <= MAX_LIMIT or offset < 0:
+            return _error(400, 'Invalid limit or offset', 30700)
+
+        if params.get('orderIds'):
+            identifiers = [identifier for identifier in params['orderIds'].split(',') if identifier]
+            if len(identifiers) > MAX_ORDER_IDS:
+                return _error(400, f"At most {MAX_ORDER_IDS} orderIds", 30850)
+            if not all(identifier.isdigit() for identifier in identifiers):
+                return _error(400, ERROR_INVALID_ORDER_ID, 32100)
+            found = [self.orders[identifier] for identifier in identifiers if identifier in self.orders]
+            payload = {'href': f"{self.base_path}/order?orderIds={params['orderIds']}",
+                       'total': len(found), 'limit': limit, 'offset': 0, 'orders': found}
+            warnings = [
+                {'errorId': 32200, 'domain': 'API_FULFILLMENT', 'category': 'REQUEST',
+                 'message': ERROR_ORDER_NOT_FOUND, 'parameters': [{'name': 'orderId', 'value': identifier}]}
+                for identifier in identifiers if identifier not in self.orders
+            ]
+            if warnings:
+                payload['warnings'] = warnings
+            return 200, {}, payload
+
+        orders = list(self.orders.values())
+        if params.get('filter'):
+            match = _DATE_FILTER.match(params['filter'])
+            if match is None:
+                return _error(400, 'Invalid filter', 30800)
+            low, high = match.groups()
+            orders = [order for order in orders
+                      if (not low or order['creationDate'] >= low) and (not high or order['creationDate'] <= high)]
+        page = orders[offset:offset + limit]
+        payload = {
+            'href': f"{self.base_path}/order?limit={limit}&offset={offset}",
+            'total': len(orders),
+            'limit': limit,
+            'offset': offset,
+            'orders': page,
+        }
+        if offset + limit < len(orders):
+            query = dict(params, limit=str(limit), offset=str(offset + limit))
+            payload['next'] = f"{self.url}/order?" + '&'.join(f"{key}={value}" for key, value in query.items())
+        return 200, {}, payload
+
+    def _issue_refund(self, identifier: str, body: Optional[bytes]) -> Tuple[int, Dict, Dict]:
+        if not identifier.isdigit():
+            return _error(400, ERROR_INVALID_ORDER_ID, 32100)
+        if identifier not in self.orders:
+            return _error(404, ERROR_ORDER_NOT_FOUND, 32200)
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return _error(400, 'Invalid JSON body', 32500)
+        if not payload.get('reasonForRefund'):
+            return _error(400, 'Missing field reasonForRefund', 32500)
+        with self._lock:
+            refund_id = f"5{len(self.refunds):09d}"
+            self.refunds.append({'orderId': identifier, 'refundId': refund_id, 'request': payload})
+        return 200, {}, {'refundId': refund_id, 'refundStatus': 'PENDING'}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately: do not let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else None
+                status, headers, payload = stub.handle(self.command, self.path, dict(self.headers), body)
+                content = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_POST = do_GET
+
+        return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local stub of the eBay Fulfillment API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--client-id', default='stub-client')
+    parser.add_argument('--client-secret', default='stub-secret')
+    parser.add_argument('--token-lifetime', type=int, default=7200, help="Seconds a minted token is valid")
+    parser.add_argument('--check-tokens', action='store_true', help="Only accept tokens minted by the stub")
+    args = parser.parse_args(argv)
+
+    stub = FulfillmentStubServer(args.orders, args.latency_ms, args.jitter_ms, args.error_rate,
+                                 args.rate_limit_rate, args.seed, args.host, args.port,
+                                 client_id=args.client_id, client_secret=args.client_secret,
+                                 token_lifetime=args.token_lifetime, check_tokens=args.check_tokens)
+    print(f"Fulfillment stub on {stub.url} ({len(stub.orders)} orders), tokens from {stub.token_url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
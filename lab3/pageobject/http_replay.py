@@ -0,0 +1,368 @@
+"""
+Record/replay layer for the eBay Fulfillment API tests.
+
+Exchanges are keyed by method, `ENDPOINTS` template, path parameters, normalised
+query parameters and canonical JSON body. The host and the Authorization header
+are not part of the key, so recordings made against the sandbox replay against
+any base URL and with any token.
+
+Two ways to use it:
+- `RecordReplayAdapter`, mounted on a `requests` session (in-process)
+- `ReplayServer`, a local HTTP stub for tests using RequestsLibrary; in record
+  mode it forwards to the real API and stores what it gets back
+
+Usage:
+    python http_replay.py --store recordings --port 8080 --mode replay
+    python http_replay.py --store recordings --port 8080 --mode record \\
+        --upstream https://api.sandbox.ebay.com
+    robot --variable BASE_URL:http://127.0.0.1:8080/sell/fulfillment/v1 lab3/testcases
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from api_endpoints import ENDPOINTS
+
+
+MODES = ('record', 'replay', 'auto')
+
+# Response headers that describe the original transfer, not the content
+_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-encoding', 'content-length',
+                'set-cookie', 'date'}
+
+# Templates matched longest first, so /order/{id}/issue_refund wins over /order/{id}
+_TEMPLATES: List[Tuple[str, re.Pattern]] = [
+    (name, re.compile(re.sub(r'\\\{(\w+)\\\}', r'(?P<\1>[^/]+)', re.escape(template)) + '$'))
+    for name, template in sorted(ENDPOINTS.items(), key=lambda item: -len(item[1]))
+]
+
+
+class ReplayMiss(requests.RequestException):
+    """Raised in replay mode for a request that was never recorded (never retried)."""
+
+
+def describe_request(method: str, url: str, body: Any = None) -> Dict[str, Any]:
+    """Returns the parts of a request that identify a recorded exchange."""
+    parts = urlsplit(url)
+    endpoint, path_params = parts.path, {}
+    for name, pattern in _TEMPLATES:
+        match = pattern.search(parts.path)
+        if match:
+            endpoint, path_params = name, match.groupdict()
+            break
+    params = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=False))
+
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    if body:
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+        except ValueError:
+            pass
+    return {
+        'method': method.upper(),
+        'endpoint': endpoint,
+        'path_params': path_params,
+        'params': params,
+        'body': body or None,
+    }
+
+
+def request_key(description: Dict[str, Any]) -> str:
+    """Returns the store key of a described request."""
+    canonical = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class CassetteStore:
+    """
+    Append-only store of recorded exchanges with an offset index.
+
+    Exchanges are appended to `exchanges.jsonl`; `index.json` maps each key to the
+    offset and length of its latest exchange, so a replay reads one line with a
+    single seek. An index missing or older than the data file (e.g. after a crash)
+    is rebuilt by scanning the data file once.
+    """
+
+    DATA_FILE = 'exchanges.jsonl'
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, self.DATA_FILE)
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the latest exchange recorded under a key, None when there is none."""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            with open(self.data_path, 'rb') as data:
+                data.seek(location[0])
+                return json.loads(data.read(location[1]))
+
+    def put(self, key: str, request: Dict[str, Any], response: Dict[str, Any]) -> None:
+        """Appends an exchange; it replaces earlier ones with the same key."""
+        line = json.dumps({
+            'key': key,
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+            'request': request,
+            'response': response,
+        }).encode('utf-8')
+        with self._lock:
+            with open(self.data_path, 'ab') as data:
+                offset = data.tell()
+                data.write(line + b'\n')
+            self._index[key] = (offset, len(line))
+            self._dirty = True
+
+    def flush(self) -> None:
+        """Writes the index next to the data file."""
+        with self._lock:
+            if not self._dirty:
+                return
+            size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+            temporary = self.index_path + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as index:
+                json.dump({'data_size': size, 'entries': self._index}, index)
+            os.replace(temporary, self.index_path)
+            self._dirty = False
+
+    def _load_index(self) -> None:
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as index:
+                stored = json.load(index)
+            if stored.get('data_size') == size:
+                self._index = {key: tuple(location) for key, location in stored['entries'].items()}
+                return
+        offset = 0
+        if size:
+            with open(self.data_path, 'rb') as data:
+                for line in data:
+                    if line.strip():
+                        self._index[json.loads(line)['key']] = (offset, len(line.rstrip(b'\n')))
+                    offset += len(line)
+        self._dirty = True
+        self.flush()
+
+
+def serialise_response(status: int, reason: str, headers: Any, content: bytes) -> Dict[str, Any]:
+    """Returns the stored form of a response."""
+    try:
+        body, encoding = content.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        body, encoding = base64.b64encode(content).decode('ascii'), 'base64'
+    return {
+        'status': status,
+        'reason': reason,
+        'headers': {name: value for name, value in headers.items() if name.lower() not in _HOP_HEADERS},
+        'body': body,
+        'encoding': encoding,
+    }
+
+
+def response_content(stored: Dict[str, Any]) -> bytes:
+    """Returns the body of a stored response."""
+    if stored['encoding'] == 'base64':
+        return base64.b64decode(stored['body'])
+    return stored['body'].encode('utf-8')
+
+
+class RecordReplayAdapter(HTTPAdapter):
+    """
+    Transport adapter recording exchanges to, or replaying them from, a `CassetteStore`.
+
+    Modes:
+    - record: always calls the network and stores the response
+    - replay: only serves stored responses; unknown requests raise `ReplayMiss`
+    - auto: serves stored responses and records the missing ones
+    """
+
+    def __init__(self, store: CassetteStore, mode: str = 'replay', **kwargs):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}'. Use one of: {', '.join(MODES)}")
+        super().__init__(**kwargs)
+        self.store = store
+        self.mode = mode
+        self.hits = 0
+        self.recorded = 0
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        description = describe_request(request.method, request.url, request.body)
+        key = request_key(description)
+        if self.mode != 'record':
+            stored = self.store.get(key)
+            if stored is not None:
+                self.hits += 1
+                return self._build_response(request, stored['response'])
+            if self.mode == 'replay':
+                raise ReplayMiss(f"No recorded response for {description['method']} "
+                                 f"{description['endpoint']} {description['path_params']} "
+                                 f"{description['params']}", request=request)
+
+        response = super().send(request, **kwargs)
+        self.store.put(key, description, serialise_response(
+            response.status_code, response.reason, response.headers, response.content
+        ))
+        self.recorded += 1
+        return response
+
+    def close(self) -> None:
+        self.store.flush()
+        super().close()
+
+    @staticmethod
+    def _build_response(request: requests.PreparedRequest, stored: Dict[str, Any]) -> requests.Response:
+        response = requests.Response()
+        response.status_code = stored['status']
+        response.reason = stored['reason']
+        response.headers = CaseInsensitiveDict(stored['headers'])
+        response._content = response_content(stored)
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+
+class ReplayServer:
+    """
+    Local HTTP stub serving recorded exchanges.
+
+    In record and auto modes, requests missing from the store are forwarded to
+    `upstream` and their responses stored. Misses in replay mode get a 501
+    response with an `X-Replay-Miss` header, never confused with an API error.
+    """
+
+    def __init__(self, store: CassetteStore, mode: str = 'replay', upstream: Optional[str] = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}'. Use one of: {', '.join(MODES)}")
+        if mode != 'replay' and not upstream:
+            raise ValueError(f"Mode '{mode}' needs an upstream URL to record from")
+        self.store = store
+        self.mode = mode
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self._session = requests.Session()
+        self._server = ThreadingHTTPServer((host, int(port)), self._handler_class())
+        self._serving = False
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serves requests in a background thread and returns the server URL."""
+        self._serving = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='replay-server').start()
+        return self.url
+
+    def serve_forever(self) -> None:
+        self._serving = True
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        # shutdown() waits for serve_forever() to return, so it must have been started
+        if self._serving:
+            self._server.shutdown()
+            self._serving = False
+        self._server.server_close()
+        self._session.close()
+        self.store.flush()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately: do not let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._serve()
+
+            do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = do_GET
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else None
+                description = describe_request(self.command, self.path, body)
+                key = request_key(description)
+                stored = server.store.get(key)['response'] if server.mode != 'record' and key in server.store else None
+                if stored is None and server.mode == 'replay':
+                    miss = json.dumps({'errors': [{'message': 'No recorded response', 'request': description}]})
+                    stored = serialise_response(501, 'Not Implemented', {
+                        'Content-Type': 'application/json', 'X-Replay-Miss': '1'
+                    }, miss.encode('utf-8'))
+                elif stored is None:
+                    stored = server._forward(self.command, self.path, dict(self.headers), body)
+                    server.store.put(key, description, stored)
+                self._reply(stored)
+
+            def _reply(self, stored):
+                content = response_content(stored)
+                self.send_response(stored['status'], stored.get('reason'))
+                for name, value in stored['headers'].items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(content)
+
+        return Handler
+
+    def _forward(self, method: str, path: str, headers: Dict[str, str], body: Optional[bytes]) -> Dict[str, Any]:
+        headers = {name: value for name, value in headers.items() if name.lower() not in ('host', 'content-length')}
+        response = self._session.request(method, self.upstream + path, headers=headers, data=body, timeout=60)
+        return serialise_response(response.status_code, response.reason, response.headers, response.content)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local stub server replaying recorded eBay API exchanges.")
+    parser.add_argument('--store', required=True, help="Directory of the recordings")
+    parser.add_argument('--mode', choices=MODES, default='replay')
+    parser.add_argument('--upstream', help="API host recorded from, e.g. https://api.sandbox.ebay.com")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    server = ReplayServer(CassetteStore(args.store), args.mode, args.upstream, args.host, args.port)
+    print(f"{args.mode} server on {server.url} ({len(server.store)} recorded exchange(s))")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+Concurrent load test of the eBay Fulfillment API.
+
+Runs a weighted mix of getOrder, getOrders and issueRefund calls, built from
+`ENDPOINTS`, `GET_ORDERS_PARAMS` and `REFUND_PAYLOAD_TEMPLATE`, and reports
+throughput, latency percentiles and errors as JSON.
+
+Two modes:
+- closed loop (default): `concurrency` workers send a request as soon as their
+  previous one is answered
+- open loop (`rate` > 0): requests start at a fixed rate whatever the response
+  times, with at most `concurrency` in flight; latency is measured from the
+  scheduled start, so time spent waiting for a free worker is counted
+
+Without a base URL, the bundled stub server (`fulfillment_stub.py`) is started
+with the requested latency and error rates.
+
+Usage:
+    python load_test.py --duration 10 --concurrency 16 --latency-ms 20 --error-rate 0.02
+    python load_test.py --rate 200 --requests 5000 --mix get_order=8,issue_refund=2 --output report.json
+    python load_test.py --base-url https://api.sandbox.ebay.com/sell/fulfillment/v1 --token $TOKEN --duration 30
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from fulfillment_client import FulfillmentClient
+from fulfillment_stub import FulfillmentStubServer
+from variables import REQUEST_TIMEOUT, VALID_ORDER_ID
+
+
+OPERATIONS = ('get_order', 'get_orders', 'issue_refund')
+
+DEFAULT_MIX = {'get_order': 6, 'get_orders': 3, 'issue_refund': 1}
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(mix: Union[str, Dict[str, float], None]) -> Dict[str, float]:
+    """
+    Parses an operation mix such as "get_order=6,get_orders=3,issue_refund=1".
+
+    Raises:
+        ValueError: For an unknown operation, a negative weight or an empty mix
+    """
+    if mix is None or mix == '':
+        return dict(DEFAULT_MIX)
+    if isinstance(mix, str):
+        entries = {}
+        for entry in mix.split(','):
+            name, _, weight = entry.partition('=')
+            entries[name.strip()] = weight.strip() or '1'
+        mix = entries
+    weights = {}
+    for name, weight in mix.items():
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}'. Use one of: {', '.join(OPERATIONS)}")
+        weights[name] = float(weight)
+        if weights[name] < 0:
+            raise ValueError(f"Negative weight for '{name}'")
+    if not sum(weights.values()):
+        raise ValueError("The operation mix has no positive weight")
+    return {name: weight for name, weight in weights.items() if weight}
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Returns min, mean, percentiles and max of latencies given in seconds, in milliseconds."""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    summary = {'min': ordered[0], 'mean': sum(ordered) / len(ordered)}
+    for percentile in PERCENTILES:
+        # Nearest-rank percentile
+        rank = max(1, -(-percentile * len(ordered) // 100))
+        summary[f"p{percentile}"] = ordered[rank - 1]
+    summary['max'] = ordered[-1]
+    return {name: round(value * 1000, 3) for name, value in summary.items()}
+
+
+class LoadTest:
+    """
+    Load test of one Fulfillment API root.
+
+    The run stops after `duration` seconds or `requests` requests, whichever comes
+    first. Retries are disabled by default so that the report shows what the
+    server answered, not what the client recovered from.
+    """
+
+    def __init__(self, base_url: str, access_token: str = 'load-test',
+                 mix: Union[str, Dict[str, float], None] = None, concurrency: int = 8,
+                 rate: float = 0.0, duration: float = 10.0, requests: int = 0,
+                 order_ids: Optional[List[str]] = None, retry_count: int = 0,
+                 timeout: float = REQUEST_TIMEOUT, seed: Optional[int] = None):
+        """
+        Args:
+            base_url: API root, e.g. http://127.0.0.1:8080/sell/fulfillment/v1
+            access_token: OAuth access token
+            mix: Relative weight of each operation
+            concurrency: Workers, i.e. maximum requests in flight
+            rate: Requests started per second (0 = closed loop)
+            duration: Seconds to run (0 = until `requests` are sent)
+            requests: Requests to send (0 = until `duration` is over)
+            order_ids: Orders used by getOrder and issueRefund (default: `VALID_ORDER_ID`)
+            retry_count: Client retries of 429, 5xx and unreachable calls
+            timeout: Seconds to wait for a response
+            seed: Seed of the operation and order choices
+        """
+        if not float(duration) and not int(requests):
+            raise ValueError("Set a duration or a number of requests")
+        if int(concurrency) < 1:
+            raise ValueError("Concurrency must be at least 1")
+        self.base_url = base_url
+        self.access_token = access_token
+        self.mix = parse_mix(mix)
+        self.concurrency = int(concurrency)
+        self.rate = float(rate)
+        self.duration = float(duration)
+        self.requests = int(requests)
+        self.order_ids = list(order_ids or [VALID_ORDER_ID])
+        self.retry_count = int(retry_count)
+        self.timeout = float(timeout)
+        self.random = random.Random(seed)
+        self._operations = list(self.mix)
+        self._weights = [self.mix[name] for name in self._operations]
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._latencies: Dict[str, List[float]] = {name: [] for name in self._operations}
+        self._outcomes: Dict[str, Dict[str, int]] = {name: {} for name in self._operations}
+
+    def run(self) -> Dict:
+        """Runs the load test and returns its report."""
+        client = FulfillmentClient(access_token=self.access_token, base_url=self.base_url,
+                                   timeout=self.timeout, retry_count=self.retry_count,
+                                   pool_size=self.concurrency)
+        started = time.perf_counter()
+        deadline = started + self.duration if self.duration else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='load-test') as pool:
+                if self.rate:
+                    futures = self._run_open_loop(pool, client, started, deadline)
+                else:
+                    futures = [pool.submit(self._run_worker, client, deadline)
+                               for _ in range(self.concurrency)]
+            for future in futures:
+                # Re-raises a failure of the load test itself instead of reporting a short run
+                future.result()
+            elapsed = time.perf_counter() - started
+            return self._report(elapsed, client.retries)
+        finally:
+            client.close()
+
+    # Scheduling
+
+    def _next_request(self, deadline: Optional[float]) -> Optional[Tuple[str, str]]:
+        """Returns the next (operation, order id), or None once the run is over."""
+        with self._lock:
+            if self.requests and self._sent >= self.requests:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            self._sent += 1
+            operation = self.random.choices(self._operations, self._weights)[0]
+            return operation, self.random.choice(self.order_ids)
+
+    def _run_worker(self, client: FulfillmentClient, deadline: Optional[float]) -> None:
+        while True:
+            request = self._next_request(deadline)
+            if request is None:
+                return
+            self._execute(client, *request, time.perf_counter())
+
+    def _run_open_loop(self, pool: ThreadPoolExecutor, client: FulfillmentClient,
+                       started: float, deadline: Optional[float]) -> List[Future]:
+        interval = 1.0 / self.rate
+        futures = []
+        while True:
+            scheduled = started + len(futures) * interval
+            if deadline is not None and scheduled >= deadline:
+                return futures
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            request = self._next_request(None)
+            if request is None:
+                return futures
+            futures.append(pool.submit(self._execute, client, *request, scheduled))
+
+    # Measurement
+
+    def _execute(self, client: FulfillmentClient, operation: str, order_id: str, started: float) -> None:
+        try:
+            if operation == 'get_order':
+                response = client.get_order(order_id)
+            elif operation == 'get_orders':
+                response = client.get_orders()
+            else:
+                response = client.issue_refund(order_id)
+            outcome = str(response.status_code)
+        except Exception as e:
+            # Any failure of the call is an outcome of the run, reported under its class name
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies[operation].append(elapsed)
+            self._outcomes[operation][outcome] = self._outcomes[operation].get(outcome, 0) + 1
+
+    def _report(self, elapsed: float, retries: int) -> Dict:
+        operations = {}
+        errors: Dict[str, int] = {}
+        for operation in self._operations:
+            outcomes = self._outcomes[operation]
+            failed = {outcome: count for outcome, count in outcomes.items() if not outcome.startswith('2')}
+            for outcome, count in failed.items():
+                errors[outcome] = errors.get(outcome, 0) + count
+            count = len(self._latencies[operation])
+            operations[operation] = {
+                'requests': count,
+                'errors': sum(failed.values()),
+                'throughput_rps': round(count / elapsed, 3) if elapsed else 0.0,
+                'latency_ms': latency_summary(self._latencies[operation]),
+                'outcomes': dict(sorted(outcomes.items())),
+            }
+        total = sum(entry['requests'] for entry in operations.values())
+        failed_total = sum(errors.values())
+        return {
+            'base_url': self.base_url,
+            'mode': 'open' if self.rate else 'closed',
+            'concurrency': self.concurrency,
+            'target_rate_rps': self.rate,
+            'mix': self.mix,
+            'duration_s': round(elapsed, 3),
+            'requests': total,
+            'errors': failed_total,
+            'error_rate': round(failed_total / total, 4) if total else 0.0,
+            'throughput_rps': round(total / elapsed, 3) if elapsed else 0.0,
+            'retries': retries,
+            'latency_ms': latency_summary([latency for latencies in self._latencies.values()
+                                           for latency in latencies]),
+            'error_breakdown': dict(sorted(errors.items(), key=lambda item: -item[1])),
+            'operations': operations,
+        }
+
+
+def run_load_test(base_url: Optional[str] = None, output_path: Optional[str] = None,
+                  stub_options: Optional[Dict] = None, **options) -> Dict:
+    """
+    Runs a `LoadTest`, against the bundled stub server when no base URL is given.
+
+    Args:
+        base_url: API root to load (default: a stub started for the run)
+        output_path: JSON file receiving the report
+        stub_options: `FulfillmentStubServer` arguments, e.g. latency_ms and error_rate
+        options: `LoadTest` arguments
+
+    Returns:
+        The report, with the stub settings under `stub` when one was used
+    """
+    stub = None
+    if base_url is None:
+        stub = FulfillmentStubServer(**(stub_options or {}))
+        base_url = stub.start()
+        options.setdefault('order_ids', stub.order_ids[:100])
+    try:
+        report = LoadTest(base_url, **options).run()
+    finally:
+        if stub is not None:
+            stub.stop()
+    if stub is not None:
+        report['stub'] = {'orders': len(stub.orders), 'latency_ms': stub.latency_ms,
+                          'jitter_ms': stub.jitter_ms, 'error_rate': stub.error_rate,
+                          'rate_limit_rate': stub.rate_limit_rate}
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Concurrent load test of the eBay Fulfillment API.")
+    parser.add_argument('--base-url', help="API root (default: the bundled stub server)")
+    parser.add_argument('--token', default='load-test', help="OAuth access token")
+    parser.add_argument('--mix', default='get_order=6,get_orders=3,issue_refund=1')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0.0, help="Requests per second (0 = closed loop)")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds (0 = until --requests)")
+    parser.add_argument('--requests', type=int, default=0, help="Requests to send (0 = until --duration)")
+    parser.add_argument('--order-id', action='append', dest='order_ids', help="Order id (repeatable)")
+    parser.add_argument('--retry-count', type=int, default=0)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="JSON file receiving the report")
+    stub = parser.add_argument_group('stub server')
+    stub.add_argument('--orders', type=int, default=1000)
+    stub.add_argument('--latency-ms', type=float, default=0)
+    stub.add_argument('--jitter-ms', type=float, default=0)
+    stub.add_argument('--error-rate', type=float, default=0.0)
+    stub.add_argument('--rate-limit-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    options = {'access_token': args.token, 'mix': args.mix, 'concurrency': args.concurrency,
+               'rate': args.rate, 'duration': args.duration, 'requests': args.requests,
+               'retry_count': args.retry_count, 'seed': args.seed}
+    if args.order_ids:
+        options['order_ids'] = args.order_ids
+    stub_options = {'orders': args.orders, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+                    'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate}
+    report = run_load_test(args.base_url, args.output, stub_options, **options)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Coalescing of getOrder lookups into batched getOrders requests.
+
+Lookups issued within `window` seconds of each other, up to `MAX_ORDER_IDS`, are
+sent as one `getOrders?orderIds=...` request, and each caller gets its own order
+back. An id the API does not return fails that caller alone with
+`OrderNotFoundError`, as getOrder would have.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from api_endpoints import MAX_ORDER_IDS
+from fulfillment_client import FulfillmentClient
+from variables import ERROR_ORDER_NOT_FOUND
+
+
+class OrderNotFoundError(LookupError):
+    """Raised for an order id the API does not know."""
+
+    def __init__(self, order_id: str):
+        super().__init__(f"{ERROR_ORDER_NOT_FOUND}: {order_id}")
+        self.order_id = order_id
+
+
+class OrderLookupError(Exception):
+    """Raised when the API refuses a lookup for another reason than a missing order."""
+
+    def __init__(self, order_id: str, status_code: int, message: str):
+        super().__init__(f"getOrder {order_id} failed with status {status_code}: {message}")
+        self.order_id = order_id
+        self.status_code = status_code
+
+
+class OrderCoalescer:
+    """
+    Batches concurrent getOrder lookups made through a `FulfillmentClient`.
+
+    The first pending lookup opens a window; the batch is sent when the window
+    closes or as soon as it holds `max_batch` distinct ids, so a lookup waits at
+    most `window` seconds before being sent. Duplicate ids within a batch are
+    requested once. Batches are sent on up to `max_in_flight` threads.
+    """
+
+    def __init__(self, client: FulfillmentClient, window: float = 0.01,
+                 max_batch: int = MAX_ORDER_IDS, max_in_flight: int = 4):
+        """
+        Args:
+            client: Client sending the requests
+            window: Seconds to wait for more lookups after the first pending one
+            max_batch: Distinct ids per getOrders request (at most `MAX_ORDER_IDS`)
+            max_in_flight: getOrders requests sent concurrently
+        """
+        if not 1 <= int(max_batch) <= MAX_ORDER_IDS:
+            raise ValueError(f"max_batch must be between 1 and {MAX_ORDER_IDS}")
+        self.client = client
+        self.window = float(window)
+        self.max_batch = int(max_batch)
+        self.lookups = 0
+        self.requests = 0
+        self._pending: 'OrderedDict[str, List[Future]]' = OrderedDict()
+        self._opened_at = 0.0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=int(max_in_flight), thread_name_prefix='getOrders-batch')
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True, name='getOrder-coalescer')
+        self._dispatcher.start()
+
+    def submit(self, order_id: str) -> Future:
+        """Queues a lookup and returns a future of the order."""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The order coalescer is closed")
+            if not self._pending:
+                self._opened_at = time.monotonic()
+            self._pending.setdefault(str(order_id), []).append(future)
+            self.lookups += 1
+            self._condition.notify()
+        return future
+
+    def get_order(self, order_id: str, timeout: Optional[float] = None) -> Dict:
+        """
+        Returns an order, fetched in a batch with the lookups of other threads.
+
+        Raises:
+            OrderNotFoundError: When the API does not know the order
+            OrderLookupError: When the API refuses the lookup
+            requests.RequestException: When the API cannot be reached
+        """
+        return self.submit(order_id).result(timeout)
+
+    def get_orders(self, order_ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Returns the found orders by id; missing ids are left out.
+
+        Raises:
+            OrderLookupError: When the API refuses a lookup for another reason
+        """
+        futures = [(order_id, self.submit(order_id)) for order_id in order_ids]
+        orders = {}
+        for order_id, future in futures:
+            try:
+                orders[order_id] = future.result()
+            except OrderNotFoundError:
+                continue
+        return orders
+
+    def close(self) -> None:
+        """Sends the pending lookups and stops the dispatcher."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    # Dispatching
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._opened_at + self.window
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = OrderedDict()
+                while self._pending and len(batch) < self.max_batch:
+                    order_id, futures = self._pending.popitem(last=False)
+                    batch[order_id] = futures
+                # Lookups left over open the next window right away
+                self._opened_at = time.monotonic() - self.window if self._pending else 0.0
+                self.requests += 1
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: 'OrderedDict[str, List[Future]]') -> None:
+        try:
+            results = self._fetch(list(batch))
+        except Exception as e:
+            results = {order_id: e for order_id in batch}
+        for order_id, futures in batch.items():
+            result = results.get(order_id) or OrderNotFoundError(order_id)
+            for future in futures:
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _fetch(self, order_ids: List[str]) -> Dict[str, object]:
+        """Returns the order, or the exception to raise, of each id."""
+        if len(order_ids) == 1:
+            return {order_ids[0]: self._fetch_one(order_ids[0])}
+        # orderIds replaces the default creationdate filter and pagination
+        response = self.client.get_orders(orderIds=order_ids, filter=None, offset=None, limit=len(order_ids))
+        if response.status_code == 400:
+            # One malformed id must not fail the lookups of the others
+            with self._condition:
+                self.requests += len(order_ids)
+            return {order_id: self._fetch_one(order_id) for order_id in order_ids}
+        if response.status_code != 200:
+            error = OrderLookupError(','.join(order_ids), response.status_code, _error_message(response))
+            return {order_id: error for order_id in order_ids}
+        return {order['orderId']: order for order in response.json().get('orders') or []}
+
+    def _fetch_one(self, order_id: str) -> object:
+        try:
+            response = self.client.get_order(order_id)
+        except requests.RequestException as e:
+            return e
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code == 404:
+            return OrderNotFoundError(order_id)
+        return OrderLookupError(order_id, response.status_code, _error_message(response))
+
+
+def _error_message(response: requests.Response) -> str:
+    try:
+        errors = response.json().get('errors') or []
+        return errors[0].get('message', response.reason) if errors else response.reason
+    except ValueError:
+        return response.reason
@@ -0,0 +1,225 @@
+"""
+OAuth access-token cache for the eBay APIs.
+
+A token is minted once and reused by every test: it is kept in memory and in an
+on-disk cache shared by the processes of a pabot run, guarded by a file lock so
+that only one process mints at a time. A token is refreshed `refresh_margin`
+seconds before it expires; while one thread refreshes it, the others keep using
+the still valid one.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+from api_endpoints import DEFAULT_HEADERS, FULFILLMENT_SCOPE, TOKEN_ENDPOINTS
+from variables import REQUEST_TIMEOUT
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'ebay_token_cache.json')
+
+# Seconds before expiry at which a token is replaced
+REFRESH_MARGIN = 300
+
+
+class _FileLock:
+    """Exclusive lock on `<path>.lock`, held across processes."""
+
+    def __init__(self, path: str):
+        self.path = path + '.lock'
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after ten seconds
+                    continue
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class TokenManager:
+    """
+    Mints, caches and refreshes an eBay OAuth access token.
+
+    With a `refresh_token` the refresh_token grant is used (user token, as the
+    Fulfillment API requires), otherwise the client_credentials grant.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, environment: str = 'sandbox',
+                 token_url: Optional[str] = None, scope: str = FULFILLMENT_SCOPE,
+                 refresh_token: Optional[str] = None, cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+                 refresh_margin: float = REFRESH_MARGIN, timeout: float = REQUEST_TIMEOUT,
+                 session: Optional[requests.Session] = None):
+        """
+        Args:
+            client_id: Application client id
+            client_secret: Application client secret
+            environment: Key of `TOKEN_ENDPOINTS` (sandbox or production)
+            token_url: Token endpoint overriding the environment (e.g. a local stub)
+            scope: Space-separated OAuth scopes
+            refresh_token: User refresh token
+            cache_path: JSON file shared by parallel workers (None = memory only)
+            refresh_margin: Seconds before expiry at which the token is replaced
+            timeout: Seconds to wait for the token endpoint
+            session: Session to send requests with
+        """
+        if token_url is None and environment not in TOKEN_ENDPOINTS:
+            raise ValueError(f"Unknown environment '{environment}'. Use one of: {', '.join(TOKEN_ENDPOINTS)}")
+        self.token_url = token_url or TOKEN_ENDPOINTS[environment]
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_token = refresh_token
+        self.cache_path = cache_path
+        self.refresh_margin = float(refresh_margin)
+        self.timeout = float(timeout)
+        self.session = session or requests.Session()
+        self.minted = 0
+        self._token: Optional[Dict] = None
+        self._refresh_lock = threading.Lock()
+        # Several applications or users may share the cache file
+        self._cache_key = hashlib.sha256('\n'.join(
+            [self.token_url, client_id, scope, refresh_token or '']).encode('utf-8')).hexdigest()
+
+    def get_token(self) -> str:
+        """
+        Returns a valid access token, minting one only when no worker has a fresh one.
+
+        Raises:
+            requests.HTTPError: When the token endpoint refuses the credentials
+        """
+        token = self._token
+        if token is not None and not self._expiring(token):
+            return token['access_token']
+        if token is not None and not self._expired(token):
+            # Still valid: refresh it unless another thread already does
+            if not self._refresh_lock.acquire(blocking=False):
+                return token['access_token']
+        else:
+            self._refresh_lock.acquire()
+        try:
+            if self._token is not None and not self._expiring(self._token):
+                return self._token['access_token']
+            self._token = self._load_or_mint()
+            return self._token['access_token']
+        finally:
+            self._refresh_lock.release()
+
+    def headers(self) -> Dict[str, str]:
+        """Returns `DEFAULT_HEADERS` with the access token filled in."""
+        access_token = self.get_token()
+        return {name: value.format(access_token=access_token) for name, value in DEFAULT_HEADERS.items()}
+
+    def invalidate(self, access_token: Optional[str] = None) -> None:
+        """
+        Forgets a token the API rejected, in memory and on disk.
+
+        Args:
+            access_token: The rejected token; a newer one minted meanwhile is kept
+        """
+        with self._refresh_lock:
+            if self._token is not None and access_token in (None, self._token['access_token']):
+                self._token = None
+            if self.cache_path is None:
+                return
+            with _FileLock(self.cache_path):
+                entries = self._read_cache()
+                entry = entries.get(self._cache_key)
+                if entry is not None and access_token in (None, entry['access_token']):
+                    del entries[self._cache_key]
+                    self._write_cache(entries)
+
+    # Minting and caching
+
+    def _expiring(self, token: Dict) -> bool:
+        return time.time() >= token['expires_at'] - self.refresh_margin
+
+    @staticmethod
+    def _expired(token: Dict) -> bool:
+        return time.time() >= token['expires_at']
+
+    def _load_or_mint(self) -> Dict:
+        if self.cache_path is None:
+            return self._mint()
+        with _FileLock(self.cache_path):
+            entries = self._read_cache()
+            entry = entries.get(self._cache_key)
+            if entry is not None and not self._expiring(entry):
+                return entry
+            entry = self._mint()
+            entries = {key: value for key, value in entries.items() if not self._expired(value)}
+            entries[self._cache_key] = entry
+            self._write_cache(entries)
+            return entry
+
+    def _mint(self) -> Dict:
+        if self.refresh_token:
+            data = {'grant_type': 'refresh_token', 'refresh_token': self.refresh_token, 'scope': self.scope}
+        else:
+            data = {'grant_type': 'client_credentials', 'scope': self.scope}
+        requested_at = time.time()
+        response = self.session.post(self.token_url, data=data, auth=(self.client_id, self.client_secret),
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        payload = response.json()
+        self.minted += 1
+        return {
+            'access_token': payload['access_token'],
+            # Counted from the request, so that the token is never kept past its real expiry
+            'expires_at': requested_at + float(payload.get('expires_in', 7200)),
+        }
+
+    def _read_cache(self) -> Dict[str, Dict]:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as cache:
+                return json.load(cache)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, entries: Dict[str, Dict]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.token-')
+        try:
+            # Tokens are secrets: readable by the owner only
+            os.chmod(temporary, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as cache:
+                json.dump(entries, cache)
+            os.replace(temporary, self.cache_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+
+    def __repr__(self):
+        return f"TokenManager({self.token_url!r}, client_id={self.client_id!r})"
@@ -0,0 +1,133 @@
+"""
+Robot Framework listener profiling keyword durations while the tests run.
+
+It keeps a stack of the running suites, tests and keywords. When a frame ends,
+its self time (elapsed time minus the time of its children) is added to the
+frame's collapsed stack. At the end of the execution the listener writes:
+
+- `<prefix>.folded`: collapsed stacks ("suite;test;keyword;keyword <microseconds>"),
+  ready for flamegraph.pl, speedscope or inferno
+- `<prefix>_top.txt`: the N keywords with the highest cumulated duration
+
+Nothing is parsed from output.xml, so the cost is a couple of perf_counter calls
+per keyword. Keyword events need Robot Framework 7 or newer. With older versions
+only suites and tests are profiled.
+
+Usage:
+    robot -d results --listener ../tools/KeywordProfiler.py tests/            (from lab1)
+    robot --listener "tools/KeywordProfiler.py:top=30:prefix=crm" lab2/testcases
+"""
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+class KeywordProfiler:
+    ROBOT_LISTENER_API_VERSION = 3
+
+    def __init__(self, top: int = 20, prefix: str = 'keyword_profile', output_dir: Optional[str] = None):
+        """
+        Args:
+            top: Number of keywords listed in the slowest-keyword table
+            prefix: File name prefix of the generated files
+            output_dir: Directory of the generated files (default: the Robot output directory)
+        """
+        self.top = int(top)
+        self.prefix = prefix
+        self.output_dir = output_dir
+        # Each frame is [collapsed stack, start time, time spent in children]
+        self._stack: List[list] = []
+        self._folded: Dict[str, float] = {}
+        self._keywords: Dict[str, List[float]] = {}
+
+    # Suites and tests
+
+    def start_suite(self, data, result):
+        self._push(result.name)
+
+    def end_suite(self, data, result):
+        self._pop()
+
+    def start_test(self, data, result):
+        self._push(result.name)
+
+    def end_test(self, data, result):
+        self._pop()
+
+    # Keywords (Robot Framework 7+)
+
+    def start_keyword(self, data, result):
+        self._push(self._keyword_name(result))
+
+    def end_keyword(self, data, result):
+        name = self._keyword_name(result)
+        elapsed, self_time = self._pop()
+        if result.status == 'NOT RUN':
+            return
+        # count, total, self, max
+        stats = self._keywords.setdefault(name, [0, 0.0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += self_time
+        stats[3] = max(stats[3], elapsed)
+
+    # Output
+
+    def output_file(self, path):
+        if self.output_dir is None:
+            self.output_dir = os.path.dirname(os.path.abspath(str(path)))
+
+    def close(self):
+        output_dir = self.output_dir or os.getcwd()
+        os.makedirs(output_dir, exist_ok=True)
+        folded_path = os.path.join(output_dir, f"{self.prefix}.folded")
+        top_path = os.path.join(output_dir, f"{self.prefix}_top.txt")
+
+        with open(folded_path, 'w', encoding='utf-8') as folded:
+            for stack, seconds in sorted(self._folded.items()):
+                micros = int(seconds * 1_000_000)
+                if micros:
+                    folded.write(f"{stack} {micros}\n")
+
+        with open(top_path, 'w', encoding='utf-8') as table:
+            table.write(self.format_top())
+
+        sys.__stdout__.write(f"Profile: {folded_path}\nTop:     {top_path}\n")
+
+    def format_top(self) -> str:
+        """Returns the slowest keywords by cumulated duration as a text table."""
+        ranked = sorted(self._keywords.items(), key=lambda item: item[1][1], reverse=True)[:self.top]
+        total = sum(seconds for seconds in self._folded.values()) or 1.0
+        width = max([len('Keyword')] + [len(name) for name, _ in ranked])
+        lines = [
+            f"{'Keyword':<{width}}  {'Calls':>7}  {'Total (s)':>10}  {'Self (s)':>10}  "
+            f"{'Mean (ms)':>10}  {'Max (ms)':>10}  {'% run':>6}",
+            '-' * (width + 67),
+        ]
+        for name, (count, elapsed, self_time, longest) in ranked:
+            lines.append(
+                f"{name:<{width}}  {count:>7}  {elapsed:>10.3f}  {self_time:>10.3f}  "
+                f"{elapsed / count * 1000:>10.1f}  {longest * 1000:>10.1f}  {elapsed / total * 100:>5.1f}%"
+            )
+        return '\n'.join(lines) + '\n'
+
+    # Stack handling
+
+    def _push(self, name: str) -> None:
+        name = name.replace(';', ',')
+        stack = f"{self._stack[-1][0]};{name}" if self._stack else name
+        self._stack.append([stack, time.perf_counter(), 0.0])
+
+    def _pop(self):
+        stack, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self_time = max(elapsed - children, 0.0)
+        self._folded[stack] = self._folded.get(stack, 0.0) + self_time
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        return elapsed, self_time
+
+    @staticmethod
+    def _keyword_name(result) -> str:
+        return getattr(result, 'full_name', None) or result.name
@@ -0,0 +1,449 @@
+"""
+Robot Framework library validating API responses and MongoDB documents against JSON Schemas.
+
+Schemas are loaded once from `tools/schemas` (and any extra directory), keyed by
+their `$id` (e.g. `ebay/order`, `fakestore/products`), and refer to each other
+with `$ref`. A validator is compiled the first time a schema is used and cached
+for the rest of the run. Lists of documents are validated in bulk: valid
+documents take the `is_valid` fast path and only invalid ones are explained.
+Very large lists can be split across a pool of worker processes, since
+validation is CPU-bound.
+
+BSON values count as JSON: ObjectIds and dates are strings, lazily decoded
+documents are objects.
+
+Usage:
+    Library    ../../tools/SchemaValidator.py                                  (from lab1/tests or lab3/testcases)
+    Library    ../../tools/SchemaValidator.py    schema_dirs=${CURDIR}/../schemas
+"""
+import json
+import os
+import sys
+import threading
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from jsonschema import Draft202012Validator, validators
+from jsonschema.exceptions import SchemaError
+from referencing import Registry, Resource
+from referencing.jsonschema import DRAFT202012
+from robot.api import logger
+from robot.api.deco import keyword, library
+
+try:
+    from bson import ObjectId
+    _TEXT_TYPES: Tuple[type, ...] = (datetime, ObjectId)
+except ImportError:  # lab3 does not install pymongo
+    _TEXT_TYPES = (datetime,)
+
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas')
+
+# Errors reported per document, and documents reported per failure
+MAX_ERRORS = 10
+MAX_REPORTED_DOCUMENTS = 20
+
+# String keywords applied to the text of ObjectIds and dates
+_TEXT_KEYWORDS = ('minLength', 'maxLength', 'pattern')
+
+_TYPE_CHECKER = Draft202012Validator.TYPE_CHECKER.redefine_many({
+    'string': lambda checker, instance: isinstance(instance, (str,) + _TEXT_TYPES),
+    'object': lambda checker, instance: isinstance(instance, Mapping),
+    'array': lambda checker, instance: isinstance(instance, (list, tuple)),
+})
+
+
+class SchemaRegistry:
+    """Loads schemas once and keeps one compiled validator per schema id."""
+
+    def __init__(self, schema_dirs: Iterable[str] = (SCHEMA_DIR,)):
+        self.schema_dirs = list(schema_dirs)
+        self.schemas: Dict[str, Dict] = {}
+        self._added: Dict[str, Dict] = {}
+        self._validators: Dict[str, Any] = {}
+        self._validator_classes: Dict[type, type] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_key: Optional[tuple] = None
+        for directory in self.schema_dirs:
+            self._load_directory(directory)
+        self._resources = self._build_resources()
+
+    def add(self, schema: Dict, schema_id: Optional[str] = None) -> str:
+        """
+        Registers a schema, replacing any schema with the same id.
+
+        Raises:
+            ValueError: When the schema has no id or is not a valid JSON Schema
+        """
+        schema_id = schema_id or schema.get('$id')
+        if not schema_id:
+            raise ValueError("The schema has no '$id': give a schema_id")
+        schema = dict(schema, **{'$id': schema_id})
+        self._check(schema_id, schema)
+        with self._lock:
+            self.schemas[schema_id] = schema
+            self._added[schema_id] = schema
+            self._resources = self._build_resources()
+            # Other schemas may $ref this one
+            self._validators.clear()
+        return schema_id
+
+    def validator(self, schema_id: str):
+        """Returns the compiled validator of a schema, compiling it on first use."""
+        validator = self._validators.get(schema_id)
+        if validator is not None:
+            return validator
+        if schema_id not in self.schemas:
+            raise ValueError(f"Unknown schema '{schema_id}'. Known schemas: {', '.join(sorted(self.schemas))}")
+        with self._lock:
+            schema = self.schemas[schema_id]
+            cls = validators.validator_for(schema, default=Draft202012Validator)
+            if cls not in self._validator_classes:
+                self._validator_classes[cls] = validators.extend(
+                    cls, {name: _on_text(cls.VALIDATORS[name]) for name in _TEXT_KEYWORDS if name in cls.VALIDATORS},
+                    type_checker=_TYPE_CHECKER)
+            validator = self._validator_classes[cls](schema, registry=self._resources)
+            self._validators[schema_id] = validator
+        return validator
+
+    def errors(self, document: Any, schema_id: str, max_errors: int = MAX_ERRORS) -> List[str]:
+        """Returns the validation errors of a document as "json path: message" strings."""
+        validator = self.validator(schema_id)
+        if validator.is_valid(document):
+            return []
+        messages = []
+        for error in sorted(validator.iter_errors(document), key=lambda error: list(error.absolute_path)):
+            messages.append(f"{error.json_path}: {error.message}")
+            if len(messages) >= max_errors:
+                break
+        return messages
+
+    def validate_many(self, documents: List[Any], schema_id: str, fail_fast: bool = False,
+                      workers: int = 0, chunk_size: int = 0,
+                      max_errors: int = MAX_ERRORS) -> List[Tuple[int, List[str]]]:
+        """
+        Validates documents in bulk.
+
+        Args:
+            documents: Documents to validate
+            schema_id: Id of the schema
+            fail_fast: Stop at the first invalid document
+            workers: Worker processes (0 = validate in this process)
+            chunk_size: Documents per worker task (default: spread over 4 tasks per worker)
+            max_errors: Errors reported per document
+
+        Returns:
+            (index, errors) of each invalid document, by index
+        """
+        self.validator(schema_id)
+        workers = int(workers)
+        if workers <= 0 or len(documents) < 2:
+            return _validate_chunk(self, schema_id, 0, documents, fail_fast, max_errors)
+
+        chunk_size = int(chunk_size) or max(1, -(-len(documents) // (workers * 4)))
+        pool = self._get_pool(workers)
+        pending = {
+            pool.submit(_validate_in_worker, schema_id, start, _plain(documents[start:start + chunk_size]),
+                        fail_fast, max_errors)
+            for start in range(0, len(documents), chunk_size)
+        }
+        invalid: List[Tuple[int, List[str]]] = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                invalid.extend(future.result())
+            if fail_fast and invalid:
+                for future in pending:
+                    future.cancel()
+                break
+        invalid.sort(key=lambda item: item[0])
+        return invalid[:1] if fail_fast else invalid
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._pool_key = None
+
+    # Loading
+
+    def _load_directory(self, directory: str) -> None:
+        if not os.path.isdir(directory):
+            raise ValueError(f"Schema directory not found: {directory}")
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'r', encoding='utf-8') as schema_file:
+                    schema = json.load(schema_file)
+                schema_id = schema.get('$id') or os.path.relpath(path, directory)[:-len('.json')].replace(os.sep, '/')
+                schema.setdefault('$id', schema_id)
+                self._check(schema_id, schema)
+                self.schemas[schema_id] = schema
+
+    @staticmethod
+    def _check(schema_id: str, schema: Dict) -> None:
+        try:
+            validators.validator_for(schema, default=Draft202012Validator).check_schema(schema)
+        except SchemaError as e:
+            raise ValueError(f"Invalid schema '{schema_id}': {e.message}")
+
+    def _build_resources(self) -> Registry:
+        return Registry().with_resources(
+            (schema_id, Resource.from_contents(schema, default_specification=DRAFT202012))
+            for schema_id, schema in self.schemas.items()
+        )
+
+    def _get_pool(self, workers: int) -> ProcessPoolExecutor:
+        key = (workers, json.dumps(self._added, sort_keys=True))
+        if self._pool is None or self._pool_key != key:
+            self.close()
+            # Spawned workers import this module by name
+            module_dir = os.path.dirname(os.path.abspath(__file__))
+            if module_dir not in sys.path:
+                sys.path.append(module_dir)
+            self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                             initargs=(self.schema_dirs, self._added))
+            self._pool_key = key
+        return self._pool
+
+
+def _on_text(validate_keyword):
+    """Wraps a string keyword so that it checks the hex of an ObjectId or the ISO form of a date."""
+    def validate(validator, value, instance, schema):
+        if isinstance(instance, _TEXT_TYPES):
+            instance = instance.isoformat() if isinstance(instance, datetime) else str(instance)
+        return validate_keyword(validator, value, instance, schema)
+    return validate
+
+
+# Worker processes: each one loads the registry once, in its initializer
+
+_WORKER_REGISTRY: Optional[SchemaRegistry] = None
+
+
+def _init_worker(schema_dirs: List[str], added: Dict[str, Dict]) -> None:
+    global _WORKER_REGISTRY
+    _WORKER_REGISTRY = SchemaRegistry(schema_dirs)
+    for schema_id, schema in added.items():
+        _WORKER_REGISTRY.add(schema, schema_id)
+
+
+def _validate_in_worker(schema_id: str, start: int, documents: List[Any], fail_fast: bool,
+                        max_errors: int) -> List[Tuple[int, List[str]]]:
+    return _validate_chunk(_WORKER_REGISTRY, schema_id, start, documents, fail_fast, max_errors)
+
+
+def _validate_chunk(registry: SchemaRegistry, schema_id: str, start: int, documents: List[Any],
+                    fail_fast: bool, max_errors: int) -> List[Tuple[int, List[str]]]:
+    validator = registry.validator(schema_id)
+    invalid = []
+    for offset, document in enumerate(documents):
+        if validator.is_valid(document):
+            continue
+        invalid.append((start + offset, registry.errors(document, schema_id, max_errors)))
+        if fail_fast:
+            break
+    return invalid
+
+
+def _plain(documents: List[Any]) -> List[Any]:
+    """Turns lazily decoded BSON documents into dicts, so that they can be sent to workers."""
+    return [_to_dict(document) if isinstance(document, Mapping) and not isinstance(document, dict) else document
+            for document in documents]
+
+
+def _to_dict(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {key: _to_dict(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_dict(item) for item in value]
+    return value
+
+
+@library(scope='GLOBAL', version='1.0.0')
+class SchemaValidator:
+    """
+    JSON Schema validation of lab3 API responses and lab1 MongoDB documents.
+
+    Bundled schemas: `ebay/order`, `ebay/orders-page`, `ebay/refund-request`,
+    `ebay/refund`, `ebay/amount`, and `fakestore/products`, `fakestore/users`,
+    `fakestore/carts`, `fakestore/categories`.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 3
+
+    def __init__(self, schema_dirs: Optional[str] = None):
+        """
+        Args:
+            schema_dirs: Extra schema directories, separated by commas
+        """
+        self.ROBOT_LIBRARY_LISTENER = self
+        extra = [directory.strip() for directory in (schema_dirs or '').split(',') if directory.strip()]
+        self.registry = SchemaRegistry([SCHEMA_DIR] + extra)
+
+    @keyword("Register JSON Schema")
+    def register_json_schema(self, schema: Union[str, Dict], schema_id: Optional[str] = None) -> str:
+        """
+        Registers a schema given as a dictionary, a JSON string or a file path.
+
+        Args:
+            schema: The schema
+            schema_id: Id of the schema (default: its `$id`)
+
+        Returns:
+            The id of the schema
+
+        Examples:
+            | ${id}= | Register JSON Schema | ${CURDIR}/schemas/discount.json |
+        """
+        if isinstance(schema, str):
+            try:
+                if os.path.isfile(schema):
+                    with open(schema, 'r', encoding='utf-8') as schema_file:
+                        schema = json.load(schema_file)
+                else:
+                    schema = json.loads(schema)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid schema JSON: {str(e)}")
+        return self.registry.add(schema, schema_id)
+
+    @keyword("Validate JSON Against Schema")
+    def validate_json_against_schema(self, document: Any, schema_id: str) -> None:
+        """
+        Fails when a document does not match a schema.
+
+        Args:
+            document: Dictionary, list or JSON string
+            schema_id: Id of the schema, e.g. `ebay/refund-request`
+
+        Examples:
+            | Validate JSON Against Schema | ${REFUND_PAYLOAD} | ebay/refund-request |
+        """
+        errors = self.registry.errors(self._parse(document), schema_id)
+        if errors:
+            raise AssertionError(f"Document does not match schema '{schema_id}':\n" + '\n'.join(errors))
+
+    @keyword("Validate Response Against Schema")
+    def validate_response_against_schema(self, response, schema_id: str) -> Any:
+        """
+        Fails when the JSON body of a response does not match a schema.
+
+        Works with the responses of RequestsLibrary and of `EbayFulfillmentLibrary`.
+
+        Args:
+            response: The response
+            schema_id: Id of the schema, e.g. `ebay/order` or `ebay/orders-page`
+
+        Returns:
+            The decoded body
+
+        Examples:
+            | ${response}= | Get Orders | limit=200 |
+            | ${page}= | Validate Response Against Schema | ${response} | ebay/orders-page |
+        """
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise AssertionError(f"Response body is not JSON: {str(e)}")
+        self.validate_json_against_schema(body, schema_id)
+        return body
+
+    @keyword("Validate Documents Against Schema")
+    def validate_documents_against_schema(self, documents: Any, schema_id: str,
+                                          fail_fast: bool = False, workers: int = 0,
+                                          max_errors: int = MAX_ERRORS) -> int:
+        """
+        Fails when any document of a list does not match a schema.
+
+        Meant for the results of `Retrieve All MongoDB Records`, `Retrieve Some
+        MongoDB Records` (as a list or a JSON string) and `Get All Orders`.
+
+        Args:
+            documents: List of documents or JSON array
+            schema_id: Id of the schema, e.g. `fakestore/products`
+            fail_fast: Stop at the first invalid document
+            workers: Worker processes for very large lists (0 = no pool)
+            max_errors: Errors reported per document
+
+        Returns:
+            Number of documents validated
+
+        Examples:
+            | ${products}= | Retrieve All MongoDB Records | ${DATABASE_NAME} | products |
+            | Validate Documents Against Schema | ${products} | fakestore/products |
+            | ${orders}= | Get All Orders |
+            | Validate Documents Against Schema | ${orders} | ebay/order | workers=4 |
+        """
+        documents = self._parse_list(documents)
+        invalid = self.registry.validate_many(documents, schema_id, fail_fast, int(workers),
+                                              max_errors=int(max_errors))
+        if invalid:
+            lines = [f"{len(invalid)} of {len(documents)} document(s) do not match schema '{schema_id}'"
+                     if not fail_fast else f"Document does not match schema '{schema_id}'"]
+            for index, errors in invalid[:MAX_REPORTED_DOCUMENTS]:
+                lines.append(f"[{index}] {self._document_id(documents[index])}: " + '; '.join(errors))
+            raise AssertionError('\n'.join(lines))
+        logger.info(f"{len(documents)} document(s) match schema '{schema_id}'")
+        return len(documents)
+
+    @keyword("Get Schema Validation Errors")
+    def get_schema_validation_errors(self, documents: Any, schema_id: str, workers: int = 0,
+                                     max_errors: int = MAX_ERRORS) -> List[Dict]:
+        """
+        Returns the invalid documents of a list instead of failing.
+
+        Args:
+            documents: Document, list of documents or JSON string
+            schema_id: Id of the schema
+            workers: Worker processes for very large lists (0 = no pool)
+            max_errors: Errors reported per document
+
+        Returns:
+            One dictionary per invalid document: index, _id and errors
+
+        Examples:
+            | ${errors}= | Get Schema Validation Errors | ${product_data} | fakestore/products |
+            | Should Not Be Empty | ${errors} |
+        """
+        documents = self._parse(documents)
+        if not isinstance(documents, (list, tuple)):
+            documents = [documents]
+        invalid = self.registry.validate_many(list(documents), schema_id, workers=int(workers),
+                                              max_errors=int(max_errors))
+        return [{'index': index, '_id': self._document_id(documents[index]), 'errors': errors}
+                for index, errors in invalid]
+
+    # Helper methods
+
+    def close(self) -> None:
+        """Stops the worker processes when the library goes out of scope."""
+        self.registry.close()
+
+    @staticmethod
+    def _parse(document: Any) -> Any:
+        if isinstance(document, str):
+            try:
+                return json.loads(document)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid document JSON: {str(e)}")
+        return document
+
+    def _parse_list(self, documents: Any) -> List[Any]:
+        documents = self._parse(documents)
+        if not isinstance(documents, (list, tuple)):
+            raise ValueError("Expected a list of documents")
+        return list(documents)
+
+    @staticmethod
+    def _document_id(document: Any) -> Optional[str]:
+        if isinstance(document, Mapping):
+            for field in ('_id', 'orderId', 'refundId'):
+                if field in document:
+                    return str(document[field])
+        return None